@@ -0,0 +1,50 @@
+import re
+
+import xxhash
+
+# Сокращения приводим к полной форме, чтобы "ул." и "улица" давали один ключ
+ABBREVIATIONS = {
+    'ул': 'улица',
+    'пр-т': 'проспект',
+    'пр-кт': 'проспект',
+    'просп': 'проспект',
+    'пр-д': 'проезд',
+    'пер': 'переулок',
+    'пл': 'площадь',
+    'б-р': 'бульвар',
+    'бул': 'бульвар',
+    'ш': 'шоссе',
+    'наб': 'набережная',
+    'мкр': 'микрорайон',
+    'мкр-н': 'микрорайон',
+    'обл': 'область',
+    'р-н': 'район',
+    'д': 'дом',
+    'корп': 'корпус',
+    'к': 'корпус',
+    'стр': 'строение',
+}
+# Слова, которые не меняют адрес: "г. Москва" и "Москва" — одно и то же
+IGNORED_WORDS = {'г', 'город'}
+
+SEPARATORS = re.compile(r'[\s,.;:"«»()]+')
+
+
+def normalize_address(address):
+    words = SEPARATORS.split(address.lower().replace('ё', 'е'))
+    normalized = [
+        ABBREVIATIONS.get(word, word)
+        for word in words
+        if word and word not in IGNORED_WORDS
+    ]
+    return ' '.join(normalized)
+
+
+def get_address_hash(address):
+    """64-битный ключ нормализованного адреса со знаком, под BigIntegerField."""
+    digest = xxhash.xxh64(normalize_address(address).encode()).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def is_same_address(address, other_address):
+    return normalize_address(address) == normalize_address(other_address)
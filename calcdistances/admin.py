@@ -1,3 +1,23 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import GeocodeJob
+
+
+@admin.register(GeocodeJob)
+class GeocodeJobAdmin(admin.ModelAdmin):
+    list_display = [
+        'target',
+        'object_id',
+        'address',
+        'status',
+        'attempts',
+        'created_at',
+        'processed_at',
+    ]
+    list_filter = [
+        'status',
+        'target',
+    ]
+    search_fields = [
+        'address',
+    ]
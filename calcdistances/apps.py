@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CalcdistancesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'calcdistances'
+
+    def ready(self):
+        from calcdistances import signals  # noqa: F401
@@ -0,0 +1,153 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+from calcdistances.addresses import get_address_hash, is_same_address
+from calcdistances.models import PlaceCoord
+
+CachedPlace = namedtuple('CachedPlace', ['place_id', 'address', 'lng', 'lat'])
+
+TIERS = ['local', 'shared', 'db']
+STATS_FLUSH_INTERVAL = 10
+
+
+class GeocodeCache:
+    """Двухуровневый кэш мест: LRU в памяти процесса и общий для всех воркеров файл SQLite."""
+
+    def __init__(self, path, max_size=10000):
+        self.path = path
+        self.max_size = max_size
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+        self.connections = threading.local()
+        self.stats = dict.fromkeys([f'{tier}_hits' for tier in TIERS] + ['misses'], 0)
+        self.unflushed_stats = dict.fromkeys(self.stats, 0)
+        self.flushed_at = time.monotonic()
+
+    def get_connection(self):
+        # Соединение SQLite нельзя переносить между потоками и форкнутыми процессами
+        connection = getattr(self.connections, 'connection', None)
+        if connection is None or self.connections.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS places ('
+                'hash INTEGER PRIMARY KEY, place_id INTEGER, address TEXT, lng REAL, lat REAL)'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)'
+            )
+            self.connections.connection = connection
+            self.connections.pid = os.getpid()
+        return connection
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+            self.unflushed_stats[stat] += 1
+            if time.monotonic() - self.flushed_at < STATS_FLUSH_INTERVAL:
+                return
+            unflushed_stats = self.unflushed_stats
+            self.unflushed_stats = dict.fromkeys(self.stats, 0)
+            self.flushed_at = time.monotonic()
+        self.get_connection().executemany(
+            'INSERT INTO stats (name, value) VALUES (?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+            unflushed_stats.items()
+        )
+
+    def remember_locally(self, address_hash, place):
+        with self.lock:
+            self.local[address_hash] = place
+            self.local.move_to_end(address_hash)
+            if len(self.local) > self.max_size:
+                self.local.popitem(last=False)
+
+    def get(self, address_hash):
+        with self.lock:
+            place = self.local.get(address_hash)
+            if place:
+                self.local.move_to_end(address_hash)
+        if place:
+            self.count('local_hits')
+            return place
+
+        row = self.get_connection().execute(
+            'SELECT place_id, address, lng, lat FROM places WHERE hash = ?', (address_hash,)
+        ).fetchone()
+        if not row:
+            return None
+        place = CachedPlace(*row)
+        self.remember_locally(address_hash, place)
+        self.count('shared_hits')
+        return place
+
+    def set(self, address_hash, place):
+        self.remember_locally(address_hash, place)
+        self.get_connection().execute(
+            'INSERT OR REPLACE INTO places (hash, place_id, address, lng, lat) VALUES (?, ?, ?, ?, ?)',
+            (address_hash, *place)
+        )
+
+    def delete(self, address_hash):
+        with self.lock:
+            self.local.pop(address_hash, None)
+        self.get_connection().execute('DELETE FROM places WHERE hash = ?', (address_hash,))
+
+    def get_stats(self, shared=False):
+        """Счётчики попаданий по уровням: текущего процесса или суммарно по всем воркерам."""
+        if shared:
+            stats = dict.fromkeys(self.stats, 0)
+            stats.update(self.get_connection().execute('SELECT name, value FROM stats'))
+        else:
+            with self.lock:
+                stats = dict(self.stats)
+        lookups = sum(stats.values())
+        for tier in TIERS:
+            stats[f'{tier}_hit_rate'] = stats[f'{tier}_hits'] / lookups if lookups else 0
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_geocode_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None or _cache.path != settings.GEOCODE_CACHE_PATH:
+            _cache = GeocodeCache(settings.GEOCODE_CACHE_PATH, max_size=settings.GEOCODE_CACHE_SIZE)
+        return _cache
+
+
+def to_cached_place(place):
+    return CachedPlace(
+        place.id,
+        place.address,
+        float(place.lng) if place.lng is not None else None,
+        float(place.lat) if place.lat is not None else None,
+    )
+
+
+def find_place(address):
+    """Ищет место по адресу: сначала в кэшах, затем в PlaceCoord. Сеть не трогает."""
+    cache = get_geocode_cache()
+    address_hash = get_address_hash(address)
+    cached_place = cache.get(address_hash)
+    if cached_place and is_same_address(cached_place.address, address):
+        return cached_place
+
+    place = PlaceCoord.objects.find_by_address(address)
+    if not place:
+        cache.count('misses')
+        return None
+    cache.count('db_hits')
+    cached_place = to_cached_place(place)
+    cache.set(address_hash, cached_place)
+    return cached_place
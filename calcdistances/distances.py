@@ -0,0 +1,168 @@
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+
+from calcdistances.geometry import distance_matrix
+from calcdistances.models import PlaceCoord, RestaurantDistance
+from calcdistances.routing import get_router
+from foodcartapp.models import Order, Restaurant
+
+
+def load_coordinates(place_ids, near=None):
+    """Один раз переводит Decimal-координаты мест в массивы: id мест и их (lat, lng) в радианах.
+
+    near — (широты, долготы, км): читать только места в радиусе км от этих точек.
+    """
+    places = PlaceCoord.objects.resolved().filter(pk__in=place_ids)
+    if near:
+        places = places.near_points(*near)
+    places = list(places.values_list('pk', 'lat', 'lng'))
+    ids = np.array([place_id for place_id, lat, lng in places], dtype=np.int64)
+    coords = np.radians(np.array([(lat, lng) for place_id, lat, lng in places], dtype=np.float64).reshape(-1, 2))
+    return ids, coords
+
+
+def get_order_place_ids():
+    return set(
+        Order.objects
+        .exclude(status=Order.Status.COMPLETED)
+        .exclude(place=None)
+        .values_list('place_id', flat=True)
+    )
+
+
+def get_restaurant_place_ids():
+    return set(Restaurant.objects.exclude(place=None).values_list('place_id', flat=True))
+
+
+def load_nearby_coordinates(place_ids, other_place_ids):
+    """Координаты мест и тех мест из other_place_ids, что попадают в радиус доставки от них.
+
+    Сначала читаем меньшую сторону, вторую отбираем по индексу: вокруг одного места — поиском в радиусе,
+    вокруг нескольких — прямоугольниками по группам близких мест, см. PlaceCoordQuerySet.near_points.
+    """
+    radius = settings.DELIVERY_RADIUS_KM
+    ids, coords = load_coordinates(place_ids)
+    if not len(ids) or not radius:
+        return (ids, coords), load_coordinates(other_place_ids)
+    lats, lngs = np.degrees(coords).T.tolist()
+    return (ids, coords), load_coordinates(other_place_ids, (lats, lngs, radius))
+
+
+def save_missing_distances(order_place_ids, restaurant_place_ids):
+    """Досчитывает только отсутствующие пары мест заказов и ресторанов в радиусе доставки."""
+    order_place_ids, restaurant_place_ids = set(order_place_ids), set(restaurant_place_ids)
+    if len(order_place_ids) <= len(restaurant_place_ids):
+        (order_ids, order_coords), (restaurant_ids, restaurant_coords) = load_nearby_coordinates(
+            order_place_ids, restaurant_place_ids
+        )
+    else:
+        (restaurant_ids, restaurant_coords), (order_ids, order_coords) = load_nearby_coordinates(
+            restaurant_place_ids, order_place_ids
+        )
+    if not len(order_ids) or not len(restaurant_ids):
+        return 0
+    existing_pairs = set(
+        RestaurantDistance.objects
+        .filter(order_place__in=order_ids.tolist(), restaurant_place__in=restaurant_ids.tolist())
+        .values_list('order_place_id', 'restaurant_place_id')
+    )
+    distances = distance_matrix(order_coords, restaurant_coords)
+    radius = settings.DELIVERY_RADIUS_KM or np.inf
+    rows = [
+        RestaurantDistance(
+            order_place_id=order_place_id,
+            restaurant_place_id=restaurant_place_id,
+            distance=f'{distance:.2f}'
+        )
+        for order_place_id, row in zip(order_ids.tolist(), distances.tolist())
+        for restaurant_place_id, distance in zip(restaurant_ids.tolist(), row)
+        if distance <= radius and (order_place_id, restaurant_place_id) not in existing_pairs
+    ]
+    RestaurantDistance.objects.bulk_create(rows, ignore_conflicts=True)
+    return len(rows)
+
+
+def save_missing_routes(order_place_ids=None, restaurant_place_ids=None):
+    """Дописывает расстояние и время по дорогам в пары мест, где их ещё нет, если настроен дорожный граф."""
+    router = get_router()
+    if router is None:
+        return 0
+    distances = RestaurantDistance.objects.filter(route_distance__isnull=True)
+    if order_place_ids is not None:
+        distances = distances.filter(order_place__in=order_place_ids)
+    if restaurant_place_ids is not None:
+        distances = distances.filter(restaurant_place__in=restaurant_place_ids)
+    distances = list(distances.only('order_place_id', 'restaurant_place_id'))
+    if not distances:
+        return 0
+    places = PlaceCoord.objects.resolved().in_bulk(
+        {distance.order_place_id for distance in distances}
+        | {distance.restaurant_place_id for distance in distances}
+    )
+    # Курьер едет из ресторана к заказу, поэтому на улицах с односторонним движением важно направление
+    routes = router.get_routes(
+        [
+            (place_id, places[place_id].lat, places[place_id].lng)
+            for place_id in {distance.restaurant_place_id for distance in distances} if place_id in places
+        ],
+        [
+            (place_id, places[place_id].lat, places[place_id].lng)
+            for place_id in {distance.order_place_id for distance in distances} if place_id in places
+        ],
+    )
+    routed = []
+    for distance in distances:
+        route = routes.get((distance.restaurant_place_id, distance.order_place_id))
+        if route is None:
+            continue
+        distance.route_distance = f'{route.km:.2f}'
+        distance.route_duration = round(route.minutes)
+        routed.append(distance)
+    RestaurantDistance.objects.bulk_update(routed, ['route_distance', 'route_duration'], batch_size=1000)
+    return len(routed)
+
+
+def save_place_routes(place_ids):
+    """Маршруты для пар, где место из place_ids — заказ или ресторан.
+
+    Поиск пути по графу долгий, поэтому его вызывают только фоновый обработчик и команды, а не запросы сайта.
+    """
+    place_ids = list(place_ids)
+    if not place_ids:
+        return 0
+    return save_missing_routes(order_place_ids=place_ids) + save_missing_routes(restaurant_place_ids=place_ids)
+
+
+def add_order_places(place_ids):
+    return save_missing_distances(place_ids, get_restaurant_place_ids())
+
+
+def add_restaurant_places(place_ids):
+    return save_missing_distances(get_order_place_ids(), place_ids)
+
+
+def prune_distances():
+    """Удаляет пары мест, которые больше не нужны: заказы выполнены или ресторан удалён."""
+    # place_id IS NULL в подзапросе превратил бы NOT IN в NULL, и ничего бы не удалилось
+    open_order_places = (
+        Order.objects
+        .exclude(status=Order.Status.COMPLETED)
+        .exclude(place=None)
+        .values('place_id')
+    )
+    restaurant_places = Restaurant.objects.exclude(place=None).values('place_id')
+    deleted, _ = RestaurantDistance.objects.filter(
+        ~Q(order_place__in=open_order_places) | ~Q(restaurant_place__in=restaurant_places)
+    ).delete()
+    return deleted
+
+
+def recalculate_places(place_ids):
+    """Пересчитывает расстояния для мест, у которых изменились координаты."""
+    RestaurantDistance.objects.filter(
+        Q(order_place__in=place_ids) | Q(restaurant_place__in=place_ids)
+    ).delete()
+    order_place_ids = get_order_place_ids() & set(place_ids)
+    restaurant_place_ids = get_restaurant_place_ids() & set(place_ids)
+    return add_order_places(order_place_ids) + add_restaurant_places(restaurant_place_ids)
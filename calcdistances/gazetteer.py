@@ -0,0 +1,121 @@
+import csv
+import re
+from array import array
+from collections import defaultdict
+
+from calcdistances.addresses import normalize_address
+
+COUNTRY_WORDS = {'россия'}
+HOUSE_WORDS = {'дом': '', 'корпус': 'к', 'строение': 'с', 'владение': 'вл'}
+# "7", "11с2", "15/3", но не "2-я" из названия улицы
+HOUSE_NUMBER = re.compile(r'^\d+[а-я\d/]*$')
+
+
+def split_house(words):
+    """Отделяет номер дома — хвост из номеров и слов "дом", "корпус", "строение" — от названия улицы."""
+    position = len(words)
+    while position and (HOUSE_NUMBER.match(words[position - 1]) or words[position - 1] in HOUSE_WORDS):
+        position -= 1
+    house_words = words[position:]
+    if not any(HOUSE_NUMBER.match(word) for word in house_words):
+        position, house_words = len(words), []
+    street_words = [word for word in words[:position] if word not in HOUSE_WORDS]
+    house = ''.join(HOUSE_WORDS.get(word, word) for word in house_words)
+    return ' '.join(sorted(street_words)), house
+
+
+def split_address(address, cities=()):
+    """Делит адрес на город, улицу и дом: "Москва, ул. Тверская, 7 стр. 2" -> ("москва", "тверская улица", "7с2").
+
+    Город ищется только среди переданных `cities`; если его нет, первым элементом возвращается None.
+    """
+    words = [word for word in normalize_address(address).split() if word not in COUNTRY_WORDS]
+    for city in cities:
+        city_words = city.split()
+        for position in range(len(words) - len(city_words) + 1):
+            if words[position:position + len(city_words)] == city_words:
+                del words[position:position + len(city_words)]
+                return (city, *split_house(words))
+    return (None, *split_house(words))
+
+
+def get_trigrams(text):
+    padded = f'  {text} '
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+class StreetIndex:
+    """Улицы одного города: номера домов по ключу улицы и триграммы названий для нечёткого поиска."""
+
+    def __init__(self):
+        self.houses = {}
+        self.street_names = []
+        self.street_trigrams = []
+        self.trigram_index = defaultdict(list)
+
+    def add(self, street_key, house_key, index):
+        if street_key not in self.houses:
+            street_id = len(self.street_names)
+            self.houses[street_key] = {}
+            self.street_names.append(street_key)
+            trigrams = get_trigrams(street_key)
+            self.street_trigrams.append(len(trigrams))
+            for trigram in trigrams:
+                self.trigram_index[trigram].append(street_id)
+        self.houses[street_key][house_key] = index
+
+    def find_street(self, street_key, min_similarity):
+        if street_key in self.houses:
+            return street_key
+        trigrams = get_trigrams(street_key)
+        shared = defaultdict(int)
+        for trigram in trigrams:
+            for street_id in self.trigram_index.get(trigram, ()):
+                shared[street_id] += 1
+        best_street, best_similarity = None, min_similarity
+        for street_id, common in shared.items():
+            similarity = common / (len(trigrams) + self.street_trigrams[street_id] - common)
+            if similarity >= best_similarity:
+                best_street, best_similarity = self.street_names[street_id], similarity
+        return best_street
+
+
+class Gazetteer:
+    """Справочник адресов в памяти: точный поиск по городу, улице и дому, нечёткий — по триграммам названия улицы."""
+
+    def __init__(self, min_similarity=0.6):
+        self.min_similarity = min_similarity
+        self.cities = {}
+        self.coords = array('d')
+
+    @classmethod
+    def from_csv(cls, path, **kwargs):
+        """Загружает CSV с колонками city, street, house, lng, lat."""
+        gazetteer = cls(**kwargs)
+        with open(path, encoding='utf-8', newline='') as file:
+            for row in csv.DictReader(file):
+                gazetteer.add(row['city'], row['street'], row['house'], float(row['lng']), float(row['lat']))
+        return gazetteer
+
+    def __len__(self):
+        return len(self.coords) // 2
+
+    def add(self, city, street, house, lng, lat):
+        city_key = normalize_address(city)
+        street_key, house_key = split_house(normalize_address(f'{street} {house}').split())
+        self.cities.setdefault(city_key, StreetIndex()).add(street_key, house_key, len(self))
+        self.coords.extend((lng, lat))
+
+    def lookup(self, address):
+        """Возвращает (lng, lat) или None, если города, улицы или дома нет в справочнике."""
+        city_key, street_key, house_key = split_address(address, self.cities)
+        if city_key is None or not street_key or not house_key:
+            return None
+        streets = self.cities[city_key]
+        street = streets.find_street(street_key, self.min_similarity)
+        if street is None:
+            return None
+        index = streets.houses[street].get(house_key)
+        if index is None:
+            return None
+        return self.coords[2 * index], self.coords[2 * index + 1]
@@ -0,0 +1,232 @@
+import abc
+import json
+import random
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from calcdistances.gazetteer import Gazetteer
+
+
+class GeocoderUnavailable(requests.exceptions.RequestException):
+    """Геокодер недоступен: автомат разомкнут после серии ошибок."""
+
+
+class GeocoderBackend(abc.ABC):
+    @abc.abstractmethod
+    def geocode(self, session, address, timeout):
+        """Возвращает словарь {'lng', 'lat', 'address'} или None, если адрес не найден."""
+
+
+class YandexBackend(GeocoderBackend):
+    base_url = 'https://geocode-maps.yandex.ru/1.x'
+
+    def __init__(self, apikey):
+        self.apikey = apikey
+
+    def geocode(self, session, address, timeout):
+        response = session.get(self.base_url, params={
+            'geocode': address,
+            'apikey': self.apikey,
+            'format': 'json',
+        }, timeout=timeout)
+        response.raise_for_status()
+        found_places = response.json()['response']['GeoObjectCollection']['featureMember']
+
+        if not found_places:
+            return None
+
+        most_relevant = found_places[0]
+        lng, lat = most_relevant['GeoObject']['Point']['pos'].split(" ")
+
+        return {'lng': float(lng), 'lat': float(lat), 'address': address}
+
+
+class FixtureBackend(GeocoderBackend):
+    """Офлайн-геокодер для тестов и нагрузочных прогонов.
+
+    Координаты берутся из JSON-файла вида {"адрес": [lng, lat]}.
+    """
+
+    def __init__(self, places):
+        self.places = places
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding='utf-8') as file:
+            return cls(json.load(file))
+
+    def geocode(self, session, address, timeout):
+        if address not in self.places:
+            return None
+        lng, lat = self.places[address]
+        return {'lng': lng, 'lat': lat, 'address': address}
+
+
+class GazetteerBackend(GeocoderBackend):
+    """Офлайн-геокодер по локальному справочнику улиц и домов."""
+
+    def __init__(self, gazetteer):
+        self.gazetteer = gazetteer
+
+    def geocode(self, session, address, timeout):
+        coords = self.gazetteer.lookup(address)
+        if not coords:
+            return None
+        lng, lat = coords
+        return {'lng': lng, 'lat': lat, 'address': address}
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            # После паузы пропускаем пробный запрос, остальные ждут его результата
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class TokenBucket:
+    """Ограничитель частоты запросов: не больше rate запросов в секунду с пиками до capacity."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Geocoder:
+    retry_statuses = {429, 500, 502, 503, 504}
+    # Неверный или заблокированный ключ API: повтор не поможет, и следующие запросы получат тот же ответ
+    breaker_statuses = {401, 403}
+
+    def __init__(self, backend, local_backend=None, connect_timeout=3.05, read_timeout=10,
+                 retries=2, backoff=0.5, pool_size=10, breaker=None):
+        self.backend = backend
+        self.local_backend = local_backend
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @staticmethod
+    def get_status_code(error):
+        if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+            return error.response.status_code
+        return None
+
+    def is_retryable(self, error):
+        if isinstance(error, requests.exceptions.HTTPError):
+            return self.get_status_code(error) in self.retry_statuses
+        return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+    def geocode_locally(self, address):
+        if not self.local_backend:
+            return None
+        return self.local_backend.geocode(None, address, None)
+
+    def fetch_coordinates(self, address):
+        place = self.geocode_locally(address)
+        if place:
+            return place
+
+        if not self.breaker.allow_request():
+            raise GeocoderUnavailable(f'Геокодер недоступен, запрос "{address}" отклонён')
+
+        for attempt in range(self.retries + 1):
+            try:
+                place = self.backend.geocode(self.session, address, self.timeout)
+            except requests.exceptions.RequestException as error:
+                if not self.is_retryable(error):
+                    if self.get_status_code(error) in self.breaker_statuses:
+                        self.breaker.record_failure()
+                    raise
+                if attempt == self.retries:
+                    self.breaker.record_failure()
+                    raise
+                time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+            else:
+                self.breaker.record_success()
+                return place
+
+
+def create_backend():
+    if settings.GEOCODER_BACKEND == 'fixture':
+        return FixtureBackend.from_file(settings.GEOCODER_FIXTURE_PATH)
+    return YandexBackend(apikey=settings.YANDEX_GEO_TOKEN)
+
+
+def create_local_backend():
+    if not settings.GEOCODER_GAZETTEER_PATH:
+        return None
+    return GazetteerBackend(Gazetteer.from_csv(settings.GEOCODER_GAZETTEER_PATH))
+
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+
+
+def get_geocoder():
+    global _geocoder
+    with _geocoder_lock:
+        if _geocoder is None:
+            _geocoder = Geocoder(
+                backend=create_backend(),
+                local_backend=create_local_backend(),
+                connect_timeout=settings.GEOCODER_CONNECT_TIMEOUT,
+                read_timeout=settings.GEOCODER_READ_TIMEOUT,
+                retries=settings.GEOCODER_RETRIES,
+            )
+        return _geocoder
+
+
+def fetch_coordinates(address):
+    return get_geocoder().fetch_coordinates(address)
+
+
+def geocode_locally(address):
+    """Ищет координаты только в локальном справочнике, без обращения к сети."""
+    return get_geocoder().geocode_locally(address)
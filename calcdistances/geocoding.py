@@ -0,0 +1,210 @@
+import logging
+from datetime import timedelta
+
+import requests
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Q
+from django.utils import timezone
+
+from calcdistances.addresses import get_address_hash, is_same_address
+from calcdistances.cache import find_place
+from calcdistances.distances import add_order_places, add_restaurant_places, recalculate_places, save_place_routes
+from calcdistances.geocoder import fetch_coordinates
+from calcdistances.locks import SingleFlight, advisory_lock
+from calcdistances.models import PlaceCoord, GeocodeJob, get_retry_backoff
+from foodcartapp.models import Order, Restaurant
+
+logger = logging.getLogger(__name__)
+
+MAX_JOB_ATTEMPTS = 5
+STUCK_JOB_TIMEOUT = timedelta(minutes=10)
+
+geocode_flight = SingleFlight()
+
+
+class AddressCollision(Exception):
+    """Ключ адреса совпал с ключом другого адреса, и место к объекту не привязать."""
+
+
+def enqueue_geocode_job(target, object_id, address):
+    GeocodeJob.objects.bulk_create(
+        [GeocodeJob(target=target, object_id=object_id, address=address)],
+        ignore_conflicts=True
+    )
+
+
+def enqueue_stale_places():
+    """Ставит в очередь незавершённые заказы, у которых ещё нет PlaceCoord.
+
+    Заказы со сменившимся адресом и рестораны сюда не входят: они ставятся в очередь при сохранении.
+    Заказ, задачи которого по тому же адресу завершились ошибкой, повторяется с растущей паузой.
+    """
+    orders = (
+        Order.objects
+        .filter(place__isnull=True)
+        .exclude(status=Order.Status.COMPLETED)
+    )
+    addresses = dict(orders.values_list('pk', 'address'))
+    failed_jobs = (
+        GeocodeJob.objects
+        .filter(target=GeocodeJob.Target.ORDER, object_id__in=orders.values('pk'), status=GeocodeJob.Status.FAILED)
+        .values_list('object_id', 'address')
+        .annotate(failures=Count('pk'), failed_at=Max('processed_at'))
+    )
+    now = timezone.now()
+    for order_id, address, failures, failed_at in failed_jobs:
+        if addresses.get(order_id) == address and failed_at and failed_at + get_retry_backoff(failures) > now:
+            del addresses[order_id]
+    jobs = [
+        GeocodeJob(target=GeocodeJob.Target.ORDER, object_id=order_id, address=address)
+        for order_id, address in addresses.items()
+    ]
+    GeocodeJob.objects.bulk_create(jobs, ignore_conflicts=True)
+    return len(jobs)
+
+
+def enqueue_expired_places():
+    """Ставит в очередь обновление устаревших координат и повтор для ненайденных адресов."""
+    places = (
+        (PlaceCoord.objects.expired() | PlaceCoord.objects.due_for_retry())
+        .filter(
+            Q(pk__in=Order.objects.exclude(status=Order.Status.COMPLETED).values('place_id'))
+            | Q(pk__in=Restaurant.objects.values('place_id'))
+        )
+        .values_list('pk', 'address')
+    )
+    jobs = [
+        GeocodeJob(target=GeocodeJob.Target.PLACE, object_id=place_id, address=address)
+        for place_id, address in places
+    ]
+    GeocodeJob.objects.bulk_create(jobs, ignore_conflicts=True)
+    return len(jobs)
+
+
+def claim_geocode_jobs(limit):
+    # Возвращаем в очередь задачи, которые зависли у упавшего обработчика:
+    GeocodeJob.objects.filter(
+        status=GeocodeJob.Status.PROCESSING,
+        processed_at__lt=timezone.now() - STUCK_JOB_TIMEOUT
+    ).update(status=GeocodeJob.Status.NEW)
+
+    with transaction.atomic():
+        jobs = list(
+            GeocodeJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=GeocodeJob.Status.NEW)
+            .order_by('created_at')[:limit]
+        )
+        GeocodeJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            status=GeocodeJob.Status.PROCESSING,
+            processed_at=timezone.now(),
+            attempts=F('attempts') + 1,
+        )
+    for job in jobs:
+        job.attempts += 1
+    return jobs
+
+
+def create_place(address, coords):
+    place = PlaceCoord(address=address, hash=get_address_hash(address))
+    place.set_coordinates(coords)
+    try:
+        with transaction.atomic():
+            place.save()
+    except IntegrityError:
+        place = PlaceCoord.objects.get(hash=place.hash)
+    return place
+
+
+def fetch_place_exclusively(address, address_hash):
+    with advisory_lock(address_hash):
+        # Пока ждали блокировку, адрес мог геокодировать другой процесс
+        place = PlaceCoord.objects.filter(hash=address_hash).first()
+        if not place:
+            place = create_place(address, fetch_coordinates(address))
+    if not is_same_address(place.address, address):
+        raise AddressCollision(f'Коллизия ключей адресов "{place.address}" и "{address}"')
+    return place.id
+
+
+def get_or_fetch_place(address):
+    cached_place = find_place(address)
+    if cached_place:
+        return cached_place.place_id
+    address_hash = get_address_hash(address)
+    return geocode_flight.do(address_hash, fetch_place_exclusively, address, address_hash)
+
+
+def refresh_place_exclusively(place_id, refresh_started_at):
+    place = PlaceCoord.objects.filter(pk=place_id).first()
+    if not place:
+        return
+    with advisory_lock(place.hash):
+        place.refresh_from_db()
+        if place.request_at > refresh_started_at:
+            return
+        old_coordinates = (place.lat, place.lng)
+        place.set_coordinates(fetch_coordinates(place.address))
+        place.save()
+    place.refresh_from_db(fields=['lat', 'lng'])
+    if (place.lat, place.lng) != old_coordinates:
+        recalculate_places([place.id])
+        save_place_routes([place.id])
+
+
+def postpone_refresh(place_id):
+    """Откладывает обновление места, которое не удалось геокодировать из-за сетевых ошибок."""
+    place = PlaceCoord.objects.filter(pk=place_id).first()
+    if place:
+        place.postpone_retry()
+        place.save(update_fields=['failed_attempts', 'retry_at'])
+
+
+def refresh_place(place_id):
+    geocode_flight.do(('refresh', place_id), refresh_place_exclusively, place_id, timezone.now())
+
+
+def resolve_geocode_job(job):
+    if job.target == GeocodeJob.Target.PLACE:
+        refresh_place(job.object_id)
+        return
+    place_id = get_or_fetch_place(job.address)
+    # Адрес мог измениться, пока задача ждала в очереди, тогда её догонит следующая задача:
+    if job.target == GeocodeJob.Target.ORDER:
+        if Order.objects.filter(pk=job.object_id, address=job.address).update(place_id=place_id):
+            add_order_places([place_id])
+            save_place_routes([place_id])
+    elif Restaurant.objects.filter(pk=job.object_id, address=job.address).update(place_id=place_id):
+        add_restaurant_places([place_id])
+        save_place_routes([place_id])
+
+
+def process_geocode_jobs(limit=50):
+    processed = 0
+    for job in claim_geocode_jobs(limit):
+        try:
+            resolve_geocode_job(job)
+        except requests.exceptions.RequestException as error:
+            logger.warning('Ошибка получения данных для "%s": %s', job.address, error)
+            job.status = (
+                GeocodeJob.Status.FAILED
+                if job.attempts >= MAX_JOB_ATTEMPTS
+                else GeocodeJob.Status.NEW
+            )
+            # Иначе следующий проход сразу поставил бы место в очередь снова
+            if job.status == GeocodeJob.Status.FAILED and job.target == GeocodeJob.Target.PLACE:
+                postpone_refresh(job.object_id)
+        except AddressCollision as error:
+            # Повтор даст ту же коллизию, поэтому задача сразу завершается ошибкой
+            logger.error('%s', error)
+            job.status = GeocodeJob.Status.FAILED
+        except Exception:
+            # Ошибка в данных или в базе не должна останавливать обработчик и оставлять задачи зависшими
+            logger.exception('Не удалось обработать задачу геокодирования "%s"', job.address)
+            job.status = GeocodeJob.Status.FAILED
+        else:
+            job.status = GeocodeJob.Status.DONE
+            processed += 1
+        job.processed_at = timezone.now()
+        job.save(update_fields=['status', 'processed_at'])
+    return processed
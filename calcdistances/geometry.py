@@ -0,0 +1,181 @@
+from collections import defaultdict
+from math import asin, cos, floor, pi, radians, sin, sqrt
+
+import numpy as np
+from django.db import connections
+from django.db.models import BooleanField, F, FloatField, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import ASin, Cast, Cos, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371
+KM_PER_DEGREE = EARTH_RADIUS_KM * pi / 180
+MATRIX_BLOCK_ROWS = 2048
+
+PLACE_TABLE = 'calcdistances_placecoord'
+# Тип колонки location: geography при установленном PostGIS, иначе встроенный point
+POSTGIS, POINT = 'geography', 'point'
+
+_location_types = {}
+
+
+def get_location_type(using='default'):
+    """Тип колонки с точкой места или None, если её нет: другая СУБД или миграция не применена."""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    key = (using, connection.settings_dict['NAME'])
+    if key not in _location_types:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT udt_name FROM information_schema.columns WHERE table_name = %s AND column_name = %s',
+                [PLACE_TABLE, 'location']
+            )
+            row = cursor.fetchone()
+        _location_types[key] = row[0] if row else None
+    return _location_types[key]
+
+
+def calculate_distance(lat1, lng1, lat2, lng2):
+    """Расстояние между двумя точками в км по формуле гаверсинусов, координаты в градусах."""
+    lat1, lng1, lat2, lng2 = map(radians, (lat1, lng1, lat2, lng2))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(sqrt(a))
+
+
+def distance_matrix(order_coords, restaurant_coords):
+    """Расстояния по формуле гаверсинусов, км: строки — заказы, столбцы — рестораны, координаты в радианах.
+
+    Подходит для любых двух групп точек, например одной точки заказа и ресторанов вокруг неё.
+    """
+    restaurant_lat = restaurant_coords[:, 0]
+    restaurant_lng = restaurant_coords[:, 1]
+    cos_restaurant_lat = np.cos(restaurant_lat)
+    distances = np.empty((len(order_coords), len(restaurant_coords)), dtype=np.float64)
+    # Считаем блоками, чтобы промежуточные массивы не раздували память на больших матрицах
+    for start in range(0, len(order_coords), MATRIX_BLOCK_ROWS):
+        block = order_coords[start:start + MATRIX_BLOCK_ROWS]
+        order_lat = block[:, 0, np.newaxis]
+        order_lng = block[:, 1, np.newaxis]
+        a = (
+            np.sin((restaurant_lat - order_lat) / 2) ** 2
+            + np.cos(order_lat) * cos_restaurant_lat * np.sin((restaurant_lng - order_lng) / 2) ** 2
+        )
+        distances[start:start + len(block)] = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+    return distances
+
+
+def get_coords_array(points):
+    """Массив (lat, lng) в радианах для distance_matrix из точек в градусах."""
+    return np.radians(np.array(points, dtype=np.float64).reshape(-1, 2))
+
+
+def get_points_bounding_box(lats, lngs, km):
+    """Прямоугольник (min_lat, min_lng, max_lat, max_lng), который покрывает окрестности радиусом km всех точек."""
+    delta_lat = km / KM_PER_DEGREE
+    max_abs_lat = min(89.9, max(map(abs, lats)) + delta_lat)
+    delta_lng = min(180, delta_lat / cos(radians(max_abs_lat)))
+    return min(lats) - delta_lat, min(lngs) - delta_lng, max(lats) + delta_lat, max(lngs) + delta_lng
+
+
+def get_points_bounding_boxes(lats, lngs, km):
+    """Прямоугольники, которые покрывают окрестности радиусом km всех точек, по одному на группу близких точек.
+
+    Точки группируются по ячейкам сетки со стороной km, так что пустое пространство между далёкими
+    точками, в отличие от get_points_bounding_box, в прямоугольники не попадает.
+    """
+    cell_deg = km / KM_PER_DEGREE
+    groups = defaultdict(lambda: ([], []))
+    for lat, lng in zip(lats, lngs):
+        group_lats, group_lngs = groups[floor(lat / cell_deg), floor(lng / cell_deg)]
+        group_lats.append(lat)
+        group_lngs.append(lng)
+    return [get_points_bounding_box(group_lats, group_lngs, km) for group_lats, group_lngs in groups.values()]
+
+
+def distance_expression(lat, lng, prefix=''):
+    """Расстояние в км от точки до места по формуле гаверсинусов, считается в базе."""
+    place_lat = Radians(Cast(F(f'{prefix}lat'), FloatField()))
+    place_lng = Radians(Cast(F(f'{prefix}lng'), FloatField()))
+    lat, lng = radians(lat), radians(lng)
+    a = (
+        Power(Sin((place_lat - lat) / 2), 2)
+        + Cos(place_lat) * cos(lat) * Power(Sin((place_lng - lng) / 2), 2)
+    )
+    return 2 * EARTH_RADIUS_KM * ASin(Sqrt(a))
+
+
+def location_condition(sql, params):
+    return RawSQL(sql, params, output_field=BooleanField())
+
+
+def location_within_box(location_type, min_lat, min_lng, max_lat, max_lng):
+    """Условие "место в прямоугольнике", которое Postgres проверяет по GiST-индексу колонки location.
+
+    Для geography прямоугольник сравнивается по охватывающему его геодезическому, то есть с запасом.
+    """
+    if location_type == POSTGIS:
+        return location_condition(
+            f'"{PLACE_TABLE}"."location" && ST_MakeEnvelope(%s, %s, %s, %s, 4326)::geography',
+            [min_lng, min_lat, max_lng, max_lat]
+        )
+    return location_condition(
+        f'"{PLACE_TABLE}"."location" <@ box(point(%s, %s), point(%s, %s))',
+        [min_lng, min_lat, max_lng, max_lat]
+    )
+
+
+def location_within_km(location_type, lat, lng, km):
+    """Условие "место в радиусе km" по GiST-индексу колонки location."""
+    if location_type == POSTGIS:
+        # Радиус сферы в PostGIS чуть больше нашего, поэтому отбираем с запасом
+        return location_condition(
+            f'ST_DWithin("{PLACE_TABLE}"."location", ST_MakePoint(%s, %s)::geography, %s, false)',
+            [lng, lat, km * 1001]
+        )
+    return location_within_box(location_type, *get_points_bounding_box([lat], [lng], km))
+
+
+def filter_within_boxes(queryset, boxes, prefix=''):
+    """Оставляет места, попавшие хотя бы в один из прямоугольников (min_lat, min_lng, max_lat, max_lng).
+
+    С колонкой location прямоугольники проверяются по её GiST-индексу, иначе — по индексу (lat, lng).
+    """
+    location_type = get_location_type(queryset.db)
+    condition = Q()
+    for min_lat, min_lng, max_lat, max_lng in boxes:
+        if location_type:
+            condition |= Q(location_within_box(location_type, min_lat, min_lng, max_lat, max_lng))
+        else:
+            condition |= Q(**{
+                f'{prefix}lat__range': (min_lat, max_lat),
+                f'{prefix}lng__range': (min_lng, max_lng),
+            })
+    return queryset.filter(condition)
+
+
+def filter_within_km(queryset, lat, lng, km, prefix=''):
+    """Оставляет места в радиусе km и добавляет к ним расстояние distance.
+
+    prefix — путь до PlaceCoord, например "place__" для ресторанов.
+    """
+    queryset = queryset.filter(**{f'{prefix}lat__isnull': False, f'{prefix}lng__isnull': False})
+    location_type = get_location_type(queryset.db)
+    if location_type:
+        queryset = queryset.filter(location_within_km(location_type, lat, lng, km))
+    else:
+        queryset = filter_within_boxes(queryset, [get_points_bounding_box([lat], [lng], km)], prefix)
+    return queryset.annotate(distance=distance_expression(lat, lng, prefix)).filter(distance__lte=km)
+
+
+def order_by_distance(queryset, lat, lng, prefix=''):
+    """Сортирует места от ближних к дальним, места без координат — в конце; с PostGIS — KNN-поиском по индексу."""
+    if 'distance' not in queryset.query.annotations:
+        queryset = queryset.annotate(distance=distance_expression(lat, lng, prefix))
+    if get_location_type(queryset.db) == POSTGIS:
+        return queryset.order_by(
+            RawSQL(
+                f'"{PLACE_TABLE}"."location" <-> ST_MakePoint(%s, %s)::geography', [lng, lat], output_field=FloatField()
+            ).asc(nulls_last=True),
+            'pk',
+        )
+    return queryset.order_by(F('distance').asc(nulls_last=True), 'pk')
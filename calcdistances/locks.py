@@ -0,0 +1,50 @@
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+class SingleFlight:
+    """Склеивает одновременные вызовы с одним ключом: функция выполняется один раз, остальные ждут её результат."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        with self.lock:
+            call = self.calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self.calls[key] = Future()
+        if not is_leader:
+            return call.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as error:
+            call.set_exception(error)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+
+@contextmanager
+def advisory_lock(key):
+    """Блокировка Postgres по 64-битному ключу, общая для всех процессов. На других СУБД ничего не делает."""
+    if connection.vendor != 'postgresql':
+        yield
+        return
+    # Блокировка сессионная, а не транзакционная: транзакцию на время сетевого запроса не держим
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_lock(%s)', [key])
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s)', [key])
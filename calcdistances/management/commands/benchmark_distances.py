@@ -0,0 +1,63 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from calcdistances.geometry import distance_matrix
+
+# Та же формула, что считалась в get_data_orders до появления RestaurantDistance
+SQL_DISTANCES = '''
+    SELECT count(*), max(dist) FROM (
+        SELECT round((acos(sind(o.lat)*sind(r.lat)
+                     +cosd(o.lat)*cosd(r.lat)*cosd(o.lng-r.lng))*6371)::numeric, 2) as dist
+        FROM unnest(%s::float8[], %s::float8[]) as o(lat, lng)
+        CROSS JOIN unnest(%s::float8[], %s::float8[]) as r(lat, lng)
+    ) as distances
+'''
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает скорость расчёта матрицы расстояний в NumPy и SQL-выражением с acos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=10000)
+        parser.add_argument('--restaurants', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        generator = np.random.default_rng(options['seed'])
+        # Случайные точки в пределах Москвы
+        orders = np.column_stack([
+            generator.uniform(55.55, 55.95, options['orders']),
+            generator.uniform(37.35, 37.85, options['orders']),
+        ])
+        restaurants = np.column_stack([
+            generator.uniform(55.55, 55.95, options['restaurants']),
+            generator.uniform(37.35, 37.85, options['restaurants']),
+        ])
+        pairs = len(orders) * len(restaurants)
+
+        started_at = time.perf_counter()
+        distances = distance_matrix(np.radians(orders), np.radians(restaurants))
+        numpy_seconds = time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(SQL_DISTANCES, [
+                orders[:, 0].tolist(), orders[:, 1].tolist(),
+                restaurants[:, 0].tolist(), restaurants[:, 1].tolist(),
+            ])
+            sql_pairs, sql_max_distance = cursor.fetchone()
+        sql_seconds = time.perf_counter() - started_at
+
+        self.stdout.write(f'{len(orders)} заказов × {len(restaurants)} ресторанов = {pairs} пар')
+        self.stdout.write(
+            f'NumPy: {numpy_seconds:.3f} с ({pairs / numpy_seconds / 1e6:.1f} млн пар/с), '
+            f'максимум {distances.max():.2f} км'
+        )
+        self.stdout.write(
+            f'SQL:   {sql_seconds:.3f} с ({sql_pairs / sql_seconds / 1e6:.1f} млн пар/с), '
+            f'максимум {sql_max_distance} км'
+        )
+        self.stdout.write(f'NumPy быстрее в {sql_seconds / numpy_seconds:.1f} раз')
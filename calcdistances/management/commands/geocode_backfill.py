@@ -0,0 +1,129 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from calcdistances.addresses import get_address_hash, is_same_address
+from calcdistances.cache import get_geocode_cache, to_cached_place
+from calcdistances.distances import add_order_places, add_restaurant_places, recalculate_places, save_place_routes
+from calcdistances.geocoder import TokenBucket, fetch_coordinates
+from calcdistances.models import PlaceCoord
+from foodcartapp.models import DashboardVersion, Order, Restaurant
+
+
+def collect_stale_addresses():
+    """Группирует заказы и рестораны без актуальных координат по ключу адреса."""
+    addresses = {}
+    for model in (Order, Restaurant):
+        objects = model.objects.exclude(address='').select_related('place')
+        for obj in objects.only('address', 'place'):
+            address_hash = get_address_hash(obj.address)
+            place = obj.place
+            if place and place.hash == address_hash and not place.needs_refresh():
+                continue
+            item = addresses.setdefault(address_hash, {'address': obj.address, Order: [], Restaurant: []})
+            item[model].append(obj)
+    return addresses
+
+
+class Command(BaseCommand):
+    help = 'Геокодирует адреса всех заказов и ресторанов без координат или с устаревшими координатами'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='число параллельных запросов к геокодеру')
+        parser.add_argument('--rate', type=float, default=settings.GEOCODER_RATE_LIMIT,
+                            help='не больше запросов к геокодеру в секунду')
+        parser.add_argument('--chunk', type=int, default=200, help='адресов в одной транзакции')
+
+    def handle(self, *args, **options):
+        addresses = collect_stale_addresses()
+        total = len(addresses)
+        self.stdout.write(f'Адресов для геокодирования: {total}')
+
+        bucket = TokenBucket(options['rate'])
+        started_at = time.monotonic()
+        done = failed = 0
+        address_hashes = list(addresses)
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for start in range(0, total, options['chunk']):
+                chunk = {
+                    address_hash: addresses[address_hash]
+                    for address_hash in address_hashes[start:start + options['chunk']]
+                }
+                failed += self.process_chunk(chunk, bucket, executor)
+                done += len(chunk)
+                elapsed = time.monotonic() - started_at
+                self.stdout.write(
+                    f'Обработано {done}/{total} адресов, ошибок {failed}, {done / elapsed:.1f} адр/с'
+                )
+
+    def process_chunk(self, chunk, bucket, executor):
+        known_places = {
+            place.hash: place
+            for place in PlaceCoord.objects.filter(hash__in=chunk)
+        }
+        to_fetch = [
+            address_hash for address_hash, item in chunk.items()
+            if address_hash not in known_places or known_places[address_hash].needs_refresh()
+        ]
+
+        def fetch(address_hash):
+            bucket.acquire()
+            try:
+                return address_hash, fetch_coordinates(chunk[address_hash]['address']), None
+            except requests.exceptions.RequestException as error:
+                return address_hash, None, error
+
+        new_places, updated_places, errors = [], [], 0
+        for address_hash, coords, error in executor.map(fetch, to_fetch):
+            if error:
+                # Адрес останется без координат и попадёт в следующий запуск
+                errors += 1
+                self.stderr.write(f'Ошибка геокодирования "{chunk[address_hash]["address"]}": {error}')
+                del chunk[address_hash]
+                continue
+            place = known_places.get(address_hash) or PlaceCoord(
+                hash=address_hash,
+                address=chunk[address_hash]['address']
+            )
+            place.set_coordinates(coords)
+            (updated_places if place.pk else new_places).append(place)
+
+        with transaction.atomic():
+            PlaceCoord.objects.bulk_create(new_places, ignore_conflicts=True)
+            PlaceCoord.objects.bulk_update(
+                updated_places,
+                ['lng', 'lat', 'request_at', 'failed_attempts', 'retry_at']
+            )
+            # Ресторан переехал — страница заказов перестраивается целиком, см. foodcartapp.signals.reset_dashboard
+            if Restaurant.objects.filter(place__in=[place.pk for place in updated_places]).exists():
+                DashboardVersion.objects.bump(reset=True)
+            places = PlaceCoord.objects.in_bulk(list(chunk), field_name='hash')
+
+            attached_place_ids = {}
+            for model in (Order, Restaurant):
+                objects = []
+                for address_hash, item in chunk.items():
+                    place = places.get(address_hash)
+                    if not place or not is_same_address(place.address, item['address']):
+                        continue
+                    for obj in item[model]:
+                        obj.place = place
+                        objects.append(obj)
+                model.objects.bulk_update(objects, ['place'])
+                attached_place_ids[model] = {obj.place_id for obj in objects}
+
+            recalculate_places([place.id for place in updated_places])
+            add_order_places(attached_place_ids[Order])
+            add_restaurant_places(attached_place_ids[Restaurant])
+            save_place_routes(
+                {place.id for place in updated_places} | attached_place_ids[Order] | attached_place_ids[Restaurant]
+            )
+
+        cache = get_geocode_cache()
+        for place in places.values():
+            cache.set(place.hash, to_cached_place(place))
+        return errors
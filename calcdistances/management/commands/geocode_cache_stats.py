@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from calcdistances.cache import TIERS, get_geocode_cache
+
+
+class Command(BaseCommand):
+    help = 'Статистика попаданий в кэш геокодирования по всем воркерам'
+
+    def handle(self, *args, **options):
+        stats = get_geocode_cache().get_stats(shared=True)
+        for tier in TIERS:
+            self.stdout.write(
+                f'{tier}: {stats[f"{tier}_hits"]} попаданий ({stats[f"{tier}_hit_rate"]:.1%})'
+            )
+        self.stdout.write(f'промахи: {stats["misses"]}')
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from calcdistances.models import PlaceCoord
+
+
+class Command(BaseCommand):
+    help = 'Отчёт об устаревших и ненайденных адресах в кэше координат'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20, help='сколько адресов вывести в каждом списке')
+
+    def handle(self, *args, **options):
+        limit = options['limit']
+        now = timezone.now()
+
+        expired = PlaceCoord.objects.expired().order_by('request_at')
+        self.stdout.write(f'Устаревшие координаты (старше {settings.GEOCODE_TTL_DAYS} дн.): {expired.count()}')
+        for place in expired[:limit]:
+            self.stdout.write(f'  {place.address} — обновлены {place.request_at:%d.%m.%Y %H:%M}')
+
+        failed = PlaceCoord.objects.failed().order_by('-failed_attempts', 'retry_at')
+        due_for_retry = PlaceCoord.objects.due_for_retry().count()
+        self.stdout.write(f'Ненайденные адреса: {failed.count()}, из них ждут повтора сейчас: {due_for_retry}')
+        for place in failed[:limit]:
+            retry = f'повтор {place.retry_at:%d.%m.%Y %H:%M}' if place.retry_at and place.retry_at > now else 'повтор сейчас'
+            self.stdout.write(f'  {place.address or "<пустой адрес>"} — попыток {place.failed_attempts}, {retry}')
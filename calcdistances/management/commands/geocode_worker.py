@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from calcdistances.distances import prune_distances
+from calcdistances.geocoding import enqueue_expired_places, enqueue_stale_places, process_geocode_jobs
+
+
+class Command(BaseCommand):
+    help = 'Фоновое геокодирование адресов заказов и ресторанов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='выполнить один проход и завершиться')
+        parser.add_argument('--interval', type=float, default=5, help='пауза между проходами, сек')
+        parser.add_argument('--batch', type=int, default=50, help='задач за один проход')
+        parser.add_argument(
+            '--prune-interval', type=float, default=3600,
+            help='как часто удалять расстояния для выполненных заказов, сек'
+        )
+
+    def handle(self, *args, **options):
+        pruned_at = None
+        while True:
+            if pruned_at is None or time.monotonic() - pruned_at >= options['prune_interval']:
+                pruned = prune_distances()
+                pruned_at = time.monotonic()
+                if pruned:
+                    self.stdout.write(f'Удалено расстояний: {pruned}')
+            enqueued = enqueue_stale_places() + enqueue_expired_places()
+            processed = process_geocode_jobs(limit=options['batch'])
+            if enqueued or processed:
+                self.stdout.write(f'В очереди: {enqueued}, геокодировано: {processed}')
+            if options['once']:
+                break
+            time.sleep(options['interval'])
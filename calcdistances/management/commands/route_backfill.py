@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from calcdistances.distances import save_missing_routes
+from calcdistances.routing import get_router
+
+
+class Command(BaseCommand):
+    help = 'Считает расстояние и время по дорогам для сохранённых пар мест заказов и ресторанов'
+
+    def handle(self, *args, **options):
+        if get_router() is None:
+            raise CommandError('Дорожный граф не настроен: укажите ROUTING_GRAPH_PATH')
+        routed = save_missing_routes()
+        self.stdout.write(f'Маршрутов сохранено: {routed}')
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.16 on 2026-10-18 03:59
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calcdistances', '0011_alter_placecoord_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodeJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target', models.CharField(choices=[('OR', 'Заказ'), ('RS', 'Ресторан')], max_length=2, verbose_name='объект')),
+                ('object_id', models.PositiveIntegerField(verbose_name='id объекта')),
+                ('address', models.CharField(max_length=255, verbose_name='адрес')),
+                ('status', models.CharField(choices=[('NW', 'Новая'), ('PR', 'Выполняется'), ('OK', 'Выполнена'), ('ER', 'Ошибка')], db_index=True, default='NW', max_length=2, verbose_name='статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='попыток')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='создана')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='обработана')),
+            ],
+            options={
+                'verbose_name': 'задача геокодирования',
+                'verbose_name_plural': 'задачи геокодирования',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='geocodejob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['NW', 'PR'])), fields=('target', 'object_id', 'address'), name='unique_active_geocode_job'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.16 on 2026-10-18 04:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calcdistances', '0012_geocodejob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='placecoord',
+            name='hash',
+            field=models.BigIntegerField(db_index=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,75 @@
+import re
+
+import xxhash
+from django.db import migrations
+
+# Копия нормализации адресов на момент миграции: последующие правки calcdistances.addresses
+# не должны менять то, что делает уже написанная миграция
+ABBREVIATIONS = {
+    'ул': 'улица',
+    'пр-т': 'проспект',
+    'пр-кт': 'проспект',
+    'просп': 'проспект',
+    'пр-д': 'проезд',
+    'пер': 'переулок',
+    'пл': 'площадь',
+    'б-р': 'бульвар',
+    'бул': 'бульвар',
+    'ш': 'шоссе',
+    'наб': 'набережная',
+    'мкр': 'микрорайон',
+    'мкр-н': 'микрорайон',
+    'обл': 'область',
+    'р-н': 'район',
+    'д': 'дом',
+    'корп': 'корпус',
+    'к': 'корпус',
+    'стр': 'строение',
+}
+IGNORED_WORDS = {'г', 'город'}
+
+SEPARATORS = re.compile(r'[\s,.;:"«»()]+')
+
+
+def normalize_address(address):
+    words = SEPARATORS.split(address.lower().replace('ё', 'е'))
+    return ' '.join(ABBREVIATIONS.get(word, word) for word in words if word and word not in IGNORED_WORDS)
+
+
+def get_address_hash(address):
+    digest = xxhash.xxh64(normalize_address(address).encode()).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def rekey_places(apps, schema_editor):
+    PlaceCoord = apps.get_model('calcdistances', 'PlaceCoord')
+    Order = apps.get_model('foodcartapp', 'Order')
+    Restaurant = apps.get_model('foodcartapp', 'Restaurant')
+
+    places_by_hash = {}
+    for place in PlaceCoord.objects.order_by('-request_at'):
+        places_by_hash.setdefault(get_address_hash(place.address), []).append(place)
+
+    for address_hash, places in places_by_hash.items():
+        # Из вариантов одного адреса оставляем самый свежий геокодированный
+        places.sort(key=lambda place: place.lat is None)
+        kept_place, *duplicates = places
+        if duplicates:
+            duplicate_ids = [place.id for place in duplicates]
+            Order.objects.filter(place_id__in=duplicate_ids).update(place=kept_place)
+            Restaurant.objects.filter(place_id__in=duplicate_ids).update(place=kept_place)
+            PlaceCoord.objects.filter(id__in=duplicate_ids).delete()
+        kept_place.hash = address_hash
+        kept_place.save(update_fields=['hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calcdistances', '0013_placecoord_hash_64'),
+        ('foodcartapp', '0055_auto_20221112_1312'),
+    ]
+
+    operations = [
+        migrations.RunPython(rekey_places, migrations.RunPython.noop),
+    ]
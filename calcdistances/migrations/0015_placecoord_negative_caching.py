@@ -0,0 +1,34 @@
+# Generated by Django 3.2.16 on 2026-10-18 04:03
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calcdistances', '0014_rekey_placecoord_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='placecoord',
+            name='failed_attempts',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='неудачных попыток'),
+        ),
+        migrations.AddField(
+            model_name='placecoord',
+            name='retry_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='повторить после'),
+        ),
+        migrations.AlterField(
+            model_name='geocodejob',
+            name='target',
+            field=models.CharField(choices=[('OR', 'Заказ'), ('RS', 'Ресторан'), ('PL', 'Место')], max_length=2, verbose_name='объект'),
+        ),
+        migrations.AlterField(
+            model_name='placecoord',
+            name='request_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='время запроса'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.16 on 2026-10-18 04:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calcdistances', '0015_placecoord_negative_caching'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RestaurantDistance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('distance', models.DecimalField(decimal_places=2, max_digits=8, verbose_name='расстояние, км')),
+                ('order_place', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='restaurant_distances', to='calcdistances.placecoord', verbose_name='место доставки')),
+                ('restaurant_place', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_distances', to='calcdistances.placecoord', verbose_name='место ресторана')),
+            ],
+            options={
+                'verbose_name': 'расстояние до ресторана',
+                'verbose_name_plural': 'расстояния до ресторанов',
+                'unique_together': {('order_place', 'restaurant_place')},
+            },
+        ),
+    ]
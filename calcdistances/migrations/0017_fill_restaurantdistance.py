@@ -0,0 +1,49 @@
+from decimal import Decimal
+from math import asin, cos, radians, sin, sqrt
+
+from django.db import migrations
+
+
+def calculate_distance(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(radians, (lat1, lng1, lat2, lng2))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6371 * asin(sqrt(a))
+
+
+def fill_distances(apps, schema_editor):
+    PlaceCoord = apps.get_model('calcdistances', 'PlaceCoord')
+    RestaurantDistance = apps.get_model('calcdistances', 'RestaurantDistance')
+    Order = apps.get_model('foodcartapp', 'Order')
+    Restaurant = apps.get_model('foodcartapp', 'Restaurant')
+
+    def get_coordinates(place_ids):
+        places = (
+            PlaceCoord.objects
+            .filter(pk__in=place_ids, lat__isnull=False, lng__isnull=False)
+            .values_list('pk', 'lat', 'lng')
+        )
+        return {place_id: (float(lat), float(lng)) for place_id, lat, lng in places}
+
+    order_places = get_coordinates(Order.objects.exclude(status='OK').values('place_id'))
+    restaurant_places = get_coordinates(Restaurant.objects.values('place_id'))
+    RestaurantDistance.objects.bulk_create([
+        RestaurantDistance(
+            order_place_id=order_place_id,
+            restaurant_place_id=restaurant_place_id,
+            distance=Decimal(calculate_distance(*order_coords, *restaurant_coords)).quantize(Decimal('0.01'))
+        )
+        for order_place_id, order_coords in order_places.items()
+        for restaurant_place_id, restaurant_coords in restaurant_places.items()
+    ], ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calcdistances', '0016_restaurantdistance'),
+        ('foodcartapp', '0055_auto_20221112_1312'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_distances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.db import DatabaseError, migrations, transaction
+
+LOCATION_TYPES = {
+    'postgis': ('geography(Point, 4326)', 'ST_SetSRID(ST_MakePoint({lng}, {lat}), 4326)::geography'),
+    'point': ('point', 'point({lng}, {lat})'),
+}
+
+
+def install_postgis(cursor):
+    if not settings.GEOCODE_USE_POSTGIS:
+        return False
+    cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'postgis'")
+    if not cursor.fetchone():
+        return False
+    # Без прав на CREATE EXTENSION остаёмся на встроенном типе point
+    try:
+        with transaction.atomic():
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS postgis')
+    except DatabaseError:
+        return False
+    return True
+
+
+def add_location(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        column_type, location = LOCATION_TYPES['postgis' if install_postgis(cursor) else 'point']
+        cursor.execute(f'ALTER TABLE calcdistances_placecoord ADD COLUMN location {column_type}')
+        # Колонку заполняет триггер: так её не нужно помнить в bulk_update и сырых запросах
+        cursor.execute(f'''
+            CREATE FUNCTION calcdistances_placecoord_set_location() RETURNS trigger AS $$
+            BEGIN
+                IF NEW.lat IS NULL OR NEW.lng IS NULL THEN
+                    NEW.location := NULL;
+                ELSE
+                    NEW.location := {location.format(lng='NEW.lng', lat='NEW.lat')};
+                END IF;
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER calcdistances_placecoord_location
+            BEFORE INSERT OR UPDATE OF lat, lng ON calcdistances_placecoord
+            FOR EACH ROW EXECUTE PROCEDURE calcdistances_placecoord_set_location()
+        ''')
+        cursor.execute(f'''
+            UPDATE calcdistances_placecoord SET location = {location.format(lng='lng', lat='lat')}
+            WHERE lat IS NOT NULL AND lng IS NOT NULL
+        ''')
+        cursor.execute(
+            'CREATE INDEX calcdistances_placecoord_location ON calcdistances_placecoord USING GIST (location)'
+        )
+
+
+def remove_location(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('DROP TRIGGER IF EXISTS calcdistances_placecoord_location ON calcdistances_placecoord')
+        cursor.execute('DROP FUNCTION IF EXISTS calcdistances_placecoord_set_location()')
+        cursor.execute('ALTER TABLE calcdistances_placecoord DROP COLUMN IF EXISTS location')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calcdistances', '0017_fill_restaurantdistance'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_location, remove_location),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.16 on 2026-10-18 04:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calcdistances', '0018_placecoord_location'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='placecoord',
+            index=models.Index(fields=['lat', 'lng'], name='calcdistances_place_lat_lng'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.16 on 2026-10-18 04:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calcdistances', '0019_placecoord_lat_lng_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restaurantdistance',
+            name='route_distance',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True, verbose_name='по дорогам, км'),
+        ),
+        migrations.AddField(
+            model_name='restaurantdistance',
+            name='route_duration',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='в пути, мин'),
+        ),
+    ]
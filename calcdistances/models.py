@@ -1,6 +1,68 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
 from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from calcdistances.addresses import get_address_hash, is_same_address
+from calcdistances.geometry import filter_within_boxes, filter_within_km, get_points_bounding_boxes, order_by_distance
+
+
+def get_retry_backoff(failed_attempts):
+    """Пауза перед повтором после failed_attempts неудач подряд: удваивается, но не больше максимальной."""
+    minutes = min(
+        settings.GEOCODE_RETRY_BACKOFF_MINUTES * 2 ** (failed_attempts - 1),
+        settings.GEOCODE_RETRY_MAX_BACKOFF_MINUTES
+    )
+    return timedelta(minutes=minutes)
+
+
+class PlaceCoordQuerySet(models.QuerySet):
+    def find_by_address(self, address):
+        """Ищет место по ключу адреса и сверяет сам адрес на случай коллизии ключей."""
+        place = self.filter(hash=get_address_hash(address)).first()
+        if place and is_same_address(place.address, address):
+            return place
+        return None
+
+    def resolved(self):
+        return self.filter(lat__isnull=False, lng__isnull=False)
+
+    def failed(self):
+        return self.filter(models.Q(lat__isnull=True) | models.Q(lng__isnull=True))
+
+    def not_postponed(self):
+        return self.filter(models.Q(retry_at__isnull=True) | models.Q(retry_at__lte=timezone.now()))
+
+    def expired(self):
+        ttl = timedelta(days=settings.GEOCODE_TTL_DAYS)
+        return self.resolved().not_postponed().filter(request_at__lt=timezone.now() - ttl)
+
+    def due_for_retry(self):
+        return self.failed().not_postponed()
+
+    def within_box(self, min_lat, min_lng, max_lat, max_lng):
+        return self.filter(lat__range=(min_lat, max_lat), lng__range=(min_lng, max_lng))
+
+    def within_boxes(self, boxes):
+        return filter_within_boxes(self, boxes)
+
+    def within_km(self, lat, lng, km):
+        return filter_within_km(self, lat, lng, km)
+
+    def near_points(self, lats, lngs, km):
+        """Места в радиусе km хотя бы от одной из точек.
+
+        Для одной точки — точный поиск в радиусе, для нескольких — прямоугольники вокруг групп близких точек.
+        """
+        if len(lats) == 1:
+            return self.within_km(lats[0], lngs[0], km)
+        return self.within_boxes(get_points_bounding_boxes(lats, lngs, km))
+
+    def nearest_to(self, lat, lng):
+        return order_by_distance(self, lat, lng)
 
 
 class PlaceCoord(models.Model):
@@ -30,13 +92,159 @@ class PlaceCoord(models.Model):
     )
     request_at = models.DateTimeField(
         verbose_name='время запроса',
-        default=timezone.now
+        default=timezone.now,
+        db_index=True
     )
-    hash = models.PositiveBigIntegerField(
+    hash = models.BigIntegerField(
         unique=True,
         db_index=True,
-        validators=[MaxValueValidator(limit_value=9999999999)]
+    )
+    failed_attempts = models.PositiveSmallIntegerField(
+        verbose_name='неудачных попыток',
+        default=0
+    )
+    retry_at = models.DateTimeField(
+        verbose_name='повторить после',
+        blank=True,
+        null=True,
+        db_index=True
+    )
+
+    objects = PlaceCoordQuerySet.as_manager()
+
+    class Meta:
+        app_label = 'calcdistances'
+        indexes = [
+            # Для отбора мест прямоугольником вокруг точки
+            models.Index(fields=['lat', 'lng'], name='calcdistances_place_lat_lng'),
+        ]
+
+    def needs_refresh(self):
+        now = timezone.now()
+        if self.retry_at is not None and self.retry_at > now:
+            return False
+        if self.lat is None or self.lng is None:
+            return True
+        return self.request_at < now - timedelta(days=settings.GEOCODE_TTL_DAYS)
+
+    def set_coordinates(self, coords):
+        """Сохраняет результат геокодирования, ненайденный адрес запоминает с растущей паузой до повтора.
+
+        Если при обновлении адрес не нашёлся, прежние координаты остаются, откладывается только повтор.
+        """
+        now = timezone.now()
+        if coords:
+            self.request_at = now
+            self.lng, self.lat = coords['lng'], coords['lat']
+            self.failed_attempts = 0
+            self.retry_at = None
+            return
+        if self.lat is None or self.lng is None:
+            self.request_at = now
+        self.postpone_retry(now)
+
+    def postpone_retry(self, now=None):
+        self.failed_attempts += 1
+        self.retry_at = (now or timezone.now()) + get_retry_backoff(self.failed_attempts)
+
+
+class GeocodeJob(models.Model):
+    class Target(models.TextChoices):
+        ORDER = 'OR', _('Заказ')
+        RESTAURANT = 'RS', _('Ресторан')
+        PLACE = 'PL', _('Место')
+
+    class Status(models.TextChoices):
+        NEW = 'NW', _('Новая')
+        PROCESSING = 'PR', _('Выполняется')
+        DONE = 'OK', _('Выполнена')
+        FAILED = 'ER', _('Ошибка')
+
+    target = models.CharField(
+        max_length=2,
+        choices=Target.choices,
+        verbose_name='объект'
+    )
+    object_id = models.PositiveIntegerField(
+        verbose_name='id объекта'
+    )
+    address = models.CharField(
+        max_length=255,
+        verbose_name='адрес'
+    )
+    status = models.CharField(
+        max_length=2,
+        choices=Status.choices,
+        default=Status.NEW,
+        db_index=True,
+        verbose_name='статус'
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name='попыток'
+    )
+    created_at = models.DateTimeField(
+        verbose_name='создана',
+        default=timezone.now,
+        db_index=True
+    )
+    processed_at = models.DateTimeField(
+        verbose_name='обработана',
+        blank=True,
+        null=True
+    )
+
+    class Meta:
+        app_label = 'calcdistances'
+        verbose_name = 'задача геокодирования'
+        verbose_name_plural = 'задачи геокодирования'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['target', 'object_id', 'address'],
+                condition=models.Q(status__in=['NW', 'PR']),
+                name='unique_active_geocode_job'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.get_target_display()} {self.object_id}: {self.address}'
+
+
+class RestaurantDistance(models.Model):
+    order_place = models.ForeignKey(
+        PlaceCoord,
+        related_name='restaurant_distances',
+        on_delete=models.CASCADE,
+        verbose_name='место доставки'
+    )
+    restaurant_place = models.ForeignKey(
+        PlaceCoord,
+        related_name='order_distances',
+        on_delete=models.CASCADE,
+        verbose_name='место ресторана'
+    )
+    distance = models.DecimalField(
+        'расстояние, км',
+        max_digits=8,
+        decimal_places=2,
+    )
+    route_distance = models.DecimalField(
+        'по дорогам, км',
+        max_digits=8,
+        decimal_places=2,
+        blank=True,
+        null=True,
+    )
+    route_duration = models.PositiveIntegerField(
+        'в пути, мин',
+        blank=True,
+        null=True,
     )
 
     class Meta:
         app_label = 'calcdistances'
+        verbose_name = 'расстояние до ресторана'
+        verbose_name_plural = 'расстояния до ресторанов'
+        unique_together = [
+            ['order_place', 'restaurant_place']
+        ]
@@ -0,0 +1,246 @@
+import csv
+import heapq
+import threading
+from collections import OrderedDict, namedtuple
+from math import cos, inf, radians
+
+import numpy as np
+from django.conf import settings
+
+from calcdistances.geometry import calculate_distance
+
+Route = namedtuple('Route', ['km', 'minutes'])
+
+ONEWAY_VALUES = {'1', 'yes', 'true'}
+
+
+def build_adjacency(tails, heads, node_count):
+    """Рёбра в виде смежности: рёбра вершины v — order[offsets[v]:offsets[v + 1]]."""
+    order = np.argsort(tails, kind='stable')
+    offsets = np.searchsorted(tails[order], np.arange(node_count + 1))
+    return offsets.tolist(), order.tolist()
+
+
+class RoadGraph:
+    """Дорожный граф в массивах: координаты вершин и рёбра с длиной в км и временем в минутах.
+
+    Поиск ведётся по времени в пути, длина маршрута считается вдоль найденного пути.
+    """
+
+    def __init__(self, coords, tails, heads, lengths, durations):
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        tails = np.asarray(tails, dtype=np.int64)
+        heads = np.asarray(heads, dtype=np.int64)
+        self.lats, self.lngs = self.coords.T.tolist()
+        self.tails, self.heads = tails.tolist(), heads.tolist()
+        self.lengths = np.asarray(lengths, dtype=np.float64).tolist()
+        self.durations = np.asarray(durations, dtype=np.float64).tolist()
+        self.forward = build_adjacency(tails, heads, len(self))
+        self.backward = build_adjacency(heads, tails, len(self))
+        self.max_speed = max(
+            (length / duration * 60 for length, duration in zip(self.lengths, self.durations) if duration),
+            default=1
+        )
+
+    @classmethod
+    def from_csv(cls, path):
+        """Загружает рёбра из CSV с колонками source, source_lng, source_lat,
+        target, target_lng, target_lat, length_m, speed_kmh, oneway — например, выгрузку из OSM.
+        """
+        nodes = {}
+        coords, tails, heads, lengths, durations = [], [], [], [], []
+
+        def get_node(node_id, lng, lat):
+            if node_id not in nodes:
+                nodes[node_id] = len(coords)
+                coords.append((float(lat), float(lng)))
+            return nodes[node_id]
+
+        with open(path, encoding='utf-8', newline='') as file:
+            for row in csv.DictReader(file):
+                tail = get_node(row['source'], row['source_lng'], row['source_lat'])
+                head = get_node(row['target'], row['target_lng'], row['target_lat'])
+                length = float(row['length_m']) / 1000
+                duration = length / float(row['speed_kmh']) * 60
+                edges = [(tail, head)]
+                if row['oneway'].strip().lower() not in ONEWAY_VALUES:
+                    edges.append((head, tail))
+                for edge_tail, edge_head in edges:
+                    tails.append(edge_tail)
+                    heads.append(edge_head)
+                    lengths.append(length)
+                    durations.append(duration)
+        return cls(coords, tails, heads, lengths, durations)
+
+    def __len__(self):
+        return len(self.coords)
+
+    def nearest_node(self, lat, lng):
+        """Ближайшая к точке вершина и расстояние до неё в км."""
+        delta_lat = self.coords[:, 0] - lat
+        delta_lng = (self.coords[:, 1] - lng) * cos(radians(lat))
+        node = int(np.argmin(delta_lat ** 2 + delta_lng ** 2))
+        return node, calculate_distance(lat, lng, self.lats[node], self.lngs[node])
+
+    def estimate_minutes(self, node, target):
+        """Нижняя оценка времени: по прямой с максимальной скоростью графа."""
+        km = calculate_distance(self.lats[node], self.lngs[node], self.lats[target], self.lngs[target])
+        return km / self.max_speed * 60
+
+    def route(self, source, target):
+        """Самый быстрый путь между двумя вершинами поиском A*: Route или None, если пути нет."""
+        offsets, edges = self.forward
+        durations = {source: 0}
+        lengths = {source: 0}
+        settled = set()
+        heap = [(self.estimate_minutes(source, target), source)]
+        while heap:
+            estimate, node = heapq.heappop(heap)
+            if node == target:
+                return Route(lengths[node], durations[node])
+            if node in settled:
+                continue
+            settled.add(node)
+            for edge in edges[offsets[node]:offsets[node + 1]]:
+                head = self.heads[edge]
+                duration = durations[node] + self.durations[edge]
+                if duration < durations.get(head, inf):
+                    durations[head] = duration
+                    lengths[head] = lengths[node] + self.lengths[edge]
+                    heapq.heappush(heap, (duration + self.estimate_minutes(head, target), head))
+        return None
+
+    def routes(self, source, targets, reverse=False):
+        """Самые быстрые пути от source до каждой из targets алгоритмом Дейкстры.
+
+        С reverse=True ищутся пути от targets до source — по рёбрам в обратную сторону.
+        Поиск останавливается, как только достигнуты все targets.
+        """
+        offsets, edges = self.backward if reverse else self.forward
+        edge_ends = self.tails if reverse else self.heads
+        remaining = set(targets)
+        durations = {source: 0}
+        lengths = {source: 0}
+        found = {}
+        heap = [(0, source)]
+        while heap and remaining:
+            duration, node = heapq.heappop(heap)
+            if node in found:
+                continue
+            found[node] = Route(lengths[node], duration)
+            remaining.discard(node)
+            for edge in edges[offsets[node]:offsets[node + 1]]:
+                end = edge_ends[edge]
+                end_duration = duration + self.durations[edge]
+                if end_duration < durations.get(end, inf):
+                    durations[end] = end_duration
+                    lengths[end] = lengths[node] + self.lengths[edge]
+                    heapq.heappush(heap, (end_duration, end))
+        return {target: found.get(target) for target in targets}
+
+
+class Router:
+    """Маршруты между местами по дорожному графу.
+
+    Место привязывается к ближайшей вершине, путь до неё считается по прямой со скоростью access_speed_kmh.
+    Пути между вершинами кэшируются в LRU, поэтому смена координат места кэш не портит.
+    """
+
+    access_speed_kmh = 20
+
+    def __init__(self, graph, cache_size=100000):
+        self.graph = graph
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_cached(self, key):
+        with self.lock:
+            if key not in self.cache:
+                return False, None
+            self.cache.move_to_end(key)
+            return True, self.cache[key]
+
+    def remember(self, key, route):
+        with self.lock:
+            self.cache[key] = route
+            self.cache.move_to_end(key)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def snap(self, lat, lng):
+        node, km = self.graph.nearest_node(lat, lng)
+        return node, Route(km, km / self.access_speed_kmh * 60)
+
+    def get_node_routes(self, sources, targets):
+        """{(source, target): Route или None} для всех пар вершин.
+
+        Поиск запускаем от меньшей стороны: прямой от sources или обратный от targets.
+        """
+        routes = {}
+        missing = []
+        for pair in {(source, target) for source in sources for target in targets}:
+            is_cached, route = self.get_cached(pair)
+            if is_cached:
+                routes[pair] = route
+            else:
+                missing.append(pair)
+        if not missing:
+            return routes
+        if len(missing) == 1:
+            (source, target), = missing
+            routes[source, target] = self.graph.route(source, target)
+        elif len({source for source, target in missing}) <= len({target for source, target in missing}):
+            for source in {source for source, target in missing}:
+                pair_targets = {target for pair_source, target in missing if pair_source == source}
+                for target, route in self.graph.routes(source, pair_targets).items():
+                    routes[source, target] = route
+        else:
+            for target in {target for source, target in missing}:
+                pair_sources = {source for source, pair_target in missing if pair_target == target}
+                for source, route in self.graph.routes(target, pair_sources, reverse=True).items():
+                    routes[source, target] = route
+        for pair in missing:
+            self.remember(pair, routes[pair])
+        return routes
+
+    def get_routes(self, origins, destinations):
+        """Маршруты между местами: {(id места отправления, id места назначения): Route или None}.
+
+        origins и destinations — последовательности (id места, lat, lng).
+        """
+        snapped = {}
+        for place_id, lat, lng in {*origins, *destinations}:
+            snapped[place_id] = self.snap(float(lat), float(lng))
+        node_routes = self.get_node_routes(
+            {snapped[place_id][0] for place_id, lat, lng in origins},
+            {snapped[place_id][0] for place_id, lat, lng in destinations},
+        )
+        routes = {}
+        for origin_id, *origin_coords in origins:
+            origin_node, origin_access = snapped[origin_id]
+            for destination_id, *destination_coords in destinations:
+                destination_node, destination_access = snapped[destination_id]
+                route = node_routes[origin_node, destination_node]
+                if route is not None:
+                    route = Route(
+                        origin_access.km + route.km + destination_access.km,
+                        origin_access.minutes + route.minutes + destination_access.minutes,
+                    )
+                routes[origin_id, destination_id] = route
+        return routes
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """Маршрутизатор текущего процесса или None, если дорожный граф не настроен."""
+    global _router
+    if not settings.ROUTING_GRAPH_PATH:
+        return None
+    with _router_lock:
+        if _router is None:
+            _router = Router(RoadGraph.from_csv(settings.ROUTING_GRAPH_PATH), cache_size=settings.ROUTING_CACHE_SIZE)
+        return _router
@@ -0,0 +1,31 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from calcdistances.cache import get_geocode_cache, to_cached_place
+from calcdistances.models import PlaceCoord
+from calcdistances.spatial import update_indexed_places
+from foodcartapp.models import DashboardVersion, Restaurant
+
+
+@receiver(post_save, sender=PlaceCoord)
+def update_cached_place(sender, instance, **kwargs):
+    # Кэш общий для всех процессов и не откатывается вместе с транзакцией,
+    # поэтому место попадает в него, только когда уже есть в базе
+    address_hash, cached_place = instance.hash, to_cached_place(instance)
+    transaction.on_commit(lambda: get_geocode_cache().set(address_hash, cached_place))
+    update_indexed_places([instance.pk])
+
+
+@receiver(post_delete, sender=PlaceCoord)
+def delete_cached_place(sender, instance, **kwargs):
+    address_hash = instance.hash
+    transaction.on_commit(lambda: get_geocode_cache().delete(address_hash))
+
+
+@receiver(post_save, sender=PlaceCoord)
+def reset_dashboard_for_restaurant_place(sender, instance, created, **kwargs):
+    # Новое место ещё не привязано к ресторанам, а у привязанного поменялись координаты —
+    # расстояния меняются у многих заказов, и страница заказов перестраивается целиком
+    if not created and Restaurant.objects.filter(place=instance.pk).exists():
+        DashboardVersion.objects.bump(reset=True)
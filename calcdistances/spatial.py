@@ -0,0 +1,317 @@
+import heapq
+import threading
+import time
+from collections import defaultdict, namedtuple
+from math import cos, floor, isqrt, radians
+
+import numpy as np
+from django.conf import settings
+
+from calcdistances.geometry import KM_PER_DEGREE, distance_matrix, get_coords_array
+from foodcartapp.models import Restaurant, RestaurantMenuItem
+
+IndexedRestaurant = namedtuple('IndexedRestaurant', ['lat', 'lng', 'cell'])
+
+
+def iter_bits(mask):
+    """Номера единичных битов маски по возрастанию."""
+    while mask:
+        lowest = mask & -mask
+        yield lowest.bit_length() - 1
+        mask ^= lowest
+
+
+class RestaurantIndex:
+    """Сетка по координатам ресторанов для поиска ближайших, которые могут приготовить заказ.
+
+    Ячейки квадратные в градусах, поиск обходит кольца ячеек вокруг точки заказа
+    и останавливается, когда все необойдённые рестораны заведомо дальше найденных.
+    Для каждого блюда хранится битовая маска ресторанов, где бит ресторана означает, что блюдо там в продаже.
+    Рестораны, готовые приготовить заказ целиком, — AND масок его блюд. Биты выдаются ресторанам плотно,
+    а не по id: с большими id из разреженной последовательности маски разрастались бы на каждый пропущенный id.
+    Расстояния до кандидатов считаются одним вызовом distance_matrix на кольцо ячеек, координаты каждой ячейки
+    хранятся готовым массивом.
+    """
+
+    def __init__(self, cell_km=2):
+        self.cell_deg = cell_km / KM_PER_DEGREE
+        self.cells = defaultdict(set)
+        self.cell_coords = {}
+        self.restaurants = {}
+        self.menus = {}
+        self.positions = {}
+        self.position_ids = []
+        self.free_positions = []
+        self.product_masks = {}
+        self.all_mask = 0
+        self.unplaced_mask = 0
+        self.bounds = None
+
+    def get_cell(self, lat, lng):
+        return floor(lat / self.cell_deg), floor(lng / self.cell_deg)
+
+    def get_bit(self, restaurant_id):
+        return 1 << self.positions[restaurant_id]
+
+    def get_coords(self, restaurant_ids):
+        return get_coords_array([
+            (self.restaurants[restaurant_id].lat, self.restaurants[restaurant_id].lng)
+            for restaurant_id in restaurant_ids
+        ])
+
+    def get_cell_coords(self, cell):
+        """id ресторанов ячейки и массив их координат для distance_matrix; массив строится при первом обращении."""
+        if cell not in self.cell_coords:
+            restaurant_ids = sorted(self.cells[cell])
+            self.cell_coords[cell] = (restaurant_ids, self.get_coords(restaurant_ids))
+        return self.cell_coords[cell]
+
+    def iter_ids(self, mask):
+        """id ресторанов маски по возрастанию."""
+        return sorted(self.position_ids[position] for position in iter_bits(mask))
+
+    def add(self, restaurant_id, lat, lng, products):
+        self.remove(restaurant_id)
+        # Освободившиеся номера занимаем первыми, чтобы маски не росли
+        if self.free_positions:
+            position = heapq.heappop(self.free_positions)
+            self.position_ids[position] = restaurant_id
+        else:
+            position = len(self.position_ids)
+            self.position_ids.append(restaurant_id)
+        self.positions[restaurant_id] = position
+        self.menus[restaurant_id] = set()
+        self.all_mask |= 1 << position
+        for product in products:
+            self.set_available(restaurant_id, product, True)
+        if lat is None or lng is None:
+            self.unplaced_mask |= 1 << position
+            return
+        cell = self.get_cell(lat, lng)
+        self.restaurants[restaurant_id] = IndexedRestaurant(lat, lng, cell)
+        self.cells[cell].add(restaurant_id)
+        self.cell_coords.pop(cell, None)
+        # Границы сетки только расширяем: это лишь ограничивает число колец при поиске
+        if self.bounds is None:
+            self.bounds = [*cell, *cell]
+        min_i, min_j, max_i, max_j = self.bounds
+        self.bounds = [min(min_i, cell[0]), min(min_j, cell[1]), max(max_i, cell[0]), max(max_j, cell[1])]
+
+    def remove(self, restaurant_id):
+        position = self.positions.pop(restaurant_id, None)
+        if position is None:
+            return
+        self.position_ids[position] = None
+        heapq.heappush(self.free_positions, position)
+        bit = 1 << position
+        for product in self.menus.pop(restaurant_id, ()):
+            self.discard_from_mask(product, bit)
+        self.all_mask &= ~bit
+        self.unplaced_mask &= ~bit
+        restaurant = self.restaurants.pop(restaurant_id, None)
+        if restaurant:
+            self.cells[restaurant.cell].discard(restaurant_id)
+            self.cell_coords.pop(restaurant.cell, None)
+            if not self.cells[restaurant.cell]:
+                del self.cells[restaurant.cell]
+
+    def set_available(self, restaurant_id, product, available):
+        """Переключает один бит: блюдо появилось в продаже в ресторане или пропало из неё."""
+        menu = self.menus.get(restaurant_id)
+        if menu is None:
+            return
+        bit = self.get_bit(restaurant_id)
+        if available:
+            menu.add(product)
+            self.product_masks[product] = self.product_masks.get(product, 0) | bit
+        else:
+            menu.discard(product)
+            self.discard_from_mask(product, bit)
+
+    def discard_from_mask(self, product, bit):
+        mask = self.product_masks.get(product, 0) & ~bit
+        if mask:
+            self.product_masks[product] = mask
+        else:
+            self.product_masks.pop(product, None)
+
+    def get_capable_mask(self, products=()):
+        """Маска ресторанов, в меню которых есть все products."""
+        mask = self.all_mask
+        for product in set(products):
+            mask &= self.product_masks.get(product, 0)
+            if not mask:
+                break
+        return mask
+
+    def get_ring_cells(self, center, ring):
+        center_i, center_j = center
+        if ring == 0:
+            yield center
+            return
+        for j in range(center_j - ring, center_j + ring + 1):
+            yield center_i - ring, j
+            yield center_i + ring, j
+        for i in range(center_i - ring + 1, center_i + ring):
+            yield i, center_j - ring
+            yield i, center_j + ring
+
+    def nearest(self, lat, lng, products=(), k=None, radius_km=None):
+        """Список (id ресторана, расстояние в км) по возрастанию расстояния.
+
+        Возвращает не больше k ресторанов в радиусе radius_km, в меню которых есть все products.
+        """
+        capable_mask = self.get_capable_mask(products) & ~self.unplaced_mask
+        if not capable_mask:
+            return []
+        center = self.get_cell(lat, lng)
+        min_i, min_j, max_i, max_j = self.bounds
+        max_ring = max(center[0] - min_i, max_i - center[0], center[1] - min_j, max_j - center[1], 0)
+        # Без радиуса доставки границы сетки могут охватывать тысячи колец почти пустых ячеек:
+        # дальние рестораны дешевле перебрать напрямую, чем обходить кольца
+        ring_limit = min(max_ring, isqrt(len(self.restaurants)) + 1)
+
+        found = []
+        point = get_coords_array([(lat, lng)])
+
+        def consider(restaurant_ids, coords):
+            for restaurant_id, distance in zip(restaurant_ids, distance_matrix(point, coords)[0].tolist()):
+                if radius_km is None or distance <= radius_km:
+                    heapq.heappush(found, (-distance, restaurant_id))
+                    if k is not None and len(found) > k:
+                        heapq.heappop(found)
+
+        for ring in range(ring_limit + 1):
+            ring_ids, ring_coords = [], []
+            for cell in self.get_ring_cells(center, ring):
+                if cell not in self.cells:
+                    continue
+                cell_ids, cell_coords = self.get_cell_coords(cell)
+                capable = [
+                    index for index, restaurant_id in enumerate(cell_ids) if capable_mask & self.get_bit(restaurant_id)
+                ]
+                if capable:
+                    ring_ids += [cell_ids[index] for index in capable]
+                    ring_coords.append(cell_coords[capable])
+            if ring_ids:
+                consider(ring_ids, np.concatenate(ring_coords))
+            # Рестораны в следующих кольцах не ближе этой границы
+            unvisited_km = ring * self.cell_deg * KM_PER_DEGREE * cos(
+                radians(min(89.9, abs(lat) + (ring + 1) * self.cell_deg))
+            )
+            if radius_km is not None and unvisited_km > radius_km:
+                break
+            if k is not None and len(found) == k and -found[0][0] <= unvisited_km:
+                break
+        else:
+            far_ids = [
+                restaurant_id
+                for restaurant_id in self.iter_ids(capable_mask)
+                if max(
+                    abs(self.restaurants[restaurant_id].cell[0] - center[0]),
+                    abs(self.restaurants[restaurant_id].cell[1] - center[1]),
+                ) > ring_limit
+            ]
+            if far_ids:
+                consider(far_ids, self.get_coords(far_ids))
+        return sorted(
+            ((restaurant_id, -distance) for distance, restaurant_id in found),
+            key=lambda item: item[1]
+        )
+
+    def partially_capable(self, lat, lng, products, radius_km=None):
+        """Рестораны в радиусе radius_km, которые готовят хотя бы одно из products.
+
+        Возвращает {id ресторана: (расстояние в км, какие из products он готовит)}.
+        """
+        products = frozenset(products)
+        mask = 0
+        for product in products:
+            mask |= self.product_masks.get(product, 0)
+        restaurant_ids = self.iter_ids(mask & ~self.unplaced_mask)
+        if not restaurant_ids:
+            return {}
+        distances = distance_matrix(get_coords_array([(lat, lng)]), self.get_coords(restaurant_ids))[0]
+        return {
+            restaurant_id: (distance, products & self.menus[restaurant_id])
+            for restaurant_id, distance in zip(restaurant_ids, distances.tolist())
+            if radius_km is None or distance <= radius_km
+        }
+
+    def unplaced_capable(self, products=()):
+        """Рестораны без координат, которые могут приготовить заказ."""
+        return self.iter_ids(self.get_capable_mask(products) & self.unplaced_mask)
+
+    def capable(self, products=()):
+        """Все рестораны, которые могут приготовить заказ, без учёта расстояния."""
+        capable_mask = self.get_capable_mask(products)
+        return self.iter_ids(capable_mask & ~self.unplaced_mask) + self.iter_ids(capable_mask & self.unplaced_mask)
+
+
+def load_restaurants(restaurant_ids=None):
+    """Координаты и доступные блюда ресторанов: {id: (lat, lng, {id блюд})}."""
+    restaurants = Restaurant.objects.all()
+    menu_items = RestaurantMenuItem.objects.filter(availability=True)
+    if restaurant_ids is not None:
+        restaurants = restaurants.filter(pk__in=restaurant_ids)
+        menu_items = menu_items.filter(restaurant__in=restaurant_ids)
+    products = defaultdict(set)
+    for restaurant_id, product_id in menu_items.values_list('restaurant_id', 'product_id'):
+        products[restaurant_id].add(product_id)
+    return {
+        restaurant_id: (
+            float(lat) if lat is not None and lng is not None else None,
+            float(lng) if lat is not None and lng is not None else None,
+            products[restaurant_id],
+        )
+        for restaurant_id, lat, lng in restaurants.values_list('pk', 'place__lat', 'place__lng')
+    }
+
+
+_index = None
+_index_built_at = 0
+_index_lock = threading.Lock()
+
+
+def get_restaurant_index():
+    """Индекс текущего процесса.
+
+    Изменения, сделанные другими процессами, подхватываются перестройкой раз в RESTAURANT_INDEX_TTL секунд.
+    """
+    global _index, _index_built_at
+    with _index_lock:
+        if _index is None or time.monotonic() - _index_built_at > settings.RESTAURANT_INDEX_TTL:
+            index = RestaurantIndex(cell_km=settings.RESTAURANT_INDEX_CELL_KM)
+            for restaurant_id, (lat, lng, products) in load_restaurants().items():
+                index.add(restaurant_id, lat, lng, products)
+            _index, _index_built_at = index, time.monotonic()
+        return _index
+
+
+def update_indexed_restaurants(restaurant_ids):
+    """Перечитывает из базы рестораны, которые переехали, открылись или поменяли меню."""
+    with _index_lock:
+        if _index is None:
+            return
+        restaurants = load_restaurants(restaurant_ids)
+        for restaurant_id in restaurant_ids:
+            if restaurant_id in restaurants:
+                _index.add(restaurant_id, *restaurants[restaurant_id])
+            else:
+                _index.remove(restaurant_id)
+
+
+def update_indexed_menu_item(restaurant_id, product_id, available):
+    """Переключает одно блюдо в меню ресторана без перечитывания меню из базы."""
+    with _index_lock:
+        if _index is not None:
+            _index.set_available(restaurant_id, product_id, available)
+
+
+def update_indexed_places(place_ids):
+    """Обновляет рестораны, у которых поменялись координаты мест."""
+    if _index is None:
+        return
+    restaurant_ids = list(Restaurant.objects.filter(place__in=place_ids).values_list('pk', flat=True))
+    if restaurant_ids:
+        update_indexed_restaurants(restaurant_ids)
@@ -1,3 +1,305 @@
-from django.test import TestCase
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from calcdistances import geocoding
+from calcdistances.addresses import get_address_hash
+from calcdistances.cache import get_geocode_cache
+from calcdistances.gazetteer import Gazetteer, split_address
+from calcdistances.geometry import calculate_distance
+from calcdistances.geocoder import CircuitBreaker, Geocoder, GeocoderBackend, GeocoderUnavailable
+from calcdistances.models import GeocodeJob, PlaceCoord
+from calcdistances.spatial import RestaurantIndex
+from foodcartapp.models import Order, Restaurant
+
+
+def http_error(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.exceptions.HTTPError(response=response)
+
+
+class ScriptedBackend(GeocoderBackend):
+    """Отвечает по очереди заранее заданными результатами или ошибками."""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    def geocode(self, session, address, timeout):
+        self.calls += 1
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+@mock.patch('calcdistances.geocoder.time.sleep')
+class GeocoderTest(SimpleTestCase):
+    place = {'lng': 37.6, 'lat': 55.75, 'address': 'Тверская, 1'}
+
+    def create_geocoder(self, backend, retries=2, failure_threshold=2):
+        return Geocoder(backend, retries=retries, breaker=CircuitBreaker(failure_threshold=failure_threshold))
+
+    def test_retries_temporary_errors(self, sleep):
+        backend = ScriptedBackend(requests.exceptions.ConnectTimeout(), http_error(503), self.place)
+        geocoder = self.create_geocoder(backend)
+
+        self.assertEqual(geocoder.fetch_coordinates('Тверская, 1'), self.place)
+        self.assertEqual(backend.calls, 3)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertEqual(geocoder.breaker.failures, 0)
+
+    def test_gives_up_after_retries(self, sleep):
+        backend = ScriptedBackend(*[requests.exceptions.ConnectionError()] * 3)
+        geocoder = self.create_geocoder(backend)
+
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            geocoder.fetch_coordinates('Тверская, 1')
+        self.assertEqual(backend.calls, 3)
+        self.assertEqual(geocoder.breaker.failures, 1)
+
+    def test_client_errors_are_not_retried(self, sleep):
+        backend = ScriptedBackend(http_error(400))
+        geocoder = self.create_geocoder(backend)
+
+        with self.assertRaises(requests.exceptions.HTTPError):
+            geocoder.fetch_coordinates('Тверская, 1')
+        self.assertEqual(backend.calls, 1)
+        self.assertEqual(geocoder.breaker.failures, 0)
+
+    def test_invalid_key_opens_breaker(self, sleep):
+        backend = ScriptedBackend(http_error(403), http_error(401))
+        geocoder = self.create_geocoder(backend)
+
+        for _ in range(2):
+            with self.assertRaises(requests.exceptions.HTTPError):
+                geocoder.fetch_coordinates('Тверская, 1')
+        with self.assertRaises(GeocoderUnavailable):
+            geocoder.fetch_coordinates('Тверская, 1')
+        self.assertEqual(backend.calls, 2)
+        sleep.assert_not_called()
+
+    def test_breaker_lets_probe_through_after_timeout(self, sleep):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        with mock.patch('calcdistances.geocoder.time.monotonic', return_value=100):
+            breaker.record_failure()
+            self.assertFalse(breaker.allow_request())
+        with mock.patch('calcdistances.geocoder.time.monotonic', return_value=130):
+            self.assertTrue(breaker.allow_request())
+            self.assertFalse(breaker.allow_request())
+        breaker.record_success()
+        self.assertTrue(breaker.allow_request())
+
+
+class GazetteerTest(SimpleTestCase):
+    def setUp(self):
+        self.gazetteer = Gazetteer()
+        self.gazetteer.add('Москва', 'ул. Целинная', '31', 37.1, 55.1)
+        self.gazetteer.add('Москва', 'ул. 2-я Тверская-Ямская', '7', 37.2, 55.2)
+        self.gazetteer.add('Москва', 'Цветной бульвар', '11с2', 37.3, 55.3)
+
+    def test_splits_house_after_numeric_street(self):
+        self.assertEqual(
+            split_address('ул. 2-я Тверская-Ямская, 7', ['москва']),
+            (None, '2-я тверская-ямская улица', '7'),
+        )
+        self.assertEqual(
+            split_address('Россия, г. Москва, ул. 1905 года, д. 7, стр. 2', ['москва']),
+            ('москва', '1905 года улица', '7с2'),
+        )
+
+    def test_finds_house_in_same_city(self):
+        self.assertEqual(self.gazetteer.lookup('Москва, ул. 2-я Тверская-Ямская, 7'), (37.2, 55.2))
+        self.assertEqual(self.gazetteer.lookup('г. Москва, Цветной б-р, д. 11 стр. 2'), (37.3, 55.3))
+        self.assertEqual(self.gazetteer.lookup('Москва, Цвитной бульвар, 11с2'), (37.3, 55.3))
+
+    def test_ignores_other_cities(self):
+        self.assertIsNone(self.gazetteer.lookup('Пермь, ул. Целинная, 31'))
+        self.assertIsNone(self.gazetteer.lookup('ул. Целинная, 31'))
+
+    def test_unknown_house(self):
+        self.assertIsNone(self.gazetteer.lookup('Москва, ул. Целинная, 32'))
+        self.assertIsNone(self.gazetteer.lookup('Москва, ул. Целинная'))
+
+
+class RestaurantIndexTest(SimpleTestCase):
+    def setUp(self):
+        self.index = RestaurantIndex(cell_km=2)
+        self.index.add(1, 55.75, 37.6, {10})
+        self.index.add(2, 55.8, 37.6, {10})
+        self.index.add(3, 43.12, 131.9, {10})
+
+    def test_far_restaurants_are_scanned_without_rings(self):
+        with mock.patch.object(self.index, 'get_ring_cells', wraps=self.index.get_ring_cells) as get_ring_cells:
+            nearest = self.index.nearest(55.75, 37.6)
+
+        self.assertEqual([restaurant_id for restaurant_id, distance in nearest], [1, 2, 3])
+        self.assertAlmostEqual(nearest[1][1], 5.56, places=2)
+        self.assertLessEqual(get_ring_cells.call_count, 3)
+
+    def test_masks_stay_dense_for_sparse_ids(self):
+        self.index.add(10 ** 9, 55.76, 37.61, {10, 20})
+        self.index.remove(2)
+        self.index.add(5 * 10 ** 8, None, None, {10})
+
+        self.assertEqual(self.index.all_mask.bit_length(), 4)
+        self.assertEqual(self.index.capable([10]), [1, 3, 10 ** 9, 5 * 10 ** 8])
+        self.assertEqual(self.index.capable([20]), [10 ** 9])
+        self.assertEqual(self.index.unplaced_capable([10]), [5 * 10 ** 8])
+        self.assertEqual(self.index.nearest(55.76, 37.61, [20]), [(10 ** 9, 0.0)])
+
+    def test_batched_distances_match_haversine(self):
+        index = RestaurantIndex(cell_km=1)
+        points = {
+            restaurant_id: (55.7 + restaurant_id % 7 * 0.013, 37.5 + restaurant_id % 11 * 0.017)
+            for restaurant_id in range(1, 60)
+        }
+        for restaurant_id, (lat, lng) in points.items():
+            index.add(restaurant_id, lat, lng, {10} if restaurant_id % 3 else {20})
+
+        expected = sorted(
+            (calculate_distance(55.75, 37.6, lat, lng), restaurant_id)
+            for restaurant_id, (lat, lng) in points.items() if restaurant_id % 3
+        )[:5]
+        nearest = index.nearest(55.75, 37.6, [10], k=5)
+        self.assertEqual([restaurant_id for restaurant_id, distance in nearest], [item[1] for item in expected])
+        for (restaurant_id, distance), (expected_distance, _) in zip(nearest, expected):
+            self.assertAlmostEqual(distance, expected_distance)
+
+    def test_nearest_respects_k_and_radius(self):
+        self.assertEqual([restaurant_id for restaurant_id, distance in self.index.nearest(43.1, 131.9, k=1)], [3])
+        self.assertEqual(self.index.nearest(55.75, 37.6, radius_km=1), [(1, 0.0)])
+
+
+class PlaceDistanceQueryTest(TestCase):
+    def setUp(self):
+        index_patch = mock.patch('calcdistances.spatial._index', None)
+        index_patch.start()
+        self.addCleanup(index_patch.stop)
+
+        self.places = {
+            name: PlaceCoord.objects.create(address=name, hash=get_address_hash(name), lat=lat, lng=lng)
+            for name, lat, lng in [
+                ('Кремль', 55.752, 37.617),
+                ('Арбат', 55.75, 37.59),
+                ('Химки', 55.889, 37.445),
+                ('Пермь', 58.01, 56.25),
+            ]
+        }
+
+    def test_within_km(self):
+        places = PlaceCoord.objects.within_km(55.752, 37.617, 5).order_by('distance')
+
+        self.assertEqual([place.address for place in places], ['Кремль', 'Арбат'])
+        self.assertAlmostEqual(places[1].distance, calculate_distance(55.752, 37.617, 55.75, 37.59))
+
+    def test_near_points_covers_every_point(self):
+        places = PlaceCoord.objects.near_points([55.752, 58.0], [37.617, 56.25], 5)
+
+        self.assertEqual(sorted(place.address for place in places), ['Арбат', 'Кремль', 'Пермь'])
+
+    def test_restaurants_nearest_first(self):
+        for name in ['Пермь', 'Химки', 'Арбат']:
+            Restaurant.objects.create(name=name, address=name, place=self.places[name])
+        Restaurant.objects.create(name='Без адреса')
+
+        restaurants = Restaurant.objects.nearest_to(55.752, 37.617)
+        self.assertEqual([restaurant.name for restaurant in restaurants], ['Арбат', 'Химки', 'Пермь', 'Без адреса'])
+        self.assertEqual(
+            [restaurant.name for restaurant in Restaurant.objects.within_km(55.752, 37.617, 30)], ['Арбат', 'Химки']
+        )
+
+
+class GeocodeCacheTest(TestCase):
+    address = 'Москва, ул. Тверская, 1'
+
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        cache_settings = override_settings(
+            GEOCODE_CACHE_PATH=os.path.join(cache_dir.name, 'geocode', 'cache.sqlite3')
+        )
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+        self.address_hash = get_address_hash(self.address)
+
+    def create_place(self):
+        return PlaceCoord.objects.create(address=self.address, hash=self.address_hash, lat=55.75, lng=37.6)
+
+    def test_place_is_cached_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            place = self.create_place()
+            self.assertIsNone(get_geocode_cache().get(self.address_hash))
+        self.assertEqual(get_geocode_cache().get(self.address_hash).place_id, place.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            place.delete()
+        self.assertIsNone(get_geocode_cache().get(self.address_hash))
+
+    def test_rolled_back_place_is_not_cached(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError), transaction.atomic():
+                self.create_place()
+                raise ValueError
+        self.assertIsNone(get_geocode_cache().get(self.address_hash))
+
+
+@override_settings(GEOCODE_TTL_DAYS=30, GEOCODE_RETRY_BACKOFF_MINUTES=10)
+class PlaceRefreshTest(TestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        cache_settings = override_settings(GEOCODE_CACHE_PATH=os.path.join(cache_dir.name, 'cache.sqlite3'))
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+
+        address = 'Москва, ул. Тверская, 1'
+        self.place = PlaceCoord.objects.create(
+            address=address, hash=get_address_hash(address), lat=55.75, lng=37.6,
+            request_at=timezone.now() - timedelta(days=31),
+        )
+        Order.objects.create(
+            firstname='Иван', lastname='Петров', phonenumber='+79291000000', address=address, place=self.place
+        )
+
+    def test_first_failure_leaves_place_without_coordinates(self):
+        place = PlaceCoord(address='Нигде', hash=1)
+        place.set_coordinates(None)
+
+        self.assertIsNone(place.lat)
+        self.assertEqual(place.failed_attempts, 1)
+        self.assertFalse(place.needs_refresh())
+
+    def test_failed_refresh_keeps_coordinates(self):
+        self.assertEqual(geocoding.enqueue_expired_places(), 1)
+
+        with mock.patch.object(geocoding, 'fetch_coordinates', return_value=None):
+            geocoding.process_geocode_jobs()
+
+        self.place.refresh_from_db()
+        self.assertEqual((float(self.place.lat), float(self.place.lng)), (55.75, 37.6))
+        self.assertEqual(self.place.failed_attempts, 1)
+        self.assertGreater(self.place.retry_at, timezone.now())
+        self.assertFalse(PlaceCoord.objects.expired().exists())
+        self.assertEqual(geocoding.enqueue_expired_places(), 0)
+
+    def test_network_failures_postpone_refresh(self):
+        geocoding.enqueue_expired_places()
+        GeocodeJob.objects.update(attempts=geocoding.MAX_JOB_ATTEMPTS - 1)
+
+        with mock.patch.object(geocoding, 'fetch_coordinates', side_effect=requests.exceptions.ConnectionError()), \
+                self.assertLogs('calcdistances.geocoding', 'WARNING'):
+            geocoding.process_geocode_jobs()
+
+        self.assertEqual(GeocodeJob.objects.get().status, GeocodeJob.Status.FAILED)
+        self.assertEqual(geocoding.enqueue_expired_places(), 0)
+
+        PlaceCoord.objects.update(retry_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(geocoding.enqueue_expired_places(), 1)
@@ -117,7 +117,17 @@ class ProductAdmin(admin.ModelAdmin):
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     inlines = [OrderPositionItemInline]
-    readonly_fields = ['registrated_at']
+    readonly_fields = ['registrated_at', 'total_cost']
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        # Рестораны в списке — от ближних к адресу заказа, поиском по индексу мест
+        object_id = request.resolver_match.kwargs.get('object_id') if request.resolver_match else None
+        if db_field.name == 'restaurant_order' and object_id:
+            coordinates = Order.objects.filter(pk=object_id).values_list('place__lat', 'place__lng').first()
+            if coordinates and None not in coordinates:
+                lat, lng = map(float, coordinates)
+                kwargs['queryset'] = Restaurant.objects.nearest_to(lat, lng)
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
     def response_post_save_change(self, request, obj):
         res = super().response_post_save_change(request, obj)
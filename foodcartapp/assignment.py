@@ -0,0 +1,179 @@
+from collections import defaultdict, deque
+from math import inf
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from calcdistances.models import RestaurantDistance
+from calcdistances.spatial import get_restaurant_index
+from foodcartapp.models import Order, OrderPosition, Restaurant
+
+
+def move_along_path(path_end, parents, assignment, assigned):
+    """Переназначает заказы вдоль найденной цепочки: каждый заказ занимает место, освобождённое следующим."""
+    restaurant_id = path_end
+    while restaurant_id is not None:
+        order_id, previous_restaurant_id = parents[restaurant_id]
+        assignment[order_id] = restaurant_id
+        assigned[restaurant_id].add(order_id)
+        if previous_restaurant_id is not None:
+            assigned[previous_restaurant_id].discard(order_id)
+        restaurant_id = previous_restaurant_id
+
+
+def find_place_for(order_id, distances, assignment, assigned, free):
+    """Назначает заказ так, чтобы суммарное расстояние выросло меньше всего, пересаживая уже назначенные заказы.
+
+    Ищет кратчайший увеличивающий путь в паросочетании минимальной стоимости: пересадка заказа
+    из ресторана A в ресторан B стоит разницы расстояний до них и может быть отрицательной,
+    поэтому стоимости путей до ресторанов уточняются по алгоритму Беллмана — Форда.
+    """
+    costs = {}
+    parents = {}
+    queue = deque()
+    for restaurant_id, distance in distances[order_id].items():
+        costs[restaurant_id] = distance
+        parents[restaurant_id] = (order_id, None)
+        queue.append(restaurant_id)
+    queued = set(queue)
+    while queue:
+        restaurant_id = queue.popleft()
+        queued.discard(restaurant_id)
+        for moved_order_id in assigned[restaurant_id]:
+            moved_distance = distances[moved_order_id][restaurant_id]
+            for next_restaurant_id, distance in distances[moved_order_id].items():
+                cost = costs[restaurant_id] + distance - moved_distance
+                if cost < costs.get(next_restaurant_id, inf):
+                    costs[next_restaurant_id] = cost
+                    parents[next_restaurant_id] = (moved_order_id, restaurant_id)
+                    if next_restaurant_id not in queued:
+                        queue.append(next_restaurant_id)
+                        queued.add(next_restaurant_id)
+    reachable = [restaurant_id for restaurant_id in costs if free.get(restaurant_id, 0) > 0]
+    if not reachable:
+        return False
+    path_end = min(reachable, key=lambda restaurant_id: (costs[restaurant_id], restaurant_id))
+    move_along_path(path_end, parents, assignment, assigned)
+    free[path_end] -= 1
+    return True
+
+
+def solve_assignment(candidates, capacities):
+    """Назначает заказы ресторанам: как можно больше заказов и с наименьшим суммарным расстоянием для них.
+
+    candidates — {id заказа: [(id ресторана, расстояние)]}, capacities — {id ресторана: свободных мест}.
+    Заказы добавляются по одному, начиная с тех, у кого ближайший ресторан ближе всего,
+    и каждый раз по кратчайшему увеличивающему пути, см. find_place_for.
+    Возвращает {id заказа: id ресторана}.
+    """
+    distances = {
+        order_id: dict(order_candidates)
+        for order_id, order_candidates in candidates.items()
+    }
+    free = dict(capacities)
+    assignment = {}
+    assigned = defaultdict(set)
+    orders = sorted(
+        (min(order_distances.values()), order_id)
+        for order_id, order_distances in distances.items()
+        if order_distances
+    )
+    for distance, order_id in orders:
+        find_place_for(order_id, distances, assignment, assigned, free)
+    return assignment
+
+
+def get_free_capacities():
+    """Свободные места ресторанов: вместимость минус заказы в очереди."""
+    return {
+        restaurant_id: max(0, capacity - queued_orders)
+        for restaurant_id, capacity, queued_orders
+        in Restaurant.objects.values_list('pk', 'order_capacity', 'queued_orders')
+    }
+
+
+def get_candidates(orders):
+    """Рестораны в радиусе доставки, которые могут приготовить заказ, с расстоянием до них.
+
+    orders — последовательность (id заказа, id места, lat, lng). Расстояние по дорогам,
+    если оно уже посчитано, иначе по прямой.
+    """
+    order_ids = [order_id for order_id, place_id, lat, lng in orders]
+    products = defaultdict(set)
+    for order_id, product_id in OrderPosition.objects.filter(order__in=order_ids).values_list('order', 'product'):
+        products[order_id].add(product_id)
+
+    index = get_restaurant_index()
+    candidates = {}
+    for order_id, place_id, lat, lng in orders:
+        if not products[order_id]:
+            continue
+        candidates[order_id] = index.nearest(
+            float(lat),
+            float(lng),
+            products[order_id],
+            k=settings.ASSIGNMENT_CANDIDATES,
+            radius_km=settings.DELIVERY_RADIUS_KM or None,
+        )
+
+    restaurant_places = dict(
+        Restaurant.objects
+        .filter(pk__in={restaurant_id for nearest in candidates.values() for restaurant_id, distance in nearest})
+        .values_list('pk', 'place')
+    )
+    route_distances = {
+        (order_place_id, restaurant_place_id): route_distance
+        for order_place_id, restaurant_place_id, route_distance in (
+            RestaurantDistance.objects
+            .filter(
+                order_place__in={place_id for order_id, place_id, lat, lng in orders},
+                restaurant_place__in=set(restaurant_places.values()),
+                route_distance__isnull=False,
+            )
+            .values_list('order_place', 'restaurant_place', 'route_distance')
+        )
+    }
+    order_places = {order_id: place_id for order_id, place_id, lat, lng in orders}
+    return {
+        order_id: [
+            (
+                restaurant_id,
+                float(route_distances.get((order_places[order_id], restaurant_places.get(restaurant_id)), distance)),
+            )
+            for restaurant_id, distance in nearest
+        ]
+        for order_id, nearest in candidates.items()
+    }
+
+
+def assign_orders():
+    """Назначает рестораны всем необработанным заказам без ресторана и передаёт их в рестораны одним bulk_update.
+
+    Возвращает (число назначенных заказов, число заказов, которым ресторан не нашёлся).
+    """
+    with transaction.atomic():
+        orders = list(
+            Order.objects
+            .filter(status=Order.Status.UNPROCESSED, restaurant_order__isnull=True)
+            .select_for_update(skip_locked=True, of=('self',))
+            .values_list('pk', 'place', 'place__lat', 'place__lng')
+        )
+        placed_orders = [order for order in orders if order[2] is not None and order[3] is not None]
+        assignment = solve_assignment(get_candidates(placed_orders), get_free_capacities())
+        # Назначенный заказ сразу передаётся в ресторан, а не остаётся необработанным с уже выбранным рестораном
+        now = timezone.now()
+        Order.objects.bulk_update(
+            [
+                Order(
+                    pk=order_id,
+                    restaurant_order_id=restaurant_id,
+                    status=Order.Status.RESTAURANT,
+                    cooking_started_at=now,
+                )
+                for order_id, restaurant_id in assignment.items()
+            ],
+            ['restaurant_order', 'status', 'cooking_started_at'],
+            batch_size=1000,
+        )
+    return len(assignment), len(orders) - len(assignment)
@@ -0,0 +1,168 @@
+import threading
+import time
+from collections import defaultdict, namedtuple
+from math import atan2, cos, floor, radians
+
+from django.conf import settings
+
+from calcdistances.geometry import KM_PER_DEGREE, distance_matrix, get_coords_array
+from foodcartapp.models import Order
+
+CourierBatch = namedtuple('CourierBatch', ['restaurant_id', 'order_ids', 'km'])
+
+
+def load_ready_orders():
+    """Заказы, переданные курьеру: [(id заказа, id ресторана, (lat, lng) ресторана, (lat, lng) доставки)]."""
+    orders = (
+        Order.objects
+        .filter(status=Order.Status.COURIER, restaurant_order__isnull=False)
+        .exclude(place__lat=None)
+        .exclude(place__lng=None)
+        .exclude(restaurant_order__place__lat=None)
+        .exclude(restaurant_order__place__lng=None)
+        .values_list(
+            'pk', 'restaurant_order',
+            'restaurant_order__place__lat', 'restaurant_order__place__lng',
+            'place__lat', 'place__lng',
+        )
+    )
+    return [
+        (order_id, restaurant_id, (float(restaurant_lat), float(restaurant_lng)), (float(lat), float(lng)))
+        for order_id, restaurant_id, restaurant_lat, restaurant_lng, lat, lng in orders
+    ]
+
+
+def find_root(parents, index):
+    while parents[index] != index:
+        parents[index] = parents[parents[index]]
+        index = parents[index]
+    return index
+
+
+def cluster_stops(stops, radius_km):
+    """Группы точек доставки, связанных цепочками соседей ближе radius_km, — DBSCAN с min_samples=1.
+
+    stops — [(id заказа, (lat, lng))]. Соседей ищем только в соседних ячейках сетки со стороной radius_km,
+    расстояния до них считаются одним вызовом distance_matrix на точку.
+    """
+    if not stops:
+        return []
+    cell_lat = radius_km / KM_PER_DEGREE
+    # Градус долготы короче к полюсам, поэтому ячейки по долготе шире
+    max_abs_lat = min(89.9, max(abs(lat) for order_id, (lat, lng) in stops))
+    cell_lng = cell_lat / cos(radians(max_abs_lat))
+    coords = get_coords_array([point for order_id, point in stops])
+    cells = defaultdict(list)
+    parents = list(range(len(stops)))
+    for index, (order_id, (lat, lng)) in enumerate(stops):
+        cell_i, cell_j = floor(lat / cell_lat), floor(lng / cell_lng)
+        neighbours = [
+            neighbour
+            for neighbour_i in range(cell_i - 1, cell_i + 2)
+            for neighbour_j in range(cell_j - 1, cell_j + 2)
+            for neighbour in cells.get((neighbour_i, neighbour_j), ())
+        ]
+        if neighbours:
+            distances = distance_matrix(coords[index:index + 1], coords[neighbours])[0]
+            for neighbour, distance in zip(neighbours, distances.tolist()):
+                if distance <= radius_km:
+                    parents[find_root(parents, index)] = find_root(parents, neighbour)
+        cells[cell_i, cell_j].append(index)
+    clusters = defaultdict(list)
+    for index, stop in enumerate(stops):
+        clusters[find_root(parents, index)].append(stop)
+    return list(clusters.values())
+
+
+def plan_route(start, stops):
+    """Порядок объезда точек от start: ближайший сосед, затем улучшение 2-opt.
+
+    Возвращает (точки в порядке объезда, длина маршрута в км). Возвращаться в start не нужно.
+    """
+    points = get_coords_array([start] + [coords for order_id, coords in stops])
+    distances = distance_matrix(points, points).tolist()
+
+    route = [0]
+    unvisited = set(range(1, len(distances)))
+    while unvisited:
+        nearest = min(unvisited, key=lambda point: distances[route[-1]][point])
+        route.append(nearest)
+        unvisited.remove(nearest)
+
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, len(route) - 1):
+            for j in range(i + 1, len(route)):
+                before, first, last = route[i - 1], route[i], route[j]
+                delta = distances[before][last] - distances[before][first]
+                if j + 1 < len(route):
+                    after = route[j + 1]
+                    delta += distances[first][after] - distances[last][after]
+                if delta < -1e-9:
+                    route[i:j + 1] = reversed(route[i:j + 1])
+                    improved = True
+
+    km = sum(distances[point][next_point] for point, next_point in zip(route, route[1:]))
+    return [stops[point - 1] for point in route[1:]], km
+
+
+def sweep_stops(start, stops):
+    """Точки в порядке обхода лучом вокруг start — алгоритм заметания, за O(n log n) вместо построения маршрута."""
+    start_lat, start_lng = start
+    lng_scale = cos(radians(start_lat))
+    return sorted(
+        stops,
+        key=lambda stop: atan2(stop[1][0] - start_lat, (stop[1][1] - start_lng) * lng_scale),
+    )
+
+
+def build_batches(orders, radius_km, batch_size):
+    """Разбивает заказы на поездки курьеров: заказы одного ресторана с близкими адресами — в одну поездку."""
+    restaurants = {}
+    restaurant_stops = defaultdict(list)
+    for order_id, restaurant_id, restaurant_coords, coords in orders:
+        restaurants[restaurant_id] = restaurant_coords
+        restaurant_stops[restaurant_id].append((order_id, coords))
+
+    batches = []
+    for restaurant_id, stops in restaurant_stops.items():
+        start = restaurants[restaurant_id]
+        for cluster in cluster_stops(stops, radius_km):
+            # Большое скопление режем на секторы вокруг ресторана, чтобы в поездку попадали соседние адреса:
+            # маршрут по всему скоплению строился бы за квадратичное время
+            if len(cluster) > batch_size:
+                cluster = sweep_stops(start, cluster)
+            for offset in range(0, len(cluster), batch_size):
+                route, km = plan_route(start, cluster[offset:offset + batch_size])
+                batches.append(CourierBatch(restaurant_id, [order_id for order_id, coords in route], km))
+    batches.sort(key=lambda batch: (-len(batch.order_ids), batch.km))
+    return batches
+
+
+_batches = None
+_batches_built_at = 0
+_batches_lock = threading.Lock()
+
+
+def get_courier_batches():
+    """Поездки курьеров текущего процесса, пересчитываются после смены статуса заказа.
+
+    Изменения из других процессов подхватываются раз в COURIER_BATCHES_TTL секунд.
+    """
+    global _batches, _batches_built_at
+    with _batches_lock:
+        if _batches is None or time.monotonic() - _batches_built_at > settings.COURIER_BATCHES_TTL:
+            _batches = build_batches(
+                load_ready_orders(),
+                radius_km=settings.COURIER_BATCH_RADIUS_KM,
+                batch_size=settings.COURIER_BATCH_SIZE,
+            )
+            _batches_built_at = time.monotonic()
+        return _batches
+
+
+def invalidate_courier_batches():
+    global _batches
+    with _batches_lock:
+        _batches = None
@@ -0,0 +1,94 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from calcdistances.models import RestaurantDistance
+from foodcartapp.models import Order, Restaurant
+
+
+def is_queued(status, restaurant_id):
+    return restaurant_id is not None and status in Order.QUEUED_STATUSES
+
+
+def update_queues(old_status, old_restaurant_id, new_status, new_restaurant_id):
+    """Сдвигает счётчики очереди ресторанов на единицу при смене статуса или ресторана заказа."""
+    was_queued = is_queued(old_status, old_restaurant_id)
+    queued = is_queued(new_status, new_restaurant_id)
+    if was_queued and queued and old_restaurant_id == new_restaurant_id:
+        return
+    if was_queued:
+        Restaurant.objects.filter(pk=old_restaurant_id).update(
+            queued_orders=Greatest(F('queued_orders') - 1, 0)
+        )
+    if queued:
+        Restaurant.objects.filter(pk=new_restaurant_id).update(queued_orders=F('queued_orders') + 1)
+
+
+def learn_prep_time(restaurant_id, minutes):
+    """Обновляет скользящее среднее времени приготовления ресторана одним UPDATE."""
+    weight = settings.ETA_PREP_LEARNING_RATE
+    Restaurant.objects.filter(pk=restaurant_id).update(
+        prep_minutes=Coalesce(F('prep_minutes'), Value(minutes)) * (1 - weight) + minutes * weight
+    )
+
+
+def get_travel_minutes(distance, route_duration=None):
+    """Время в пути: по дорожному графу, если маршрут посчитан, иначе по расстоянию со средней скоростью курьера."""
+    if route_duration is not None:
+        return route_duration
+    if distance is None:
+        return None
+    return float(distance) / settings.ETA_COURIER_SPEED_KMH * 60
+
+
+def estimate_minutes(status, travel_minutes, prep_minutes=None, orders_ahead=0, order_capacity=1,
+                     cooking_started_at=None):
+    """Через сколько минут заказ доставят или None, если расстояние до ресторана неизвестно.
+
+    Необработанный заказ ждёт, пока ресторан приготовит orders_ahead заказов партиями по order_capacity,
+    затем готовится сам. У заказа в ресторане из времени приготовления вычитается уже прошедшее.
+    """
+    if travel_minutes is None:
+        return None
+    if status == Order.Status.COURIER:
+        return round(travel_minutes)
+    if prep_minutes is None:
+        prep_minutes = settings.ETA_DEFAULT_PREP_MINUTES
+    if status == Order.Status.RESTAURANT:
+        cooked_minutes = 0
+        if cooking_started_at:
+            cooked_minutes = (timezone.now() - cooking_started_at).total_seconds() / 60
+        return round(max(0, prep_minutes - cooked_minutes) + travel_minutes)
+    queue_minutes = orders_ahead // max(1, order_capacity) * prep_minutes
+    return round(queue_minutes + prep_minutes + travel_minutes)
+
+
+def get_order_eta(order):
+    """Прогноз доставки заказа: (минут до доставки, время доставки) или (None, None).
+
+    Заказу без ресторана прогноз не даём — неизвестно, кто и когда его приготовит.
+    """
+    restaurant = order.restaurant_order
+    if order.status == Order.Status.COMPLETED or restaurant is None:
+        return None, None
+    distance = (
+        RestaurantDistance.objects
+        .filter(order_place=order.place_id, restaurant_place=restaurant.place_id)
+        .values_list('distance', 'route_duration')
+        .first()
+    )
+    minutes = estimate_minutes(
+        order.status,
+        get_travel_minutes(*distance) if distance else None,
+        prep_minutes=restaurant.prep_minutes,
+        # Сам заказ тоже в очереди ресторана
+        orders_ahead=max(0, restaurant.queued_orders - 1),
+        order_capacity=restaurant.order_capacity,
+        cooking_started_at=order.cooking_started_at,
+    )
+    if minutes is None:
+        return None, None
+    return minutes, timezone.now() + timedelta(minutes=minutes)
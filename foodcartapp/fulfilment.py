@@ -0,0 +1,94 @@
+from math import inf
+
+# Точный перебор подмножеств блюд растёт как 2 ** число блюд на число ресторанов, а план считается
+# для каждого заказа на странице заказов, поэтому для больших заказов — жадный алгоритм
+MAX_EXACT_PRODUCTS = 8
+
+
+def solve_cover_exactly(products, options):
+    """Динамика по подмножествам блюд: для каждой маски — самый дешёвый набор ресторанов, который её покрывает."""
+    bits = {product: 1 << position for position, product in enumerate(products)}
+    # Из ресторанов с одинаковым набором нужных блюд имеет смысл только самый дешёвый
+    cheapest = {}
+    for restaurant_id, (cost, menu) in options.items():
+        restaurant_mask = sum(bits[product] for product in menu if product in bits)
+        # При равном расстоянии берём ресторан с меньшим id, чтобы план не зависел от порядка обхода
+        if restaurant_mask and (restaurant_mask not in cheapest or (cost, restaurant_id) < cheapest[restaurant_mask]):
+            cheapest[restaurant_mask] = (cost, restaurant_id)
+    full_mask = (1 << len(products)) - 1
+    best = [inf] * (full_mask + 1)
+    choice = [None] * (full_mask + 1)
+    best[0] = 0
+    # Объединение с меню ресторана не уменьшает маску, поэтому хватает одного прохода по возрастанию
+    for mask in range(full_mask + 1):
+        if best[mask] == inf:
+            continue
+        for restaurant_mask, (restaurant_cost, restaurant_id) in cheapest.items():
+            covered = mask | restaurant_mask
+            cost = best[mask] + restaurant_cost
+            if covered != mask and cost < best[covered]:
+                best[covered] = cost
+                choice[covered] = (mask, restaurant_id)
+    if best[full_mask] == inf:
+        return None
+    restaurant_ids = []
+    mask = full_mask
+    while mask:
+        mask, restaurant_id = choice[mask]
+        restaurant_ids.append(restaurant_id)
+    return restaurant_ids
+
+
+def solve_cover_greedily(products, options):
+    """Берёт ресторан с наименьшей стоимостью за каждое ещё не покрытое блюдо, пока не покроет все."""
+    uncovered = set(products)
+    restaurant_ids = []
+    while uncovered:
+        best_restaurant_id, best_ratio = None, inf
+        for restaurant_id, (cost, menu) in sorted(options.items()):
+            covered = len(uncovered & menu)
+            if covered and cost / covered < best_ratio:
+                best_restaurant_id, best_ratio = restaurant_id, cost / covered
+        if best_restaurant_id is None:
+            return None
+        restaurant_ids.append(best_restaurant_id)
+        uncovered -= options[best_restaurant_id][1]
+    return restaurant_ids
+
+
+def solve_cover(products, options):
+    """Самый дешёвый набор ресторанов, которые вместе готовят все products.
+
+    options — {id ресторана: (стоимость, блюда ресторана)}.
+    Возвращает [(id ресторана, блюда, которые ему достаются)] или None, если блюда не покрыть.
+    Каждое блюдо достаётся самому дешёвому ресторану из набора, который его готовит.
+    """
+    products = sorted(set(products))
+    if not products:
+        return []
+    if len(products) <= MAX_EXACT_PRODUCTS:
+        restaurant_ids = solve_cover_exactly(products, options)
+    else:
+        restaurant_ids = solve_cover_greedily(products, options)
+    if restaurant_ids is None:
+        return None
+    restaurant_ids.sort(key=lambda restaurant_id: (options[restaurant_id][0], restaurant_id))
+    parts = {restaurant_id: [] for restaurant_id in restaurant_ids}
+    for product in products:
+        restaurant_id = next(
+            restaurant_id for restaurant_id in restaurant_ids if product in options[restaurant_id][1]
+        )
+        parts[restaurant_id].append(product)
+    return [(restaurant_id, parts[restaurant_id]) for restaurant_id in restaurant_ids if parts[restaurant_id]]
+
+
+def plan_split(index, lat, lng, products, radius_km=None):
+    """План приготовления заказа несколькими ресторанами: [(id ресторана, расстояние, блюда)] или None.
+
+    Стоимость ресторана в плане — расстояние от него до заказа.
+    """
+    options = index.partially_capable(lat, lng, products, radius_km=radius_km)
+    plan = solve_cover(products, options)
+    if plan is None:
+        return None
+    return [(restaurant_id, options[restaurant_id][0], parts) for restaurant_id, parts in plan]
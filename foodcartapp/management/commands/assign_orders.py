@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from foodcartapp.assignment import assign_orders
+
+
+class Command(BaseCommand):
+    help = 'Назначает рестораны необработанным заказам с учётом расстояния и загрузки ресторанов'
+
+    def handle(self, *args, **options):
+        assigned, unassigned = assign_orders()
+        self.stdout.write(f'Назначено заказов: {assigned}, без ресторана осталось: {unassigned}')
@@ -0,0 +1,106 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F
+
+from foodcartapp.models import Order, OrderPosition, Product
+
+# Запрос страницы заказов до переписывания: соединение заказов с позициями и группировка
+LEGACY_SQL = '''
+    SELECT count(*) FROM (
+        SELECT fo.id, SUM(fo3.quantity*fo3.price) as total_cost,
+               array_remove(array_agg(fo3.product_id), NULL) as product_ids
+        FROM foodcartapp_order fo
+        LEFT JOIN foodcartapp_orderposition fo3 ON fo.id = fo3.order_id
+        LEFT JOIN foodcartapp_restaurant fr ON fr.id = fo.restaurant_order_id
+        LEFT JOIN calcdistances_placecoord cp ON cp.id = fo.place_id
+        LEFT JOIN calcdistances_restaurantdistance rd
+            ON rd.order_place_id = fo.place_id AND rd.restaurant_place_id = fr.place_id
+        WHERE fo.status != 'OK'
+        GROUP BY fo.id, fr.id, cp.id, rd.id
+        ORDER BY fo.called_at DESC, fo.id
+    ) as orders
+'''
+
+
+class Command(BaseCommand):
+    help = 'Замеряет построение страницы заказов на большом числе открытых заказов, данные откатываются'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=50000)
+        parser.add_argument('--positions', type=int, default=3, help='позиций в заказе')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        generator = random.Random(options['seed'])
+        products = list(Product.objects.values_list('pk', 'price'))
+        if not products:
+            self.stderr.write('Нет товаров: загрузите хотя бы один товар')
+            return
+
+        with transaction.atomic():
+            orders = Order.objects.bulk_create(
+                [
+                    Order(firstname='Тест', lastname='Тестов', phonenumber='+79291000000', address=f'Адрес {number}')
+                    for number in range(options['orders'])
+                ],
+                batch_size=5000,
+            )
+            if not all(order.pk for order in orders):
+                orders = list(Order.objects.order_by('-pk')[:options['orders']])
+            OrderPosition.objects.bulk_create(
+                [
+                    OrderPosition(order=order, product_id=product_id, price=price, quantity=generator.randint(1, 3))
+                    for order in orders
+                    for product_id, price in generator.sample(products, min(len(products), options['positions']))
+                ],
+                batch_size=5000,
+            )
+            open_orders = Order.objects.exclude(status=Order.Status.COMPLETED).count()
+
+            started_at = time.perf_counter()
+            rows = Order.objects.get_dashboard_rows()
+            rows_seconds = time.perf_counter() - started_at
+
+            started_at = time.perf_counter()
+            Order.objects.get_data_orders()
+            page_seconds = time.perf_counter() - started_at
+
+            started_at = time.perf_counter()
+            keys = Order.objects.get_page_keys(settings.DASHBOARD_PAGE_SIZE)
+            page_keys = keys[:settings.DASHBOARD_PAGE_SIZE]
+            Order.objects.filter(pk__in=[order_id for called_at, order_id in page_keys]).get_data_orders()
+            first_page_seconds = time.perf_counter() - started_at
+
+            # Последняя страница: ключ берём от предпоследнего открытого заказа
+            last_keys = list(
+                Order.objects
+                .exclude(status=Order.Status.COMPLETED)
+                .order_by(F('called_at').asc(nulls_last=True), '-pk')
+                .values_list('called_at', 'pk')[:2]
+            )
+            started_at = time.perf_counter()
+            if len(last_keys) == 2:
+                keys = Order.objects.get_page_keys(settings.DASHBOARD_PAGE_SIZE, after=last_keys[1])
+                Order.objects.filter(pk__in=[order_id for called_at, order_id in keys]).get_data_orders()
+            last_page_seconds = time.perf_counter() - started_at
+
+            self.stdout.write(f'Открытых заказов: {open_orders}')
+            self.stdout.write(f'Заказы с позициями и расстояниями: {rows_seconds:.3f} с, {len(rows)} строк')
+            self.stdout.write(f'Данные страницы целиком: {page_seconds:.3f} с')
+            self.stdout.write(
+                f'Страница из {settings.DASHBOARD_PAGE_SIZE} заказов: первая {first_page_seconds:.3f} с, '
+                f'последняя {last_page_seconds:.3f} с'
+            )
+            if connection.vendor == 'postgresql':
+                started_at = time.perf_counter()
+                with connection.cursor() as cursor:
+                    cursor.execute(LEGACY_SQL)
+                    legacy_rows, = cursor.fetchone()
+                legacy_seconds = time.perf_counter() - started_at
+                self.stdout.write(f'Прежний запрос: {legacy_seconds:.3f} с, {legacy_rows} строк')
+
+            transaction.set_rollback(True)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from foodcartapp.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Сверяет сохранённые суммы заказов с суммами позиций и исправляет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='только показать расхождения')
+
+    def handle(self, *args, **options):
+        wrong_orders = list(
+            Order.objects.with_wrong_totals().order_by('pk').values_list('pk', 'total_cost', 'positions_total')
+        )
+        for order_id, total_cost, positions_total in wrong_orders:
+            self.stdout.write(f'Заказ {order_id}: сохранено {total_cost}, по позициям {positions_total}')
+        if wrong_orders and not options['dry_run']:
+            Order.objects.filter(pk__in=[order_id for order_id, *totals in wrong_orders]).recount_totals()
+        self.stdout.write(f'Заказов с неверной суммой: {len(wrong_orders)}')
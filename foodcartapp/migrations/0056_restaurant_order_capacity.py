@@ -0,0 +1,18 @@
+# Generated by Django 3.2.16 on 2026-10-18 04:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0055_auto_20221112_1312'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restaurant',
+            name='order_capacity',
+            field=models.PositiveSmallIntegerField(default=10, help_text='Сколько заказов ресторан может готовить одновременно при автоматическом назначении', verbose_name='заказов одновременно'),
+        ),
+    ]
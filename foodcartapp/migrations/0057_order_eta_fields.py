@@ -0,0 +1,44 @@
+# Generated by Django 3.2.16 on 2026-10-18 04:46
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_queued_orders(apps, schema_editor):
+    Order = apps.get_model('foodcartapp', 'Order')
+    Restaurant = apps.get_model('foodcartapp', 'Restaurant')
+    queued = (
+        Order.objects
+        .filter(restaurant_order=OuterRef('pk'), status__in=['UN', 'RS'])
+        .values('restaurant_order')
+        .annotate(orders=Count('pk'))
+        .values('orders')
+    )
+    Restaurant.objects.update(queued_orders=Coalesce(Subquery(queued), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0056_restaurant_order_capacity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='cooking_started_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='передан в ресторан'),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='prep_minutes',
+            field=models.FloatField(blank=True, editable=False, help_text='Скользящее среднее по заказам, которые ресторан передал курьерам', null=True, verbose_name='время приготовления, мин'),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='queued_orders',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Назначенные ресторану и ещё не переданные курьеру заказы, счётчик обновляется при смене статуса', verbose_name='заказов в очереди'),
+        ),
+        migrations.RunPython(count_queued_orders, migrations.RunPython.noop),
+    ]
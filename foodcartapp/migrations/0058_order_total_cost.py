@@ -0,0 +1,36 @@
+# Generated by Django 3.2.16 on 2026-10-18 04:54
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def count_order_totals(apps, schema_editor):
+    Order = apps.get_model('foodcartapp', 'Order')
+    OrderPosition = apps.get_model('foodcartapp', 'OrderPosition')
+    positions_total = (
+        OrderPosition.objects
+        .filter(order=OuterRef('pk'))
+        .values('order')
+        .annotate(total=Sum(F('quantity') * F('price'), output_field=DecimalField(max_digits=10, decimal_places=2)))
+        .values('total')
+    )
+    Order.objects.update(total_cost=Coalesce(Subquery(positions_total), Decimal('0')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0057_order_eta_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total_cost',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, help_text='Сумма позиций заказа, пересчитывается при изменении позиций', max_digits=10, verbose_name='сумма заказа'),
+        ),
+        migrations.RunPython(count_order_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.16 on 2026-10-18 04:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0058_order_total_cost'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('status', 'OK'), _negated=True), fields=['-called_at', 'id'], name='order_open_called_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('status', 'OK'), _negated=True), fields=['status', '-called_at', 'id'], name='order_open_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('status', 'OK'), _negated=True), fields=['payment_method', '-called_at', 'id'], name='order_open_payment_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('status', 'OK'), _negated=True), fields=['restaurant_order', '-called_at', 'id'], name='order_open_restaurant_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.16 on 2026-10-18 05:01
+
+from django.db import migrations, models
+
+
+def create_version(apps, schema_editor):
+    DashboardVersion = apps.get_model('foodcartapp', 'DashboardVersion')
+    DashboardVersion.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0059_order_open_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0, verbose_name='версия')),
+                ('reset_version', models.PositiveBigIntegerField(default=0, help_text='Последнее изменение меню ресторанов или удаление заказа', verbose_name='версия полного обновления')),
+            ],
+            options={
+                'verbose_name': 'версия страницы заказов',
+                'verbose_name_plural': 'версии страницы заказов',
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='version',
+            field=models.PositiveBigIntegerField(db_index=True, default=0, editable=False, help_text='Версия последнего изменения, по ней страница заказов получает только изменившиеся заказы', verbose_name='версия'),
+        ),
+        migrations.RunPython(create_version, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.16 on 2026-10-18 05:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0060_dashboard_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('place__isnull', True), models.Q(('status', 'OK'), _negated=True)), fields=['id'], name='order_open_unplaced_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.16 on 2026-10-18 05:42
+
+import uuid
+
+from django.db import migrations, models
+
+
+def fill_public_ids(apps, schema_editor):
+    # Значение по умолчанию AddField вычисляется один раз, поэтому каждому заказу — свой uuid
+    Order = apps.get_model('foodcartapp', 'Order')
+    orders = list(Order.objects.only('pk'))
+    for order in orders:
+        order.public_id = uuid.uuid4()
+    Order.objects.bulk_update(orders, ['public_id'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0061_order_open_unplaced_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='public_id',
+            field=models.UUIDField(editable=False, null=True, verbose_name='публичный id'),
+        ),
+        migrations.RunPython(fill_public_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='public_id',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, help_text='Выдаётся клиенту при оформлении заказа, по нему клиент узнаёт прогноз доставки', unique=True, verbose_name='публичный id'),
+        ),
+    ]
@@ -1,9 +1,88 @@
-from django.db import models
+import uuid
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connections, models, transaction
+from django.db.models.functions import Coalesce, Greatest
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import MinValueValidator
 from phonenumber_field.modelfields import PhoneNumberField
-from calcdistances.models import PlaceCoord
+from calcdistances.geometry import filter_within_km, order_by_distance
+from calcdistances.models import GeocodeJob, PlaceCoord, RestaurantDistance
+
+
+DashboardOrder = namedtuple('DashboardOrder', [
+    'order_id', 'order_position_id', 'product_ids', 'total_cost',
+    'order_address', 'restaurant_order_id', 'order_place_id', 'restaurant_place_id',
+    'name', 'restaurant_address', 'queued_orders', 'order_capacity', 'prep_minutes', 'cooking_started_at',
+    'order_lng', 'order_lat', 'status', 'payment_method', 'called_at',
+    'first_name', 'last_name', 'phone', 'order_comment',
+    'dist', 'route_dist', 'route_duration',
+])
+
+
+class RestaurantQuerySet(models.QuerySet):
+    def enqueue_geocoding(self):
+        jobs = [
+            GeocodeJob(target=GeocodeJob.Target.RESTAURANT, object_id=restaurant_id, address=address)
+            for restaurant_id, address in self.exclude(address='').values_list('pk', 'address')
+        ]
+        GeocodeJob.objects.bulk_create(jobs, ignore_conflicts=True)
+
+    @staticmethod
+    def reindex(restaurant_ids):
+        # Импорт здесь: модуль индекса сам зависит от моделей ресторанов
+        from calcdistances.spatial import update_indexed_restaurants
+        update_indexed_restaurants(restaurant_ids)
+        # Рестораны, подходящие заказам, меняются сразу у многих заказов — страница заказов перестраивается целиком
+        DashboardVersion.objects.bump(reset=True)
+
+    def recount_queues(self):
+        """Пересчитывает счётчики очереди заказов после массовых изменений, которые не вызывают сигналы."""
+        queued = (
+            Order.objects
+            .filter(restaurant_order=models.OuterRef('pk'), status__in=Order.QUEUED_STATUSES)
+            .values('restaurant_order')
+            .annotate(orders=models.Count('pk'))
+            .values('orders')
+        )
+        return self.update(queued_orders=Coalesce(models.Subquery(queued), 0))
+
+    def within_km(self, lat, lng, km):
+        return filter_within_km(self, lat, lng, km, prefix='place__')
+
+    def nearest_to(self, lat, lng):
+        return order_by_distance(self, lat, lng, prefix='place__')
+
+    # Массовые операции не вызывают сигналы, поэтому смену адреса и места отслеживаем здесь
+    def update(self, **kwargs):
+        if not {'address', 'place', 'place_id'} & kwargs.keys():
+            return super().update(**kwargs)
+        restaurant_ids = list(self.values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        if 'address' in kwargs:
+            Restaurant.objects.filter(pk__in=restaurant_ids).enqueue_geocoding()
+        if 'place' in kwargs or 'place_id' in kwargs:
+            self.reindex(restaurant_ids)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        restaurant_ids = [obj.pk for obj in objs if obj.pk]
+        Restaurant.objects.filter(pk__in=restaurant_ids).enqueue_geocoding()
+        self.reindex(restaurant_ids)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        restaurant_ids = [obj.pk for obj in objs]
+        if 'address' in fields:
+            Restaurant.objects.filter(pk__in=restaurant_ids).enqueue_geocoding()
+        if 'place' in fields or 'place_id' in fields:
+            self.reindex(restaurant_ids)
+        return rows
 
 
 class Restaurant(models.Model):
@@ -28,6 +107,26 @@ class Restaurant(models.Model):
         blank=True,
         on_delete=models.SET_NULL,
     )
+    order_capacity = models.PositiveSmallIntegerField(
+        'заказов одновременно',
+        default=10,
+        help_text='Сколько заказов ресторан может готовить одновременно при автоматическом назначении',
+    )
+    queued_orders = models.PositiveIntegerField(
+        'заказов в очереди',
+        default=0,
+        editable=False,
+        help_text='Назначенные ресторану и ещё не переданные курьеру заказы, счётчик обновляется при смене статуса',
+    )
+    prep_minutes = models.FloatField(
+        'время приготовления, мин',
+        blank=True,
+        null=True,
+        editable=False,
+        help_text='Скользящее среднее по заказам, которые ресторан передал курьерам',
+    )
+
+    objects = RestaurantQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'ресторан'
@@ -104,6 +203,101 @@ class Product(models.Model):
         return self.name
 
 
+class DashboardVersionQuerySet(models.QuerySet):
+    def bump(self, reset=False):
+        """Версия изменений текущей транзакции.
+
+        В Postgres это номер транзакции txid_current(): он выдаётся без блокировок, и записи заказов не ждут
+        друг друга. Номера идут с пропусками, а транзакции фиксируются не в порядке номеров, поэтому
+        читатели идут не от последней версии, а от самой старой незавершённой транзакции, см. get_versions.
+        В остальных базах записи и так выполняются по одной, и версия — счётчик в строке pk=1.
+        С reset=True отмечает изменение, после которого страницу заказов проще перестроить целиком:
+        строка pk=1 тогда блокируется до конца транзакции, но меню и рестораны меняются редко.
+        """
+        connection = connections[self.db]
+        with transaction.atomic(using=self.db, savepoint=False):
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT txid_current()')
+                    version = cursor.fetchone()[0]
+                if reset:
+                    fields = {'reset_version': Greatest('reset_version', models.Value(version))}
+                    if not self.filter(pk=1).update(**fields):
+                        self.get_or_create(pk=1)
+                        self.filter(pk=1).update(**fields)
+                return version
+            fields = {'version': models.F('version') + 1}
+            if reset:
+                fields['reset_version'] = models.F('version') + 1
+            if not self.filter(pk=1).update(**fields):
+                self.get_or_create(pk=1)
+                self.filter(pk=1).update(**fields)
+            return self.filter(pk=1).values_list('version', flat=True).get()
+
+    def get_versions(self):
+        """(наименьшая версия, которую страница могла ещё не увидеть, последняя версия полного обновления).
+
+        Все изменения с версиями меньше первой уже зафиксированы и видны следующим запросам.
+        В Postgres это самая старая транзакция, ещё не завершённая к этому моменту: изменения от неё
+        и до последней версии страница получит повторно, и это безопасно — строки просто заменятся.
+        """
+        version, reset_version = self.filter(pk=1).values_list('version', 'reset_version').first() or (0, 0)
+        connection = connections[self.db]
+        if connection.vendor != 'postgresql':
+            return version + 1, reset_version
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT txid_snapshot_xmin(txid_current_snapshot())')
+            return cursor.fetchone()[0], reset_version
+
+
+class DashboardVersion(models.Model):
+    version = models.PositiveBigIntegerField('версия', default=0)
+    reset_version = models.PositiveBigIntegerField(
+        'версия полного обновления',
+        default=0,
+        help_text='Последнее изменение меню ресторанов или удаление заказа'
+    )
+
+    objects = DashboardVersionQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'версия страницы заказов'
+        verbose_name_plural = 'версии страницы заказов'
+
+    def __str__(self):
+        return str(self.version)
+
+
+class RestaurantMenuItemQuerySet(models.QuerySet):
+    # Поля, от которых зависит, какие блюда в продаже в ресторанах
+    menu_fields = {'restaurant', 'restaurant_id', 'product', 'product_id', 'availability'}
+
+    # Массовые операции не вызывают сигналы, поэтому меню ресторанов в индексе перечитываем здесь
+    def update(self, **kwargs):
+        if not self.menu_fields & kwargs.keys():
+            return super().update(**kwargs)
+        restaurant_ids = set(self.values_list('restaurant', flat=True))
+        rows = super().update(**kwargs)
+        restaurant = kwargs.get('restaurant', kwargs.get('restaurant_id'))
+        if restaurant is not None:
+            restaurant_ids.add(getattr(restaurant, 'pk', restaurant))
+        Restaurant.objects.reindex(restaurant_ids)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        Restaurant.objects.reindex({obj.restaurant_id for obj in objs})
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if not self.menu_fields & set(fields):
+            return super().bulk_update(objs, fields, *args, **kwargs)
+        restaurant_ids = set(self.filter(pk__in=[obj.pk for obj in objs]).values_list('restaurant', flat=True))
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        Restaurant.objects.reindex(restaurant_ids | {obj.restaurant_id for obj in objs})
+        return rows
+
+
 class RestaurantMenuItem(models.Model):
     restaurant = models.ForeignKey(
         Restaurant,
@@ -123,6 +317,8 @@ class RestaurantMenuItem(models.Model):
         db_index=True
     )
 
+    objects = RestaurantMenuItemQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'пункт меню ресторана'
         verbose_name_plural = 'пункты меню ресторана'
@@ -135,6 +331,221 @@ class RestaurantMenuItem(models.Model):
 
 
 class OrderQuerySet(models.QuerySet):
+    # Поля, от которых зависят поездки курьеров
+    dispatch_fields = {'status', 'place', 'place_id', 'restaurant_order', 'restaurant_order_id'}
+    # Поля, от которых зависят очереди ресторанов
+    queue_fields = {'status', 'restaurant_order', 'restaurant_order_id'}
+
+    def enqueue_geocoding(self):
+        jobs = [
+            GeocodeJob(target=GeocodeJob.Target.ORDER, object_id=order_id, address=address)
+            for order_id, address in (
+                self.exclude(status=Order.Status.COMPLETED).exclude(address='').values_list('pk', 'address')
+            )
+        ]
+        GeocodeJob.objects.bulk_create(jobs, ignore_conflicts=True)
+
+    @staticmethod
+    def invalidate_batches():
+        # Импорт здесь: модуль поездок сам зависит от моделей заказов
+        from foodcartapp.dispatch import invalidate_courier_batches
+        invalidate_courier_batches()
+
+    # Массовые операции не вызывают сигналы, поэтому смену статуса отслеживаем здесь.
+    # Новая версия и сами изменения фиксируются одной транзакцией, см. DashboardVersionQuerySet.bump
+    def update(self, **kwargs):
+        with transaction.atomic():
+            kwargs['version'] = DashboardVersion.objects.bump()
+            restaurant_ids = set()
+            if self.queue_fields & kwargs.keys():
+                restaurant_ids = set(self.exclude(restaurant_order=None).values_list('restaurant_order', flat=True))
+            rows = super().update(**kwargs)
+        if 'address' in kwargs:
+            self.enqueue_geocoding()
+        if self.dispatch_fields & kwargs.keys():
+            self.invalidate_batches()
+        if self.queue_fields & kwargs.keys():
+            restaurant = kwargs.get('restaurant_order', kwargs.get('restaurant_order_id'))
+            if restaurant is not None:
+                restaurant_ids.add(getattr(restaurant, 'pk', restaurant))
+            Restaurant.objects.filter(pk__in=restaurant_ids).recount_queues()
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        with transaction.atomic():
+            version = DashboardVersion.objects.bump()
+            for obj in objs:
+                obj.version = version
+            return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        with transaction.atomic():
+            version = DashboardVersion.objects.bump()
+            for obj in objs:
+                obj.version = version
+            # Прежние рестораны заказов после обновления уже не узнать, поэтому запоминаем их заранее
+            restaurant_ids = set()
+            if self.queue_fields & set(fields):
+                restaurant_ids = set(
+                    self.filter(pk__in=[obj.pk for obj in objs])
+                    .exclude(restaurant_order=None)
+                    .values_list('restaurant_order', flat=True)
+                )
+            rows = super().bulk_update(objs, [*fields, 'version'], *args, **kwargs)
+        if 'address' in fields:
+            Order.objects.filter(pk__in=[obj.pk for obj in objs]).enqueue_geocoding()
+        if self.dispatch_fields & set(fields):
+            self.invalidate_batches()
+        if self.queue_fields & set(fields):
+            restaurant_ids |= {obj.restaurant_order_id for obj in objs if obj.restaurant_order_id}
+            Restaurant.objects.filter(pk__in=restaurant_ids).recount_queues()
+        return rows
+
+    @staticmethod
+    def get_positions_total():
+        positions_total = (
+            OrderPosition.objects
+            .filter(order=models.OuterRef('pk'))
+            .values('order')
+            .annotate(total=models.Sum(
+                models.F('quantity') * models.F('price'),
+                output_field=models.DecimalField(max_digits=10, decimal_places=2),
+            ))
+            .values('total')
+        )
+        return Coalesce(models.Subquery(positions_total), Decimal('0'))
+
+    def recount_totals(self):
+        """Пересчитывает суммы заказов по позициям после массовых изменений, которые не вызывают сигналы."""
+        return self.update(total_cost=self.get_positions_total())
+
+    def with_wrong_totals(self):
+        """Заказы, у которых сохранённая сумма разошлась с суммой позиций."""
+        return (
+            self
+            .annotate(positions_total=self.get_positions_total())
+            .exclude(total_cost=models.F('positions_total'))
+        )
+
+    def get_page_keys(self, size, after=None):
+        """Ключи (время звонка, id) незавершённых заказов страницы менеджера после ключа after, не больше size + 1.
+
+        Порядок как на странице: сначала заказы без звонка по id, затем по убыванию времени звонка.
+        Каждая часть читается диапазоном индекса от after, а не пропуском предыдущих страниц,
+        поэтому время не зависит от того, сколько заказов стоит перед страницей.
+        """
+        open_orders = self.exclude(status=Order.Status.COMPLETED)
+        after_called_at, after_id = after or (None, None)
+        keys = []
+        if after_called_at is None:
+            not_called = open_orders.filter(called_at__isnull=True)
+            if after_id is not None:
+                not_called = not_called.filter(pk__gt=after_id)
+            keys = list(not_called.order_by('pk').values_list('called_at', 'pk')[:size + 1])
+        if len(keys) <= size:
+            called = open_orders.filter(called_at__isnull=False)
+            if after_called_at is not None:
+                called = (
+                    called
+                    .filter(called_at__lte=after_called_at)
+                    .exclude(called_at=after_called_at, pk__lte=after_id)
+                )
+            keys += called.order_by('-called_at', 'pk').values_list('called_at', 'pk')[:size + 1 - len(keys)]
+        return keys
+
+    def get_dashboard_rows(self):
+        """Незавершённые заказы для страницы менеджера в порядке звонков.
+
+        Заказы, их позиции и расстояния до назначенных ресторанов читаются отдельными запросами
+        без соединения заказов с позициями, поэтому число строк растёт с числом открытых заказов.
+        Сумма заказа хранится в самом заказе, из позиций берутся только блюда.
+        """
+        open_orders = self.exclude(status=Order.Status.COMPLETED)
+        orders = list(
+            open_orders
+            .order_by(models.F('called_at').desc(nulls_first=True), 'pk')
+            .values_list(
+                'pk', 'address', 'total_cost', 'restaurant_order', 'place',
+                'restaurant_order__name', 'restaurant_order__address', 'restaurant_order__place',
+                'restaurant_order__queued_orders', 'restaurant_order__order_capacity',
+                'restaurant_order__prep_minutes', 'cooking_started_at',
+                'place__lng', 'place__lat',
+                'status', 'payment_method', 'called_at',
+                'firstname', 'lastname', 'phonenumber', 'comment',
+                named=True,
+            )
+        )
+
+        positions = defaultdict(list)
+        for order_id, position_id, product_id in (
+            OrderPosition.objects
+            .filter(order__in=open_orders.values('pk'))
+            .order_by('pk')
+            .values_list('order', 'pk', 'product')
+        ):
+            positions[order_id].append((position_id, product_id))
+
+        # Расстояния нужны только до назначенных ресторанов
+        distance_pairs = {
+            (order.place, order.restaurant_order__place)
+            for order in orders
+            if order.restaurant_order and order.place and order.restaurant_order__place
+        }
+        distances = {}
+        if distance_pairs:
+            distances = {
+                (order_place_id, restaurant_place_id): (distance, route_distance, route_duration)
+                for order_place_id, restaurant_place_id, distance, route_distance, route_duration in (
+                    RestaurantDistance.objects
+                    .filter(
+                        order_place__in={order_place_id for order_place_id, restaurant_place_id in distance_pairs},
+                        restaurant_place__in={
+                            restaurant_place_id for order_place_id, restaurant_place_id in distance_pairs
+                        },
+                    )
+                    .values_list('order_place', 'restaurant_place', 'distance', 'route_distance', 'route_duration')
+                )
+            }
+
+        rows = []
+        for order in orders:
+            order_positions = positions.get(order.pk, [])
+            dist, route_dist, route_duration = (None, None, None)
+            if order.restaurant_order:
+                dist, route_dist, route_duration = distances.get(
+                    (order.place, order.restaurant_order__place), (None, None, None)
+                )
+            rows.append(DashboardOrder(
+                order_id=order.pk,
+                order_position_id=order_positions[0][0] if order_positions else None,
+                product_ids=[product_id for position_id, product_id in order_positions],
+                total_cost=order.total_cost,
+                order_address=order.address,
+                restaurant_order_id=order.restaurant_order,
+                order_place_id=order.place,
+                restaurant_place_id=order.restaurant_order__place,
+                name=order.restaurant_order__name,
+                restaurant_address=order.restaurant_order__address,
+                queued_orders=order.restaurant_order__queued_orders,
+                order_capacity=order.restaurant_order__order_capacity,
+                prep_minutes=order.restaurant_order__prep_minutes,
+                cooking_started_at=order.cooking_started_at,
+                order_lng=order.place__lng,
+                order_lat=order.place__lat,
+                status=order.status,
+                payment_method=order.payment_method,
+                called_at=order.called_at,
+                first_name=order.firstname,
+                last_name=order.lastname,
+                phone=order.phonenumber,
+                order_comment=order.comment,
+                dist=dist,
+                route_dist=route_dist,
+                route_duration=route_duration,
+            ))
+        return rows
 
     @staticmethod
     def add_data_order(order_id, order, prepare):
@@ -150,7 +561,6 @@ class OrderQuerySet(models.QuerySet):
         }
         return {
             'address': order.order_address,
-            'hash': order.hash_order,
             'pk': order_id,
             'status': status[order.status],
             'payment_method': status[order.payment_method],
@@ -159,94 +569,153 @@ class OrderQuerySet(models.QuerySet):
             'total_cost': order.total_cost,
             'comment': order.order_comment,
             'prepare': prepare,
-            'order_position_id': order.order_position_id
+            'order_position_id': order.order_position_id,
+            'called_at': order.called_at,
         }
 
     def get_data_orders(self):
-        restaurants_available = {}
-        orders_restaurant = self.raw(
-            '''
-            select *
-            from (
-            select
-                fr2.id, restaurant_id, fo.id as order_id, fr2.name,
-                (array_agg(fo3.id))[1] as order_position_id,
-                fo.address as order_address, fr2.address as restaurant_address,
-                fo.restaurant_order_id, COUNT(*) as count_restaurant,
-                cp.lng order_lng, cp.lat order_lat,
-                cp1.lng restaurant_lng, cp1.lat restaurant_lat,
-                cp.hash hash_order, cp1.hash hash_restaurant,
-                fo.status, fo.payment_method, fo.called_at,
-                fo.firstname as first_name, fo.lastname as last_name,
-                fo.phonenumber as phone, fo.comment as order_comment,
-                round((acos(sind(cp.lat)*sind(cp1.lat)
-                       +cosd(cp.lat)*cosd(cp1.lat)*cosd(cp.lng
-                       -cp1.lng))*6371)::numeric, 2) as dist,
-                (SELECT SUM(quantity*price)
-                FROM foodcartapp_orderposition
-                GROUP BY order_id
-                HAVING order_id = fo.id) as total_cost
-            FROM foodcartapp_order fo
-            LEFT JOIN foodcartapp_orderposition fo3 ON fo.id = fo3.order_id
-            LEFT JOIN foodcartapp_product fp2 ON fp2.id = fo3.product_id
-            LEFT JOIN foodcartapp_restaurantmenuitem fr ON fr.product_id = fp2.id
-            LEFT JOIN foodcartapp_restaurant fr2 ON fr2.id = fr.restaurant_id
-            LEFT JOIN calcdistances_placecoord cp ON cp.id = fo.place_id
-            LEFT JOIN calcdistances_placecoord cp1 ON cp1.id = fr2.place_id
-            WHERE (fr.availability = TRUE OR fo3.order_id ISNULL) and fo.status != 'OK'
-            group by
-                fo.id, fr2.name, restaurant_id, fr2.id,
-                fo.address, fr2.address, cp.lng, cp.lat, cp1.lng, cp1.lat,
-                cp.hash, cp1.hash
-            ) as foo
-            where
-                foo.count_restaurant = (
-                    SELECT COUNT(*)
-                    from foodcartapp_orderposition fo4
-                    GROUP BY fo4.order_id
-                    HAVING fo4.order_id = foo.order_id
+        # Импорт здесь: модуль индекса сам зависит от моделей ресторанов
+        from calcdistances.spatial import get_restaurant_index
+        from foodcartapp.eta import estimate_minutes, get_travel_minutes
+        from foodcartapp.fulfilment import plan_split
+
+        orders = self.get_dashboard_rows()
+        # Рестораны для необработанных заказов подбираем по индексу, а не перебором в SQL
+        index = get_restaurant_index()
+        # С дорожным графом берём всех в радиусе доставки: ближайшие по прямой не всегда ближайшие по дорогам
+        nearest_count = None if settings.ROUTING_GRAPH_PATH else settings.DASHBOARD_NEAREST_RESTAURANTS
+        candidates = {}
+        split_plans = {}
+        for order in orders:
+            if order.restaurant_order_id or not order.order_position_id:
+                continue
+            if order.order_lat is None or order.order_lng is None:
+                candidates[order.order_id] = [
+                    (restaurant_id, None) for restaurant_id in index.capable(order.product_ids)
+                ]
+                continue
+            nearest = index.nearest(
+                float(order.order_lat),
+                float(order.order_lng),
+                order.product_ids,
+                k=nearest_count,
+                radius_km=settings.DELIVERY_RADIUS_KM or None,
+            )
+            candidates[order.order_id] = [
+                (restaurant_id, Decimal(f'{distance:.2f}')) for restaurant_id, distance in nearest
+            ] + [(restaurant_id, None) for restaurant_id in index.unplaced_capable(order.product_ids)]
+            # Целиком заказ никто не приготовит — ищем, какими ресторанами приготовить его частями
+            if not candidates[order.order_id]:
+                split_plans[order.order_id] = plan_split(
+                    index,
+                    float(order.order_lat),
+                    float(order.order_lng),
+                    order.product_ids,
+                    radius_km=settings.DELIVERY_RADIUS_KM or None,
+                )
+
+        restaurant_ids = {
+            restaurant_id
+            for order_candidates in candidates.values()
+            for restaurant_id, dist in order_candidates
+        } | {
+            restaurant_id
+            for plan in split_plans.values() if plan
+            for restaurant_id, distance, product_ids in plan
+        }
+        restaurants = Restaurant.objects.only(
+            'name', 'address', 'place', 'queued_orders', 'order_capacity', 'prep_minutes'
+        ).in_bulk(restaurant_ids)
+        products = Product.objects.only('name').in_bulk({
+            product_id
+            for plan in split_plans.values() if plan
+            for restaurant_id, distance, product_ids in plan
+            for product_id in product_ids
+        })
+        routes = {}
+        if settings.ROUTING_GRAPH_PATH:
+            routes = {
+                (order_place_id, restaurant_place_id): (route_distance, route_duration)
+                for order_place_id, restaurant_place_id, route_distance, route_duration in (
+                    RestaurantDistance.objects
+                    .filter(
+                        order_place__in={order.order_place_id for order in orders if order.order_id in candidates},
+                        restaurant_place__in={restaurant.place_id for restaurant in restaurants.values()},
+                        route_distance__isnull=False,
                     )
-                or foo.order_position_id ISNULL
-            ORDER BY foo.called_at DESC, foo.order_id, foo.dist
-            '''
-        )
-        order_id = 0
-        restaurants = []
-        for order in orders_restaurant:
-            if order.order_id != order_id:
-                order_id = order.order_id
-                restaurants = []
-            if not order.restaurant_order_id:
-                restaurants.append(
-                    {
-                        'restaurant_id': order.restaurant_id,
+                    .values_list('order_place_id', 'restaurant_place_id', 'route_distance', 'route_duration')
+                )
+            }
+        restaurants_available = {}
+        for order in orders:
+            if order.restaurant_order_id:
+                restaurants_available[order.order_id] = {
+                    'restaurants': [{
+                        'restaurant_id': order.restaurant_order_id,
                         'name': order.name,
                         'address': order.restaurant_address,
-                        'hash': order.hash_restaurant,
-                        'dist': order.dist,
-
-                    }
+                        'dist': order.route_dist or order.dist,
+                        'duration': order.route_duration,
+                        'eta': estimate_minutes(
+                            order.status,
+                            get_travel_minutes(order.dist, order.route_duration),
+                            prep_minutes=order.prep_minutes,
+                            orders_ahead=max(0, order.queued_orders - 1),
+                            order_capacity=order.order_capacity,
+                            cooking_started_at=order.cooking_started_at,
+                        ),
+                    }]
+                } | self.add_data_order(order.order_id, order, prepare=True)
+                continue
+            order_restaurants = [
+                {
+                    'restaurant_id': restaurant_id,
+                    'name': restaurants[restaurant_id].name,
+                    'address': restaurants[restaurant_id].address,
+                    'dist': dist,
+                    'duration': None,
+                }
+                for restaurant_id, dist in candidates.get(order.order_id, [])
+                if restaurant_id in restaurants
+            ]
+            if settings.ROUTING_GRAPH_PATH:
+                for restaurant in order_restaurants:
+                    route = routes.get((order.order_place_id, restaurants[restaurant['restaurant_id']].place_id))
+                    if route:
+                        restaurant['dist'], restaurant['duration'] = route
+                # Маршруты досчитывает фоновый обработчик, до тех пор время в пути оцениваем по прямой
+                order_restaurants.sort(
+                    key=lambda restaurant: get_travel_minutes(restaurant['dist'], restaurant['duration']) or 0
                 )
-                restaurants_available.update(
-                    {
-                        order_id: {
-                            'restaurants': restaurants
-                        } | self.add_data_order(order_id, order, prepare=False)
-                    }
-                )
-            elif order.restaurant_id == order.restaurant_order_id:
-                restaurants_available.update(
-                    {
-                        order_id: {
-                            'restaurants':
-                                [{'restaurant_id': order.restaurant_order_id,
-                                  'name': order.name,
-                                  'address': order.restaurant_address,
-                                  'hash': order.hash_restaurant,
-                                  'dist': order.dist}]
-                        } | self.add_data_order(order_id, order, prepare=True)
-                    }
+                order_restaurants = [
+                    restaurant for restaurant in order_restaurants if restaurant['dist'] is not None
+                ][:settings.DASHBOARD_NEAREST_RESTAURANTS] + [
+                    restaurant for restaurant in order_restaurants if restaurant['dist'] is None
+                ]
+            for restaurant in order_restaurants:
+                candidate = restaurants[restaurant['restaurant_id']]
+                restaurant['eta'] = estimate_minutes(
+                    order.status,
+                    get_travel_minutes(restaurant['dist'], restaurant['duration']),
+                    prep_minutes=candidate.prep_minutes,
+                    orders_ahead=candidate.queued_orders,
+                    order_capacity=candidate.order_capacity,
                 )
+            split_plan = [
+                {
+                    'restaurant_id': restaurant_id,
+                    'name': restaurants[restaurant_id].name,
+                    'address': restaurants[restaurant_id].address,
+                    'dist': Decimal(f'{distance:.2f}'),
+                    'products': [products[product_id].name for product_id in product_ids if product_id in products],
+                }
+                for restaurant_id, distance, product_ids in split_plans.get(order.order_id) or []
+                if restaurant_id in restaurants
+            ]
+            restaurants_available[order.order_id] = {
+                'restaurants': order_restaurants,
+                'split_plan': split_plan,
+            } | self.add_data_order(order.order_id, order, prepare=False)
 
         return restaurants_available
 
@@ -263,6 +732,9 @@ class Order(models.Model):
         REMOTE = 'RM', _('Электронно')
         EMPTY = 'NO', _('Не назначен')
 
+    # Заказы, которые стоят в очереди ресторана: назначены, но ещё не переданы курьеру
+    QUEUED_STATUSES = [Status.UNPROCESSED, Status.RESTAURANT]
+
     status = models.CharField(
         max_length=2,
         choices=Status.choices,
@@ -312,6 +784,19 @@ class Order(models.Model):
         blank=True,
         null=True
     )
+    cooking_started_at = models.DateTimeField(
+        verbose_name='передан в ресторан',
+        blank=True,
+        null=True
+    )
+    total_cost = models.DecimalField(
+        'сумма заказа',
+        max_digits=10,
+        decimal_places=2,
+        default=0,
+        editable=False,
+        help_text='Сумма позиций заказа, пересчитывается при изменении позиций'
+    )
     delivered_at = models.DateTimeField(
         verbose_name='время доставки',
         blank=True,
@@ -334,17 +819,100 @@ class Order(models.Model):
         blank=True,
         on_delete=models.SET_NULL,
     )
+    version = models.PositiveBigIntegerField(
+        'версия',
+        default=0,
+        db_index=True,
+        editable=False,
+        help_text='Версия последнего изменения, по ней страница заказов получает только изменившиеся заказы'
+    )
+    public_id = models.UUIDField(
+        'публичный id',
+        default=uuid.uuid4,
+        unique=True,
+        editable=False,
+        help_text='Выдаётся клиенту при оформлении заказа, по нему клиент узнаёт прогноз доставки'
+    )
 
     objects = OrderQuerySet.as_manager()
 
     class Meta:
         ordering = ['called_at', '-registrated_at', 'address']
+        # Страница менеджера листает незавершённые заказы по (время звонка, id), в том числе с фильтрами
+        indexes = [
+            models.Index(
+                fields=['-called_at', 'id'],
+                condition=~models.Q(status='OK'),
+                name='order_open_called_idx',
+            ),
+            models.Index(
+                fields=['status', '-called_at', 'id'],
+                condition=~models.Q(status='OK'),
+                name='order_open_status_idx',
+            ),
+            models.Index(
+                fields=['payment_method', '-called_at', 'id'],
+                condition=~models.Q(status='OK'),
+                name='order_open_payment_idx',
+            ),
+            models.Index(
+                fields=['restaurant_order', '-called_at', 'id'],
+                condition=~models.Q(status='OK'),
+                name='order_open_restaurant_idx',
+            ),
+            # Фоновый обработчик ищет заказы, которым ещё не нашлось место
+            models.Index(
+                fields=['id'],
+                condition=models.Q(place__isnull=True) & ~models.Q(status='OK'),
+                name='order_open_unplaced_idx',
+            ),
+        ]
         verbose_name = 'заказ'
         verbose_name_plural = 'заказы'
 
     def __str__(self):
         return f'{self.firstname} {self.lastname}: {self.address}'
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            self.version = DashboardVersion.objects.bump()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+            super().save(*args, **kwargs)
+
+
+class OrderPositionQuerySet(models.QuerySet):
+    # Поля, от которых зависит сумма заказа
+    total_fields = {'order', 'order_id', 'quantity', 'price'}
+
+    # Массовые операции не вызывают сигналы, поэтому суммы заказов пересчитываем здесь
+    def bulk_create(self, objs, *args, recount_totals=True, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        if recount_totals:
+            Order.objects.filter(pk__in={obj.order_id for obj in objs}).recount_totals()
+        return objs
+
+    def update(self, **kwargs):
+        if not self.total_fields & kwargs.keys():
+            return super().update(**kwargs)
+        order_ids = set(self.values_list('order', flat=True))
+        rows = super().update(**kwargs)
+        order = kwargs.get('order', kwargs.get('order_id'))
+        if order is not None:
+            order_ids.add(getattr(order, 'pk', order))
+        Order.objects.filter(pk__in=order_ids).recount_totals()
+        return rows
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if not self.total_fields & set(fields):
+            return super().bulk_update(objs, fields, *args, **kwargs)
+        # Прежние заказы позиций после обновления уже не узнать, поэтому запоминаем их заранее
+        order_ids = set(self.filter(pk__in=[obj.pk for obj in objs]).values_list('order', flat=True))
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        order_ids |= {obj.order_id for obj in objs}
+        Order.objects.filter(pk__in=order_ids).recount_totals()
+        return rows
+
 
 class OrderPosition(models.Model):
     product = models.ForeignKey(
@@ -370,6 +938,8 @@ class OrderPosition(models.Model):
         validators=[MinValueValidator(0)]
     )
 
+    objects = OrderPositionQuerySet.as_manager()
+
     class Meta:
         ordering = ['order', 'product']
         verbose_name = 'пункт позиции заказа'
@@ -0,0 +1,148 @@
+from django.db.models import DEFERRED
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from calcdistances.addresses import get_address_hash
+from calcdistances.models import PlaceCoord
+from calcdistances.spatial import update_indexed_menu_item, update_indexed_restaurants
+from foodcartapp.dispatch import invalidate_courier_batches
+from foodcartapp.eta import learn_prep_time, update_queues
+from foodcartapp.models import DashboardVersion, Order, OrderPosition, Restaurant, RestaurantMenuItem
+
+
+@receiver(post_init, sender=Restaurant)
+def remember_restaurant_address(sender, instance, **kwargs):
+    # Через __dict__, чтобы Restaurant.objects.only('name') не загружал адрес отдельным запросом
+    instance.saved_address = instance.__dict__.get('address')
+
+
+@receiver(post_save, sender=Restaurant)
+def geocode_restaurant(sender, instance, created, raw, **kwargs):
+    # Отложенный адрес не сохранялся, значит и не менялся
+    address = instance.__dict__.get('address')
+    address_changed = address is not None and address != instance.saved_address
+    instance.saved_address = address
+    # Фикстуры сохраняются в режиме raw, их адреса проверяем всегда
+    if not (created or raw or address_changed) or not instance.address:
+        return
+    place_is_actual = PlaceCoord.objects.filter(
+        pk=instance.place_id,
+        hash=get_address_hash(instance.address)
+    ).exists()
+    if not place_is_actual:
+        Restaurant.objects.filter(pk=instance.pk).enqueue_geocoding()
+
+
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+def reindex_restaurant(sender, instance, **kwargs):
+    update_indexed_restaurants([instance.pk])
+
+
+@receiver(post_init, sender=RestaurantMenuItem)
+def remember_menu_item(sender, instance, **kwargs):
+    instance.saved_restaurant_id = instance.__dict__.get('restaurant_id')
+    instance.saved_product_id = instance.__dict__.get('product_id')
+
+
+@receiver(post_save, sender=RestaurantMenuItem)
+def reindex_menu_item(sender, instance, created, **kwargs):
+    # В админке у пункта меню можно сменить ресторан или блюдо — прежнее снимаем с продажи
+    moved = (instance.saved_restaurant_id, instance.saved_product_id) != (instance.restaurant_id, instance.product_id)
+    if not created and moved:
+        update_indexed_menu_item(instance.saved_restaurant_id, instance.saved_product_id, False)
+    update_indexed_menu_item(instance.restaurant_id, instance.product_id, instance.availability)
+    instance.saved_restaurant_id = instance.restaurant_id
+    instance.saved_product_id = instance.product_id
+
+
+@receiver(post_delete, sender=RestaurantMenuItem)
+def unindex_menu_item(sender, instance, **kwargs):
+    update_indexed_menu_item(instance.restaurant_id, instance.product_id, False)
+
+
+# Удалённый заказ изменением не вернуть, а новое меню, место или название ресторана меняют строки многих заказов —
+# страница заказов в этих случаях перестраивается целиком
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+@receiver(post_save, sender=RestaurantMenuItem)
+@receiver(post_delete, sender=RestaurantMenuItem)
+@receiver(post_delete, sender=Order)
+def reset_dashboard(sender, **kwargs):
+    DashboardVersion.objects.bump(reset=True)
+
+
+@receiver(post_init, sender=Order)
+def remember_order_status(sender, instance, **kwargs):
+    # Через __dict__, чтобы не загружать отложенные поля отдельным запросом
+    instance.saved_status = instance.__dict__.get('status')
+    instance.saved_restaurant_id = instance.__dict__.get('restaurant_order_id', DEFERRED)
+    instance.saved_address = instance.__dict__.get('address')
+
+
+@receiver(post_save, sender=Order)
+def geocode_order(sender, instance, created, **kwargs):
+    address = instance.__dict__.get('address')
+    address_changed = address != instance.saved_address
+    instance.saved_address = address
+    # Новому заказу и заказу без места место подберёт фоновый обработчик, см. enqueue_stale_places
+    if created or not address_changed or not address or not instance.place_id:
+        return
+    place_is_actual = PlaceCoord.objects.filter(pk=instance.place_id, hash=get_address_hash(address)).exists()
+    if not place_is_actual:
+        Order.objects.filter(pk=instance.pk).enqueue_geocoding()
+
+
+@receiver(pre_save, sender=Order)
+@receiver(pre_delete, sender=Order)
+def load_saved_status(sender, instance, **kwargs):
+    # Заказ загружен без статуса или ресторана, например через only(): прежние значения читаем из базы,
+    # иначе счётчики очереди ресторанов сдвинулись бы не у того ресторана или не сдвинулись вовсе
+    if kwargs.get('raw') or instance.pk is None:
+        return
+    if instance.saved_status is not None and instance.saved_restaurant_id is not DEFERRED:
+        return
+    instance.saved_status, instance.saved_restaurant_id = (
+        Order.objects.filter(pk=instance.pk).values_list('status', 'restaurant_order_id').first() or (None, None)
+    )
+
+
+@receiver(pre_save, sender=Order)
+def mark_cooking_start(sender, instance, raw, **kwargs):
+    if not raw and instance.status == Order.Status.RESTAURANT and instance.saved_status != Order.Status.RESTAURANT:
+        instance.cooking_started_at = timezone.now()
+
+
+@receiver(post_save, sender=Order)
+def track_order_status(sender, instance, created, raw, **kwargs):
+    if created:
+        instance.saved_status = instance.saved_restaurant_id = None
+    if Order.Status.COURIER in {instance.status, instance.saved_status}:
+        invalidate_courier_batches()
+    update_queues(instance.saved_status, instance.saved_restaurant_id, instance.status, instance.restaurant_order_id)
+    cooked = (
+        not raw
+        and instance.saved_status == Order.Status.RESTAURANT
+        and instance.status == Order.Status.COURIER
+        and instance.cooking_started_at
+        and instance.restaurant_order_id
+    )
+    if cooked:
+        minutes = (timezone.now() - instance.cooking_started_at).total_seconds() / 60
+        learn_prep_time(instance.restaurant_order_id, minutes)
+    instance.saved_status = instance.status
+    instance.saved_restaurant_id = instance.restaurant_order_id
+
+
+@receiver(post_delete, sender=Order)
+def forget_order(sender, instance, **kwargs):
+    if Order.Status.COURIER == instance.saved_status:
+        invalidate_courier_batches()
+    update_queues(instance.saved_status, instance.saved_restaurant_id, None, None)
+
+
+@receiver(post_save, sender=OrderPosition)
+@receiver(post_delete, sender=OrderPosition)
+def recount_order_total(sender, instance, **kwargs):
+    Order.objects.filter(pk=instance.order_id).recount_totals()
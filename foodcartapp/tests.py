@@ -0,0 +1,791 @@
+import io
+import os
+import tempfile
+import unittest
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from calcdistances import geocoding
+from calcdistances.addresses import get_address_hash
+from calcdistances.distances import add_order_places, load_nearby_coordinates, prune_distances
+from calcdistances.models import GeocodeJob, PlaceCoord, RestaurantDistance
+from calcdistances.spatial import get_restaurant_index
+from foodcartapp import dispatch
+from foodcartapp.assignment import assign_orders, solve_assignment
+from foodcartapp.fulfilment import MAX_EXACT_PRODUCTS, solve_cover
+from foodcartapp.models import Order, OrderPosition, Product, Restaurant, RestaurantMenuItem
+from restaurateur.views import OrderFilter, dump_page_key, get_page_position
+
+# Запрос страницы заказов до переписывания на отдельные запросы без соединения заказов с позициями
+LEGACY_DASHBOARD_SQL = '''
+    select
+        fo.id, fo.id as order_id,
+        (array_agg(fo3.id))[1] as order_position_id,
+        array_remove(array_agg(fo3.product_id), NULL) as product_ids,
+        fo.restaurant_order_id,
+        rd.distance as dist,
+        SUM(fo3.quantity*fo3.price) as total_cost
+    FROM foodcartapp_order fo
+    LEFT JOIN foodcartapp_orderposition fo3 ON fo.id = fo3.order_id
+    LEFT JOIN foodcartapp_restaurant fr ON fr.id = fo.restaurant_order_id
+    LEFT JOIN calcdistances_placecoord cp ON cp.id = fo.place_id
+    LEFT JOIN calcdistances_restaurantdistance rd
+        ON rd.order_place_id = fo.place_id AND rd.restaurant_place_id = fr.place_id
+    WHERE fo.status != 'OK'
+    group by fo.id, fr.id, cp.id, rd.id
+    ORDER BY fo.called_at DESC, fo.id
+'''
+
+
+class RegisterOrderTest(TransactionTestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        cache_settings = override_settings(GEOCODE_CACHE_PATH=os.path.join(cache_dir.name, 'cache.sqlite3'))
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+
+        self.product = Product.objects.create(name='Бургер', price=100, image='burger.jpg')
+        self.order_data = {
+            'firstname': 'Иван',
+            'lastname': 'Петров',
+            'phonenumber': '+79291000000',
+            'address': 'Москва, ул. Тверская, 1',
+            'products': [{'product': self.product.pk, 'quantity': 2}],
+        }
+
+    def test_order_is_created_without_network_calls(self):
+        with mock.patch('requests.sessions.Session.request') as network_request:
+            response = APIClient().post('/api/order/', self.order_data, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        network_request.assert_not_called()
+        order = Order.objects.get(pk=response.data['id'])
+        self.assertEqual(response.data['public_id'], str(order.public_id))
+        self.assertIsNone(order.place)
+        self.assertEqual(order.positions.count(), 1)
+        self.assertEqual(order.total_cost, Decimal('200'))
+        self.assertTrue(
+            GeocodeJob.objects.filter(
+                target=GeocodeJob.Target.ORDER,
+                object_id=order.pk,
+                status=GeocodeJob.Status.NEW
+            ).exists()
+        )
+
+    def test_place_is_attached_later_outside_transaction(self):
+        response = APIClient().post('/api/order/', self.order_data, format='json')
+        in_atomic_block = []
+
+        def fake_fetch_coordinates(address):
+            in_atomic_block.append(connection.in_atomic_block)
+            return {'lng': 37.6, 'lat': 55.7, 'address': address}
+
+        with mock.patch.object(geocoding, 'fetch_coordinates', fake_fetch_coordinates):
+            geocoding.process_geocode_jobs()
+
+        self.assertEqual(in_atomic_block, [False])
+        order = Order.objects.get(pk=response.data['id'])
+        self.assertEqual(float(order.place.lat), 55.7)
+
+    def test_known_address_distances_are_calculated_by_worker(self):
+        index_patch = mock.patch('calcdistances.spatial._index', None)
+        index_patch.start()
+        self.addCleanup(index_patch.stop)
+        address = self.order_data['address']
+        place = PlaceCoord.objects.create(address=address, hash=get_address_hash(address), lat=55.76, lng=37.61)
+        restaurant_place = PlaceCoord.objects.create(
+            address='Москва, ул. Арбат, 1', hash=get_address_hash('Москва, ул. Арбат, 1'), lat=55.75, lng=37.6
+        )
+        Restaurant.objects.create(name='Центр', address=restaurant_place.address, place=restaurant_place)
+
+        response = APIClient().post('/api/order/', self.order_data, format='json')
+
+        self.assertEqual(Order.objects.get(pk=response.data['id']).place_id, place.pk)
+        self.assertFalse(RestaurantDistance.objects.exists())
+
+        with mock.patch.object(geocoding, 'fetch_coordinates') as fetch_coordinates:
+            geocoding.process_geocode_jobs()
+
+        fetch_coordinates.assert_not_called()
+        self.assertEqual(
+            list(RestaurantDistance.objects.values_list('order_place', 'restaurant_place')),
+            [(place.pk, restaurant_place.pk)]
+        )
+
+
+class GeocodeWorkerTest(TestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        cache_settings = override_settings(GEOCODE_CACHE_PATH=os.path.join(cache_dir.name, 'cache.sqlite3'))
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+
+        self.order = Order.objects.create(
+            firstname='Иван', lastname='Петров', phonenumber='+79291000000', address='Москва, ул. Тверская, 1'
+        )
+
+    def get_jobs(self):
+        return GeocodeJob.objects.filter(target=GeocodeJob.Target.ORDER, object_id=self.order.pk)
+
+    def test_unexpected_error_fails_job(self):
+        geocoding.enqueue_stale_places()
+
+        with mock.patch.object(geocoding, 'fetch_coordinates', side_effect=KeyError('response')), \
+                self.assertLogs('calcdistances.geocoding', 'ERROR'):
+            self.assertEqual(geocoding.process_geocode_jobs(), 0)
+
+        self.assertEqual(list(self.get_jobs().values_list('status', flat=True)), [GeocodeJob.Status.FAILED])
+
+    def test_address_collision_is_not_retried_at_once(self):
+        PlaceCoord.objects.create(address='Москва, ул. Арбат, 1', hash=get_address_hash(self.order.address))
+        geocoding.enqueue_stale_places()
+
+        with mock.patch.object(geocoding, 'fetch_coordinates') as fetch_coordinates, \
+                self.assertLogs('calcdistances.geocoding', 'ERROR'):
+            geocoding.process_geocode_jobs()
+
+        fetch_coordinates.assert_not_called()
+        self.assertEqual(list(self.get_jobs().values_list('status', flat=True)), [GeocodeJob.Status.FAILED])
+        self.assertIsNone(Order.objects.get(pk=self.order.pk).place)
+        self.assertEqual(geocoding.enqueue_stale_places(), 0)
+
+        GeocodeJob.objects.update(processed_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(geocoding.enqueue_stale_places(), 1)
+
+    def test_placed_orders_are_enqueued_only_on_address_change(self):
+        place = PlaceCoord.objects.create(address=self.order.address, hash=get_address_hash(self.order.address))
+        Order.objects.filter(pk=self.order.pk).update(place=place)
+        GeocodeJob.objects.all().delete()
+
+        self.assertEqual(geocoding.enqueue_stale_places(), 0)
+
+        order = Order.objects.only('address', 'place').get(pk=self.order.pk)
+        order.comment = 'Позвонить заранее'
+        order.save()
+        self.assertFalse(self.get_jobs().exists())
+
+        order.address = 'Москва, ул. Тверская, 2'
+        order.save()
+        self.assertEqual(list(self.get_jobs().values_list('address', flat=True)), ['Москва, ул. Тверская, 2'])
+
+
+@override_settings(ROUTING_GRAPH_PATH='', DELIVERY_RADIUS_KM=30, DASHBOARD_NEAREST_RESTAURANTS=5)
+class DashboardOrdersTest(TestCase):
+    def setUp(self):
+        # Индекс ресторанов живёт в памяти процесса, для каждого теста строим его заново
+        index_patch = mock.patch('calcdistances.spatial._index', None)
+        index_patch.start()
+        self.addCleanup(index_patch.stop)
+
+        self.burger = Product.objects.create(name='Бургер', price=100, image='burger.jpg')
+        self.fries = Product.objects.create(name='Картофель', price=50, image='fries.jpg')
+        self.center = Restaurant.objects.create(name='Центр', address='Тверская, 1', place=self.create_place(1, 55.75, 37.6))
+        self.north = Restaurant.objects.create(name='Север', address='Тверская, 2', place=self.create_place(2, 55.8, 37.6))
+        for restaurant, product in [(self.center, self.burger), (self.center, self.fries), (self.north, self.burger)]:
+            RestaurantMenuItem.objects.create(restaurant=restaurant, product=product)
+
+        now = timezone.now()
+        self.unassigned = self.create_order(3, called_at=now, positions=[(self.burger, 2), (self.fries, 1)])
+        self.assigned = self.create_order(
+            4, called_at=now - timedelta(hours=1), positions=[(self.burger, 1)],
+            restaurant_order=self.north, status=Order.Status.RESTAURANT,
+        )
+        self.empty = self.create_order(5, called_at=None, positions=[])
+        self.completed = self.create_order(
+            6, called_at=now, positions=[(self.burger, 1)], status=Order.Status.COMPLETED
+        )
+        RestaurantDistance.objects.create(
+            order_place=self.assigned.place, restaurant_place=self.north.place, distance=Decimal('5.56')
+        )
+
+    @staticmethod
+    def create_place(address_hash, lat, lng):
+        return PlaceCoord.objects.create(address=str(address_hash), hash=address_hash, lat=lat, lng=lng)
+
+    def create_order(self, address_hash, positions, **fields):
+        order = Order.objects.create(
+            firstname='Иван', lastname='Петров', phonenumber='+79291000000',
+            address=f'Адрес {address_hash}', place=self.create_place(address_hash, 55.751, 37.6), **fields
+        )
+        OrderPosition.objects.bulk_create([
+            OrderPosition(order=order, product=product, quantity=quantity, price=product.price)
+            for product, quantity in positions
+        ])
+        return order
+
+    def test_open_orders_in_call_order(self):
+        orders = Order.objects.get_data_orders()
+
+        self.assertEqual(list(orders), [self.empty.pk, self.unassigned.pk, self.assigned.pk])
+
+    def test_unassigned_order_gets_capable_restaurants(self):
+        order = Order.objects.get_data_orders()[self.unassigned.pk]
+
+        self.assertEqual(order['total_cost'], Decimal('250'))
+        self.assertFalse(order['prepare'])
+        self.assertEqual([restaurant['name'] for restaurant in order['restaurants']], ['Центр'])
+        self.assertEqual(order['restaurants'][0]['dist'], Decimal('0.11'))
+
+    def test_assigned_order_shows_stored_distance(self):
+        order = Order.objects.get_data_orders()[self.assigned.pk]
+
+        self.assertTrue(order['prepare'])
+        self.assertEqual(order['total_cost'], Decimal('100'))
+        self.assertEqual(order['restaurants'][0]['name'], 'Север')
+        self.assertEqual(order['restaurants'][0]['dist'], Decimal('5.56'))
+
+    def test_distances_of_completed_orders_are_pruned(self):
+        RestaurantDistance.objects.create(
+            order_place=self.completed.place, restaurant_place=self.center.place, distance=Decimal('0.11')
+        )
+
+        self.assertEqual(prune_distances(), 1)
+        self.assertEqual(
+            list(RestaurantDistance.objects.values_list('order_place', flat=True)), [self.assigned.place_id]
+        )
+
+    def test_nearby_places_are_loaded_around_each_order(self):
+        far_order = self.create_order(7, called_at=None, positions=[])
+        PlaceCoord.objects.filter(pk=far_order.place_id).update(lat=43.12, lng=131.9)
+        # Новосибирск лежит между Москвой и Владивостоком, но далеко от обоих
+        between = self.create_place(8, 55.03, 82.92)
+
+        (order_ids, _), (restaurant_ids, _) = load_nearby_coordinates(
+            [self.unassigned.place_id, far_order.place_id], [self.center.place_id, between.pk]
+        )
+
+        self.assertEqual(sorted(order_ids.tolist()), sorted([self.unassigned.place_id, far_order.place_id]))
+        self.assertEqual(restaurant_ids.tolist(), [self.center.place_id])
+
+    def test_assigned_orders_are_passed_to_restaurant(self):
+        self.assertEqual(assign_orders(), (1, 1))
+
+        order = Order.objects.get(pk=self.unassigned.pk)
+        self.assertEqual(order.restaurant_order, self.center)
+        self.assertEqual(order.status, Order.Status.RESTAURANT)
+        self.assertIsNotNone(order.cooking_started_at)
+        self.assertEqual(Restaurant.objects.get(pk=self.center.pk).queued_orders, 1)
+
+    def test_distances_are_saved_without_routing(self):
+        with mock.patch('calcdistances.distances.get_router') as get_router:
+            self.assertEqual(add_order_places([self.unassigned.place_id]), 2)
+        get_router.assert_not_called()
+
+    @override_settings(ROUTING_GRAPH_PATH='graph.csv', ETA_COURIER_SPEED_KMH=20)
+    def test_restaurants_without_route_are_ranked_by_straight_line(self):
+        RestaurantMenuItem.objects.create(restaurant=self.north, product=self.fries)
+        RestaurantDistance.objects.create(
+            order_place=self.unassigned.place, restaurant_place=self.north.place,
+            distance=Decimal('5.49'), route_distance=Decimal('6.10'), route_duration=12,
+        )
+
+        restaurants = Order.objects.get_data_orders()[self.unassigned.pk]['restaurants']
+
+        self.assertEqual([restaurant['name'] for restaurant in restaurants], ['Центр', 'Север'])
+        self.assertIsNone(restaurants[0]['duration'])
+        self.assertEqual(restaurants[1]['duration'], 12)
+
+    def test_zero_distance_is_shown(self):
+        PlaceCoord.objects.filter(pk=self.unassigned.place_id).update(lat=55.75, lng=37.6)
+        client = Client()
+        client.force_login(User.objects.create_user('manager', is_staff=True))
+
+        response = client.get('/manager/orders/')
+
+        self.assertContains(response, 'Центр - 0,00 км')
+
+    def test_order_without_positions(self):
+        order = Order.objects.get_data_orders()[self.empty.pk]
+
+        self.assertIsNone(order['order_position_id'])
+        self.assertEqual(order['total_cost'], Decimal('0'))
+        self.assertEqual(order['restaurants'], [])
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'прежний запрос работает только в PostgreSQL')
+    def test_matches_legacy_query(self):
+        # Прежний запрос даёт NULL вместо нулевой суммы пустого заказа
+        legacy = [
+            (order.order_id, bool(order.order_position_id), sorted(order.product_ids),
+             order.restaurant_order_id, order.dist, order.total_cost or Decimal('0'))
+            for order in Order.objects.raw(LEGACY_DASHBOARD_SQL)
+        ]
+        current = [
+            (order.order_id, bool(order.order_position_id), sorted(order.product_ids),
+             order.restaurant_order_id, order.dist, order.total_cost)
+            for order in Order.objects.get_dashboard_rows()
+        ]
+
+        self.assertEqual(current, legacy)
+
+
+class OrderTotalTest(TestCase):
+    def setUp(self):
+        self.burger = Product.objects.create(name='Бургер', price=100, image='burger.jpg')
+        self.fries = Product.objects.create(name='Картофель', price=50, image='fries.jpg')
+        self.order = Order.objects.create(
+            firstname='Иван', lastname='Петров', phonenumber='+79291000000', address='Тверская, 1'
+        )
+        self.position = OrderPosition.objects.create(order=self.order, product=self.burger, quantity=2, price=100)
+
+    def get_total(self):
+        return Order.objects.get(pk=self.order.pk).total_cost
+
+    def test_position_changes_update_total(self):
+        fries = OrderPosition.objects.create(order=self.order, product=self.fries, quantity=1, price=50)
+        self.assertEqual(self.get_total(), Decimal('250'))
+
+        self.position.quantity = 3
+        self.position.save()
+        self.assertEqual(self.get_total(), Decimal('350'))
+
+        fries.delete()
+        self.assertEqual(self.get_total(), Decimal('300'))
+
+    def test_bulk_operations_update_total(self):
+        other_order = Order.objects.create(
+            firstname='Пётр', lastname='Иванов', phonenumber='+79291000001', address='Тверская, 2'
+        )
+        OrderPosition.objects.bulk_create([OrderPosition(order=other_order, product=self.fries, quantity=4, price=50)])
+        self.assertEqual(Order.objects.get(pk=other_order.pk).total_cost, Decimal('200'))
+
+        OrderPosition.objects.filter(order=self.order).update(price=10)
+        self.assertEqual(self.get_total(), Decimal('20'))
+
+        self.position.order = other_order
+        OrderPosition.objects.bulk_update([self.position], ['order'])
+        self.assertEqual(self.get_total(), Decimal('0'))
+        self.assertEqual(Order.objects.get(pk=other_order.pk).total_cost, Decimal('220'))
+
+    def test_check_command_repairs_drift(self):
+        Order.objects.filter(pk=self.order.pk).update(total_cost=1)
+        output = io.StringIO()
+
+        call_command('check_order_totals', '--dry-run', stdout=output)
+        self.assertEqual(self.get_total(), Decimal('1'))
+        self.assertIn('Заказов с неверной суммой: 1', output.getvalue())
+
+        call_command('check_order_totals', stdout=io.StringIO())
+        self.assertEqual(self.get_total(), Decimal('200'))
+        self.assertFalse(Order.objects.with_wrong_totals().exists())
+
+
+class CapabilityIndexTest(TestCase):
+    def setUp(self):
+        index_patch = mock.patch('calcdistances.spatial._index', None)
+        index_patch.start()
+        self.addCleanup(index_patch.stop)
+
+        self.burger = Product.objects.create(name='Бургер', price=100, image='burger.jpg')
+        self.fries = Product.objects.create(name='Картофель', price=50, image='fries.jpg')
+        place = PlaceCoord.objects.create(address='Тверская, 1', hash=1, lat=55.75, lng=37.6)
+        self.center = Restaurant.objects.create(name='Центр', address='Тверская, 1', place=place)
+        self.north = Restaurant.objects.create(name='Север', address='Тверская, 2')
+        self.center_burger = RestaurantMenuItem.objects.create(restaurant=self.center, product=self.burger)
+        RestaurantMenuItem.objects.create(restaurant=self.center, product=self.fries)
+        RestaurantMenuItem.objects.create(restaurant=self.north, product=self.burger)
+        self.index = get_restaurant_index()
+
+    def test_capable_is_intersection_of_products(self):
+        self.assertEqual(self.index.capable([self.burger.pk]), [self.center.pk, self.north.pk])
+        self.assertEqual(self.index.capable([self.burger.pk, self.fries.pk]), [self.center.pk])
+        self.assertEqual(self.index.unplaced_capable([self.burger.pk]), [self.north.pk])
+        self.assertEqual([restaurant_id for restaurant_id, distance in self.index.nearest(55.75, 37.6)], [self.center.pk])
+
+    def test_menu_changes_update_index(self):
+        self.center_burger.availability = False
+        self.center_burger.save()
+        self.assertEqual(self.index.capable([self.burger.pk]), [self.north.pk])
+
+        cola = Product.objects.create(name='Кола', price=50, image='cola.jpg')
+        self.center_burger.product = cola
+        self.center_burger.availability = True
+        self.center_burger.save()
+        self.assertEqual(self.index.capable([self.burger.pk]), [self.north.pk])
+        self.assertEqual(self.index.capable([cola.pk]), [self.center.pk])
+
+        RestaurantMenuItem.objects.filter(restaurant=self.north).update(availability=False)
+        self.assertEqual(self.index.capable([self.burger.pk]), [])
+
+        RestaurantMenuItem.objects.filter(restaurant=self.center).delete()
+        self.assertEqual(self.index.capable(), [self.center.pk, self.north.pk])
+        self.assertEqual(self.index.capable([self.fries.pk]), [])
+
+
+class RestaurantSignalsTest(TestCase):
+    def setUp(self):
+        index_patch = mock.patch('calcdistances.spatial._index', None)
+        index_patch.start()
+        self.addCleanup(index_patch.stop)
+
+        for number in range(3):
+            Restaurant.objects.create(name=f'Ресторан {number}', address=f'Тверская, {number}')
+
+    def test_deferred_address_is_not_loaded(self):
+        with self.assertNumQueries(1):
+            names = [restaurant.name for restaurant in Restaurant.objects.only('name')]
+        self.assertEqual(len(names), 3)
+
+    def test_saving_without_address_does_not_geocode(self):
+        GeocodeJob.objects.all().delete()
+        restaurant = Restaurant.objects.only('name').first()
+        restaurant.name = 'Центр'
+        restaurant.save()
+        self.assertFalse(GeocodeJob.objects.exists())
+
+
+class OrderAdminTest(TestCase):
+    def setUp(self):
+        index_patch = mock.patch('calcdistances.spatial._index', None)
+        index_patch.start()
+        self.addCleanup(index_patch.stop)
+
+        def create_place(address, lat, lng):
+            return PlaceCoord.objects.create(address=address, hash=get_address_hash(address), lat=lat, lng=lng)
+
+        Restaurant.objects.create(name='Химки', address='Химки', place=create_place('Химки', 55.889, 37.445))
+        Restaurant.objects.create(name='Арбат', address='Арбат', place=create_place('Арбат', 55.75, 37.59))
+        Restaurant.objects.create(name='Без адреса')
+        self.order = Order.objects.create(
+            firstname='Иван', lastname='Петров', phonenumber='+79291000000', address='Кремль',
+            place=create_place('Кремль', 55.752, 37.617),
+        )
+        self.client.force_login(User.objects.create_superuser('admin'))
+
+    def test_restaurants_are_listed_nearest_first(self):
+        form = self.client.get(f'/admin/foodcartapp/order/{self.order.pk}/change/').context['adminform'].form
+
+        self.assertEqual(
+            [restaurant.name for restaurant in form.fields['restaurant_order'].queryset],
+            ['Арбат', 'Химки', 'Без адреса'],
+        )
+
+
+class SolveAssignmentTest(SimpleTestCase):
+    def test_respects_capacities(self):
+        candidates = {
+            1: [('near', 1.0), ('far', 5.0)],
+            2: [('near', 1.5), ('far', 3.0)],
+            3: [('near', 2.0), ('far', 9.0)],
+        }
+
+        assignment = solve_assignment(candidates, {'near': 2, 'far': 5})
+
+        self.assertEqual(assignment, {1: 'near', 2: 'far', 3: 'near'})
+
+    def test_moves_assigned_orders_to_fit_more(self):
+        candidates = {1: [('a', 1.0), ('b', 2.0)], 2: [('a', 1.5)]}
+
+        self.assertEqual(solve_assignment(candidates, {'a': 1, 'b': 1}), {1: 'b', 2: 'a'})
+
+    def test_moves_orders_along_shortest_chain(self):
+        # Обход в ширину пересадил бы первый заказ в "b" за 10 км, хотя цепочка через "c" короче
+        candidates = {
+            1: [('a', 1.0), ('c', 2.0), ('b', 10.0)],
+            2: [('a', 1.1)],
+            3: [('c', 1.0), ('b', 1.5)],
+        }
+
+        assignment = solve_assignment(candidates, {'a': 1, 'b': 1, 'c': 1})
+
+        self.assertEqual(assignment, {1: 'c', 2: 'a', 3: 'b'})
+
+    def test_orders_without_free_restaurant_stay_unassigned(self):
+        candidates = {1: [('a', 1.0)], 2: [('a', 2.0)], 3: []}
+
+        self.assertEqual(solve_assignment(candidates, {'a': 1}), {1: 'a'})
+
+
+class SolveCoverTest(SimpleTestCase):
+    def test_finds_cheapest_cover(self):
+        options = {1: (1.0, {'бургер'}), 2: (1.0, {'картофель'}), 3: (3.0, {'бургер', 'картофель'})}
+
+        self.assertEqual(solve_cover(['бургер', 'картофель'], options), [(1, ['бургер']), (2, ['картофель'])])
+
+    def test_products_go_to_nearest_restaurant_of_cover(self):
+        options = {
+            1: (1.0, {'бургер', 'картофель'}),
+            2: (0.5, {'бургер', 'кола'}),
+            3: (0.5, {'бургер', 'кола'}),
+        }
+
+        plan = solve_cover(['бургер', 'картофель', 'кола'], options)
+
+        self.assertEqual(plan, [(2, ['бургер', 'кола']), (1, ['картофель'])])
+
+    def test_no_cover(self):
+        self.assertIsNone(solve_cover(['бургер', 'кола'], {1: (1.0, {'бургер'})}))
+        self.assertEqual(solve_cover([], {}), [])
+
+    def test_large_orders_are_covered_greedily(self):
+        products = list(range(MAX_EXACT_PRODUCTS + 4))
+        options = {1: (5.0, set(products)), 2: (1.0, set(products[:2]))}
+
+        with mock.patch('foodcartapp.fulfilment.solve_cover_exactly') as solve_cover_exactly:
+            plan = solve_cover(products, options)
+
+        solve_cover_exactly.assert_not_called()
+        self.assertEqual(sorted(product for restaurant_id, parts in plan for product in parts), products)
+
+
+class CourierBatchesTest(SimpleTestCase):
+    restaurant = (55.75, 37.6)
+
+    def test_clusters_follow_chains_of_neighbours(self):
+        stops = [(1, (55.75, 37.6)), (2, (55.759, 37.6)), (3, (55.768, 37.6)), (4, (55.85, 37.6))]
+
+        clusters = dispatch.cluster_stops(stops, radius_km=1.5)
+
+        self.assertEqual(
+            sorted(sorted(order_id for order_id, coords in cluster) for cluster in clusters), [[1, 2, 3], [4]]
+        )
+
+    def test_route_visits_nearest_stops_first(self):
+        stops = [(3, (55.78, 37.6)), (1, (55.76, 37.6)), (2, (55.77, 37.6))]
+
+        route, km = dispatch.plan_route(self.restaurant, stops)
+
+        self.assertEqual([order_id for order_id, coords in route], [1, 2, 3])
+        self.assertAlmostEqual(km, 3.34, places=2)
+
+    def test_large_cluster_is_split_before_routing(self):
+        # Десять адресов по кругу в 500 м от ресторана — одно скопление
+        offsets = [(0.0045, 0), (0.0032, 0.0051), (0, 0.0072), (-0.0032, 0.0051), (-0.0045, 0),
+                   (-0.0032, -0.0051), (0, -0.0072), (0.0032, -0.0051), (0.0044, -0.0015), (0.0044, 0.0015)]
+        orders = [
+            (order_id, 7, self.restaurant, (self.restaurant[0] + delta_lat, self.restaurant[1] + delta_lng))
+            for order_id, (delta_lat, delta_lng) in enumerate(offsets)
+        ]
+
+        with mock.patch.object(dispatch, 'plan_route', wraps=dispatch.plan_route) as plan_route:
+            batches = dispatch.build_batches(orders, radius_km=1.5, batch_size=4)
+
+        self.assertEqual(sorted(len(batch.order_ids) for batch in batches), [2, 4, 4])
+        self.assertEqual(sorted(order_id for batch in batches for order_id in batch.order_ids), list(range(10)))
+        self.assertTrue(all(len(call.args[1]) <= 4 for call in plan_route.call_args_list))
+
+
+@override_settings(ROUTING_GRAPH_PATH='', DASHBOARD_PAGE_SIZE=2)
+class DashboardPagesTest(TestCase):
+    def setUp(self):
+        index_patch = mock.patch('calcdistances.spatial._index', None)
+        index_patch.start()
+        self.addCleanup(index_patch.stop)
+
+        self.restaurant = Restaurant.objects.create(name='Центр', address='Тверская, 1')
+        now = timezone.now()
+        called = [None, None, now, now, now - timedelta(hours=1)]
+        self.orders = [
+            Order.objects.create(
+                firstname='Иван', lastname='Петров', phonenumber='+79291000000', address=f'Адрес {number}',
+                called_at=called_at,
+            )
+            for number, called_at in enumerate(called)
+        ]
+        Order.objects.create(
+            firstname='Иван', lastname='Петров', phonenumber='+79291000000', address='Выполнен',
+            status=Order.Status.COMPLETED,
+        )
+
+    def test_pages_follow_dashboard_order(self):
+        expected = list(Order.objects.get_data_orders())
+        seen = []
+        after = None
+        while True:
+            keys = Order.objects.get_page_keys(2, after)
+            seen += [order_id for called_at, order_id in keys[:2]]
+            if len(keys) <= 2:
+                break
+            after = keys[1]
+
+        self.assertEqual(seen, expected)
+
+    def test_view_filters_and_links_next_page(self):
+        Order.objects.filter(pk__in=[self.orders[1].pk, self.orders[3].pk, self.orders[4].pk]).update(
+            restaurant_order=self.restaurant
+        )
+        manager = User.objects.create_user('manager', is_staff=True)
+        client = Client()
+        client.force_login(manager)
+
+        first_page = client.get('/manager/orders/', {'restaurant_order': self.restaurant.pk})
+        self.assertEqual(list(first_page.context['order_items']), [self.orders[1].pk, self.orders[3].pk])
+
+        second_page = client.get(f"/manager/orders/{first_page.context['next_page_url']}")
+        self.assertEqual(list(second_page.context['order_items']), [self.orders[4].pk])
+        self.assertIsNone(second_page.context['next_page_url'])
+
+    def test_restaurant_filter_renders_in_one_query(self):
+        for number in range(3):
+            Restaurant.objects.create(name=f'Ресторан {number}', address=f'Арбат, {number}')
+
+        with self.assertNumQueries(1):
+            rendered = str(OrderFilter()['restaurant_order'])
+        self.assertIn('Ресторан 2', rendered)
+
+
+@override_settings(ROUTING_GRAPH_PATH='', ETA_PREP_LEARNING_RATE=0.1)
+class OrderQueueTest(TestCase):
+    def setUp(self):
+        index_patch = mock.patch('calcdistances.spatial._index', None)
+        index_patch.start()
+        self.addCleanup(index_patch.stop)
+
+        self.center = Restaurant.objects.create(name='Центр', address='Тверская, 1')
+        self.north = Restaurant.objects.create(name='Север', address='Тверская, 2')
+        self.order = Order.objects.create(
+            firstname='Иван', lastname='Петров', phonenumber='+79291000000', address='Арбат, 1',
+            restaurant_order=self.center,
+        )
+
+    def get_queues(self):
+        return dict(Restaurant.objects.values_list('name', 'queued_orders'))
+
+    def test_queue_follows_status_and_restaurant(self):
+        self.assertEqual(self.get_queues(), {'Центр': 1, 'Север': 0})
+
+        self.order.restaurant_order = self.north
+        self.order.status = Order.Status.RESTAURANT
+        self.order.save()
+        self.assertEqual(self.get_queues(), {'Центр': 0, 'Север': 1})
+
+        self.order.status = Order.Status.COURIER
+        self.order.save()
+        self.assertEqual(self.get_queues(), {'Центр': 0, 'Север': 0})
+
+    def test_deferred_order_keeps_queues_in_sync(self):
+        order = Order.objects.only('comment').get(pk=self.order.pk)
+        order.restaurant_order = self.north
+        order.save()
+        self.assertEqual(self.get_queues(), {'Центр': 0, 'Север': 1})
+
+        Order.objects.only('comment').get(pk=self.order.pk).delete()
+        self.assertEqual(self.get_queues(), {'Центр': 0, 'Север': 0})
+
+    def test_prep_time_is_learned_from_cooked_orders(self):
+        self.order.status = Order.Status.RESTAURANT
+        self.order.save()
+        for minutes, expected in [(30, 30), (20, 29)]:
+            Order.objects.filter(pk=self.order.pk).update(
+                status=Order.Status.RESTAURANT, cooking_started_at=timezone.now() - timedelta(minutes=minutes)
+            )
+            order = Order.objects.get(pk=self.order.pk)
+            order.status = Order.Status.COURIER
+            order.save()
+            self.assertAlmostEqual(Restaurant.objects.get(pk=self.center.pk).prep_minutes, expected, places=1)
+
+    def test_eta_is_found_by_public_id_only(self):
+        client = APIClient()
+
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual(client.get(f'/api/order/{self.order.pk}/eta/').status_code, 404)
+        response = client.get(f'/api/order/{self.order.public_id}/eta/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['order'], self.order.pk)
+
+
+@override_settings(ROUTING_GRAPH_PATH='')
+class OrderChangesTest(TestCase):
+    def setUp(self):
+        index_patch = mock.patch('calcdistances.spatial._index', None)
+        index_patch.start()
+        self.addCleanup(index_patch.stop)
+
+        self.client = Client()
+        self.client.force_login(User.objects.create_user('manager', is_staff=True))
+        self.burger = Product.objects.create(name='Бургер', price=100, image='burger.jpg')
+        self.order = Order.objects.create(
+            firstname='Иван', lastname='Петров', phonenumber='+79291000000', address='Тверская, 1'
+        )
+        self.version = self.client.get('/manager/orders/').context['version']
+
+    def get_changes(self, **params):
+        return self.client.get('/manager/orders/changes/', {'since': self.version, **params}).json()
+
+    def test_nothing_changed(self):
+        self.assertEqual(self.get_changes(), {'version': self.version, 'reset': False, 'orders': [], 'removed': []})
+
+    def test_changed_orders_are_returned_once(self):
+        OrderPosition.objects.create(order=self.order, product=self.burger, quantity=1, price=100)
+
+        changes = self.get_changes()
+        self.assertGreater(changes['version'], self.version)
+        self.assertEqual([order['id'] for order in changes['orders']], [self.order.pk])
+        self.assertIn(f'id="order-{self.order.pk}"', changes['orders'][0]['html'])
+
+        self.version = changes['version']
+        self.assertEqual(self.get_changes()['orders'], [])
+
+    def test_completed_and_filtered_out_orders_are_removed(self):
+        Order.objects.filter(pk=self.order.pk).update(payment_method=Order.PaymentMethod.CASH)
+        self.assertEqual(self.get_changes(payment_method=Order.PaymentMethod.REMOTE)['removed'], [self.order.pk])
+
+        self.order.status = Order.Status.COMPLETED
+        self.order.save()
+        self.assertEqual(self.get_changes()['removed'], [self.order.pk])
+
+    def test_menu_change_resets_page(self):
+        restaurant = Restaurant.objects.create(name='Центр', address='Тверская, 1')
+        self.version = self.get_changes()['version']
+        RestaurantMenuItem.objects.create(restaurant=restaurant, product=self.burger)
+
+        self.assertTrue(self.get_changes()['reset'])
+
+    def test_restaurant_changes_reset_page(self):
+        place = PlaceCoord.objects.create(address='Тверская, 1', hash=get_address_hash('Тверская, 1'))
+        restaurant = Restaurant.objects.create(name='Центр', address='Тверская, 1', place=place)
+        self.assertTrue(self.get_changes()['reset'])
+
+        self.version = self.get_changes()['version']
+        place.set_coordinates({'lat': 55.75, 'lng': 37.6})
+        place.save()
+        self.assertTrue(self.get_changes()['reset'])
+
+        self.version = self.get_changes()['version']
+        restaurant.delete()
+        self.assertTrue(self.get_changes()['reset'])
+
+    @mock.patch('restaurateur.views.time')
+    def test_waits_only_when_enabled(self, views_time):
+        clock = [0]
+        views_time.monotonic.side_effect = lambda: clock[0]
+        views_time.sleep.side_effect = lambda seconds: clock.__setitem__(0, clock[0] + seconds)
+
+        self.get_changes(wait=1)
+        views_time.sleep.assert_not_called()
+
+        with override_settings(LIVE_ORDERS_WAIT_SECONDS=3, LIVE_ORDERS_POLL_SECONDS=2):
+            self.assertEqual(self.get_changes(wait=1)['orders'], [])
+        self.assertEqual([call.args for call in views_time.sleep.call_args_list], [(2,), (1,)])
+
+    def test_orders_outside_page_are_removed(self):
+        called_at = timezone.now()
+        first, last, later = [
+            Order.objects.create(
+                firstname='Иван', lastname='Петров', phonenumber='+79291000000', address='Тверская, 1',
+                called_at=called_at - timedelta(minutes=minutes),
+            )
+            for minutes in (1, 2, 3)
+        ]
+        with override_settings(DASHBOARD_PAGE_SIZE=2):
+            page = self.client.get('/manager/orders/')
+        self.assertEqual(list(page.context['order_items']), [self.order.pk, first.pk])
+        self.assertEqual(page.context['last_key'], dump_page_key(first.called_at, first.pk))
+        self.version = page.context['version']
+
+        Order.objects.filter(pk__in=[first.pk, later.pk]).update(comment='Позвонить')
+        Order.objects.filter(pk=last.pk).update(called_at=called_at)
+        changes = self.get_changes(last=page.context['last_key'])
+        positions = {order['id']: order['position'] for order in changes['orders']}
+        self.assertEqual(sorted(positions), [first.pk, last.pk])
+        self.assertLess(positions[last.pk], positions[first.pk])
+        self.assertEqual(changes['removed'], [later.pk])
@@ -1,11 +1,13 @@
-import xxhash
-from django.conf import settings
 from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
 from django.templatetags.static import static
 from rest_framework.response import Response
 
-from calcdistances.models import PlaceCoord
-from calcdistances.views import fetch_coordinates
+from calcdistances.cache import find_place
+from calcdistances.geocoder import geocode_locally
+from calcdistances.geocoding import create_place, enqueue_geocode_job
+from calcdistances.models import GeocodeJob
+from foodcartapp.eta import get_order_eta
 from foodcartapp.models import Product, Order, OrderPosition
 from rest_framework.decorators import api_view
 from rest_framework import status
@@ -18,7 +20,7 @@ class OrderSerializer(ModelSerializer):
 
     class Meta:
         model = Order
-        fields = ['id', 'firstname', 'lastname', 'address', 'phonenumber', 'products']
+        fields = ['id', 'public_id', 'firstname', 'lastname', 'address', 'phonenumber', 'products']
 
 
 class OrderPositionSerializer(ModelSerializer):
@@ -92,34 +94,55 @@ def register_order(request):
         product_serializer = OrderPositionSerializer(data=product)
         product_serializer.is_valid(raise_exception=True)
 
-    order = Order.objects.create(
-        phonenumber=order_data['phonenumber'],
-        address=order_data['address'],
-        firstname=order_data['firstname'],
-        lastname=order_data['lastname'],
-    )
-
-    hash_order = xxhash.xxh32(order_data['address'].encode()).intdigest()
-    order_place, created = PlaceCoord.objects.get_or_create(
-        hash=hash_order,
-        defaults=fetch_coordinates(apikey=settings.GEO_TOKEN, address=order_data['address'])
-    )
-    order.place = order_place
-    order.save()
-
     positions = []
     for position in order_data['products']:
         product = Product.objects.get(pk=position['product'])
         positions.append(
             OrderPosition(
-                order=order,
                 product=product,
                 price=product.price,
                 quantity=position['quantity']
             )
         )
 
-    OrderPosition.objects.bulk_create(positions)
+    # Внешний геокодер не вызываем: известный адрес привязываем сразу,
+    # ищем в локальном справочнике, а не найденный там ставим в очередь
+    address = order_data['address']
+    place_id = None
+    order_place = find_place(address)
+    if order_place:
+        place_id = order_place.place_id
+    elif coords := geocode_locally(address):
+        place_id = create_place(address, coords).pk
+
+    order = Order.objects.create(
+        phonenumber=order_data['phonenumber'],
+        address=address,
+        firstname=order_data['firstname'],
+        lastname=order_data['lastname'],
+        total_cost=sum(position.price * position.quantity for position in positions),
+        place_id=place_id,
+    )
+    # Расстояния до ресторанов досчитает обработчик очереди, а не транзакция оформления заказа
+    enqueue_geocode_job(GeocodeJob.Target.ORDER, order.pk, order.address)
+
+    for position in positions:
+        position.order = order
+    # Сумма заказа уже посчитана по этим же позициям
+    OrderPosition.objects.bulk_create(positions, recount_totals=False)
     out_serializer = OrderSerializer(instance=order)
 
     return Response(out_serializer.data, status=status.HTTP_201_CREATED)
+
+
+@api_view(['GET'])
+def order_eta(request, public_id):
+    # Заказ ищем по uuid, который знает только оформивший его клиент, а не по перебираемому id
+    order = get_object_or_404(Order.objects.select_related('restaurant_order'), public_id=public_id)
+    minutes, delivery_at = get_order_eta(order)
+    return Response({
+        'order': order.pk,
+        'status': order.status,
+        'eta_minutes': minutes,
+        'delivery_at': delivery_at,
+    })
@@ -1,14 +1,24 @@
+import time
+from datetime import datetime, timedelta, timezone
+
 from django import forms
+from django.conf import settings
+from django.contrib import messages
+from django.http import JsonResponse
 from django.shortcuts import redirect, render
+from django.template.loader import render_to_string
 from django.views import View
+from django.views.decorators.http import require_POST
 from django.urls import reverse_lazy
+from django.utils.dateparse import parse_datetime
 from django.contrib.auth.decorators import user_passes_test
 
 from django.contrib.auth import authenticate, login
 from django.contrib.auth import views as auth_views
 
-from calcdistances.views import update_all_order_place_ids
-from foodcartapp.models import Product, Restaurant, Order
+from foodcartapp.assignment import assign_orders
+from foodcartapp.dispatch import get_courier_batches
+from foodcartapp.models import DashboardVersion, Order, Product, Restaurant
 
 
 class Login(forms.Form):
@@ -28,6 +38,66 @@ class Login(forms.Form):
     )
 
 
+class OrderFilter(forms.Form):
+    status = forms.ChoiceField(
+        label='Статус', required=False,
+        choices=[('', 'Все незавершённые')] + [
+            (value, label) for value, label in Order.Status.choices if value != Order.Status.COMPLETED
+        ],
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    payment_method = forms.ChoiceField(
+        label='Способ оплаты', required=False,
+        choices=[('', 'Любой')] + Order.PaymentMethod.choices,
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    restaurant_order = forms.ModelChoiceField(
+        label='Ресторан', required=False,
+        queryset=Restaurant.objects.order_by('name').only('name'),
+        empty_label='Любой',
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+
+
+def dump_page_key(called_at, order_id):
+    if called_at is None:
+        return str(order_id)
+    return f'{order_id}_{called_at.isoformat()}'
+
+
+def load_page_key(value):
+    """Ключ (время звонка, id) последнего заказа предыдущей страницы или None для первой страницы."""
+    order_id, _, called_at = value.partition('_')
+    if not order_id.isdigit():
+        return None
+    if not called_at:
+        return None, int(order_id)
+    called_at = parse_datetime(called_at)
+    if called_at is None:
+        return None
+    return called_at, int(order_id)
+
+
+PAGE_POSITION_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def get_page_position(called_at, order_id):
+    """Строка, по которой заказы сравниваются как строки в порядке страницы.
+
+    Сначала заказы без звонка по id, затем по убыванию времени звонка и по id — как в Order.get_page_keys.
+    """
+    if called_at is None:
+        return f'0:{order_id:020d}'
+    microseconds = (called_at - PAGE_POSITION_EPOCH) // timedelta(microseconds=1)
+    return f'1:{10 ** 19 - microseconds:020d}:{order_id:020d}'
+
+
+def add_page_positions(order_items):
+    for item in order_items.values():
+        item['page_position'] = get_page_position(item['called_at'], item['pk'])
+    return order_items
+
+
 class LoginView(View):
     def get(self, request, *args, **kwargs):
         form = Login()
@@ -90,12 +160,135 @@ def view_restaurants(request):
     })
 
 
+def filter_orders(params):
+    order_filter = OrderFilter(params)
+    orders = Order.objects.all()
+    if order_filter.is_valid():
+        orders = orders.filter(**{field: value for field, value in order_filter.cleaned_data.items() if value})
+    return order_filter, orders
+
+
 @user_passes_test(is_manager, login_url='restaurateur:login')
 def view_orders(request):
-    order_items = Order.objects.get_data_orders()
-    if update_all_order_place_ids(order_items):
-        order_items = Order.objects.get_data_orders()
+    # Версию читаем до заказов: изменения, сделанные после, страница получит следующим запросом изменений
+    version, reset_version = DashboardVersion.objects.get_versions()
+    order_filter, orders = filter_orders(request.GET)
+
+    page_size = settings.DASHBOARD_PAGE_SIZE
+    after = load_page_key(request.GET.get('after', ''))
+    keys = orders.get_page_keys(page_size, after)
+    page_keys = keys[:page_size]
+    order_items = add_page_positions(
+        Order.objects.filter(pk__in=[order_id for called_at, order_id in page_keys]).get_data_orders()
+    )
+
+    params = request.GET.copy()
+    params.pop('after', None)
+    first_page_url = f'?{params.urlencode()}' if after else None
+    next_page_url = None
+    last_key = ''
+    if len(keys) > page_size:
+        last_key = dump_page_key(*page_keys[-1])
+        params['after'] = last_key
+        next_page_url = f'?{params.urlencode()}'
     return render(request,
                   template_name='order_items.html',
-                  context={'order_items': order_items}
-                  )
+                  context={
+                      'order_items': order_items,
+                      'order_filter': order_filter,
+                      'first_page_url': first_page_url,
+                      'next_page_url': next_page_url,
+                      'version': version,
+                      'page_size': page_size,
+                      'last_key': last_key,
+                      'live_orders_wait': settings.LIVE_ORDERS_WAIT_SECONDS > 0,
+                      'live_orders_poll_ms': int(settings.LIVE_ORDERS_POLL_SECONDS * 1000),
+                  })
+
+
+def get_order_changes(since):
+    """(версия для следующего запроса, id заказов с версиями от since, нужно ли перестроить страницу)."""
+    version, reset_version = DashboardVersion.objects.get_versions()
+    changed_ids = list(
+        Order.objects.filter(version__gte=since).values_list('pk', flat=True)[:settings.DASHBOARD_PAGE_SIZE + 1]
+    )
+    reset = reset_version >= since or len(changed_ids) > settings.DASHBOARD_PAGE_SIZE
+    return version, changed_ids, reset
+
+
+@user_passes_test(is_manager, login_url='restaurateur:login')
+def view_order_changes(request):
+    """Заказы, изменившиеся начиная с версии since, — строки таблицы заказов для подмены на странице.
+
+    Отвечает сразу, страница сама опрашивает изменения раз в LIVE_ORDERS_POLL_SECONDS. Ждать изменений
+    можно только если это включено настройкой: с wait=1 запрос ждёт не дольше LIVE_ORDERS_WAIT_SECONDS.
+    Версии идут с пропусками, а одно изменение может прийти дважды — строка на странице просто заменится.
+    В orders только заказы между ключами страницы after и last, остальные изменившиеся — в removed.
+    Если изменилось меню или рестораны, удалён заказ или изменений больше страницы, отвечает reset.
+    """
+    since = request.GET.get('since', '')
+    if not since.isdigit():
+        return JsonResponse({'error': 'since должен быть номером версии'}, status=400)
+    since = int(since)
+    wait_seconds = settings.LIVE_ORDERS_WAIT_SECONDS if request.GET.get('wait') == '1' else 0
+    deadline = time.monotonic() + wait_seconds
+    version, changed_ids, reset = get_order_changes(since)
+    while not changed_ids and not reset and time.monotonic() < deadline:
+        time.sleep(min(settings.LIVE_ORDERS_POLL_SECONDS, max(0, deadline - time.monotonic())))
+        version, changed_ids, reset = get_order_changes(since)
+    if reset:
+        return JsonResponse({'version': version, 'reset': True})
+
+    after = load_page_key(request.GET.get('after', ''))
+    last = load_page_key(request.GET.get('last', ''))
+    first_position = get_page_position(*after) if after else ''
+    last_position = get_page_position(*last) if last else None
+    order_filter, orders = filter_orders(request.GET)
+    order_items = add_page_positions(orders.filter(pk__in=changed_ids).get_data_orders()) if changed_ids else {}
+    # Заказы, которые после изменения стоят на других страницах, отсюда убираем
+    page_items = {
+        order_id: item
+        for order_id, item in order_items.items()
+        if item['page_position'] > first_position and (last_position is None or item['page_position'] <= last_position)
+    }
+    return JsonResponse({
+        'version': version,
+        'reset': False,
+        'orders': [
+            {
+                'id': order_id,
+                'position': item['page_position'],
+                'html': render_to_string('order_row.html', {'item': item}, request=request),
+            }
+            for order_id, item in page_items.items()
+        ],
+        # Выполненные, переставшие подходить под фильтры и ушедшие на другие страницы заказы убираем со страницы
+        'removed': [order_id for order_id in changed_ids if order_id not in page_items],
+    })
+
+
+@require_POST
+@user_passes_test(is_manager, login_url='restaurateur:login')
+def assign_restaurants(request):
+    assigned, unassigned = assign_orders()
+    messages.info(request, f'Назначено заказов: {assigned}, без ресторана осталось: {unassigned}')
+    return redirect('restaurateur:view_orders')
+
+
+@user_passes_test(is_manager, login_url='restaurateur:login')
+def view_courier_batches(request):
+    batches = get_courier_batches()
+    orders = Order.objects.only('address').in_bulk(
+        [order_id for batch in batches for order_id in batch.order_ids]
+    )
+    restaurants = Restaurant.objects.only('name').in_bulk({batch.restaurant_id for batch in batches})
+    return render(request, template_name='courier_batches.html', context={
+        'batches': [
+            {
+                'restaurant': restaurants.get(batch.restaurant_id),
+                'orders': [orders[order_id] for order_id in batch.order_ids if order_id in orders],
+                'km': round(batch.km, 2),
+            }
+            for batch in batches
+        ],
+    })
@@ -11,6 +11,44 @@ YANDEX_GEO_TOKEN = env('YANDEX_GEO_TOKEN')
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+GEOCODER_BACKEND = env('GEOCODER_BACKEND', 'yandex')
+GEOCODER_FIXTURE_PATH = env(
+    'GEOCODER_FIXTURE_PATH',
+    os.path.join(BASE_DIR, 'calcdistances', 'data', 'geocoder_places.json')
+)
+GEOCODER_CONNECT_TIMEOUT = env.float('GEOCODER_CONNECT_TIMEOUT', 3.05)
+GEOCODER_READ_TIMEOUT = env.float('GEOCODER_READ_TIMEOUT', 10)
+GEOCODER_RETRIES = env.int('GEOCODER_RETRIES', 2)
+GEOCODER_RATE_LIMIT = env.float('GEOCODER_RATE_LIMIT', 10)
+GEOCODER_GAZETTEER_PATH = env('GEOCODER_GAZETTEER_PATH', '')
+
+DATA_DIR = env('DATA_DIR', os.path.join(BASE_DIR, 'data'))
+GEOCODE_CACHE_PATH = env('GEOCODE_CACHE_PATH', os.path.join(DATA_DIR, 'geocode_cache.sqlite3'))
+GEOCODE_CACHE_SIZE = env.int('GEOCODE_CACHE_SIZE', 10000)
+
+GEOCODE_TTL_DAYS = env.int('GEOCODE_TTL_DAYS', 30)
+GEOCODE_RETRY_BACKOFF_MINUTES = env.int('GEOCODE_RETRY_BACKOFF_MINUTES', 10)
+GEOCODE_RETRY_MAX_BACKOFF_MINUTES = env.int('GEOCODE_RETRY_MAX_BACKOFF_MINUTES', 7 * 24 * 60)
+GEOCODE_USE_POSTGIS = env.bool('GEOCODE_USE_POSTGIS', True)
+
+DELIVERY_RADIUS_KM = env.float('DELIVERY_RADIUS_KM', 30)
+RESTAURANT_INDEX_TTL = env.int('RESTAURANT_INDEX_TTL', 60)
+RESTAURANT_INDEX_CELL_KM = env.float('RESTAURANT_INDEX_CELL_KM', 2)
+DASHBOARD_NEAREST_RESTAURANTS = env.int('DASHBOARD_NEAREST_RESTAURANTS', 5)
+DASHBOARD_PAGE_SIZE = env.int('DASHBOARD_PAGE_SIZE', 50)
+LIVE_ORDERS_WAIT_SECONDS = env.float('LIVE_ORDERS_WAIT_SECONDS', 0)
+LIVE_ORDERS_POLL_SECONDS = env.float('LIVE_ORDERS_POLL_SECONDS', 5)
+ASSIGNMENT_CANDIDATES = env.int('ASSIGNMENT_CANDIDATES', 10)
+COURIER_BATCH_RADIUS_KM = env.float('COURIER_BATCH_RADIUS_KM', 1.5)
+COURIER_BATCH_SIZE = env.int('COURIER_BATCH_SIZE', 4)
+COURIER_BATCHES_TTL = env.int('COURIER_BATCHES_TTL', 60)
+ETA_COURIER_SPEED_KMH = env.float('ETA_COURIER_SPEED_KMH', 20)
+ETA_DEFAULT_PREP_MINUTES = env.float('ETA_DEFAULT_PREP_MINUTES', 20)
+ETA_PREP_LEARNING_RATE = env.float('ETA_PREP_LEARNING_RATE', 0.1)
+
+ROUTING_GRAPH_PATH = env('ROUTING_GRAPH_PATH', '')
+ROUTING_CACHE_SIZE = env.int('ROUTING_CACHE_SIZE', 100000)
+
 
 SECRET_KEY = env('SECRET_KEY')
 DEBUG = env.bool('DEBUG', True)